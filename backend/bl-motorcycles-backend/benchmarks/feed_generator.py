@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Synthetic Bike It feed generator for the sync benchmarks
+Writes CSV feeds of any size using the header variants, price formats and
+data quality problems seen in real supplier feeds.
+"""
+
+import os
+import sys
+import argparse
+import csv
+import random
+
+# Header variants, one column name per product field
+# (sku, name, description, category, cost_price, stock_quantity, image_url)
+HEADER_VARIANTS = {
+    'standard': ('SKU', 'Name', 'Description', 'Category', 'Price', 'Stock', 'Image'),
+    'lowercase': ('sku', 'name', 'description', 'category', 'price', 'stock', 'image'),
+    'verbose': ('Product Code', 'Product Name', 'Description', 'Category', 'Cost', 'Quantity', 'Image URL'),
+}
+
+# Category hints as the supplier writes them
+CATEGORY_HINTS = (
+    'Brake Pads', 'Brake Discs', 'Rear Shock Absorbers', 'Steering Dampers', 'Electrical > Switches',
+    'LED Lighting', 'Indicator Bulbs', 'Engine Parts', 'Performance Exhausts', 'Clutch Plates',
+    'Chain & Sprocket Kits', 'Wheel Bearings', 'Road Tyres', 'Body Panels', 'Fairing Bolts',
+    'Radiator Hoses', 'Engine Oil', 'Fuel Taps', 'Air Filters', 'Batteries', 'Battery Chargers',
+    'Workshop Tools', 'Disc Locks', 'Tank Bags', 'Textile Clothing', 'Helmets', 'Winter Gloves',
+    'Bike Covers', 'Misc', '',
+)
+
+NAME_WORDS = (
+    'Front', 'Rear', 'Sintered', 'Stainless', 'Braided', 'Heavy Duty', 'OEM', 'Racing', 'Touring',
+    'Universal', 'Black', 'Chrome', 'Carbon', 'Replacement', 'Premium', 'Kit', 'Set', 'Pair',
+)
+
+def format_price(rng, value, dirty):
+    """Format a cost price the way the supplier might"""
+    if not dirty:
+        return f'{value:.2f}'
+
+    style = rng.random()
+    if style < 0.5:
+        return f'{value:.2f}'
+    if style < 0.8:
+        return f'£{value:,.2f}'
+    if style < 0.9:
+        return f' {value:.1f} '
+    if style < 0.97:
+        return f'£{value:,.0f}'
+    return rng.choice(('', 'N/A', 'POA'))
+
+def generate_rows(rows, seed=0, dirty=True):
+    """Yield product rows in field order"""
+    rng = random.Random(seed)
+
+    for i in range(rows):
+        sku = f'BI{i:07d}'
+        name = ' '.join(rng.sample(NAME_WORDS, 3)) + f' {i}'
+        description = f'{name} for {rng.choice(("road", "off-road", "scooter", "touring"))} bikes, fits models {rng.randint(1990, 2025)}-on'
+        category = rng.choice(CATEGORY_HINTS)
+        price = format_price(rng, rng.lognormvariate(3, 1.2), dirty)
+        stock = str(rng.choice((0, 0, 1, 2, 5, 10, 25, 100, rng.randint(0, 5000))))
+        image_url = f'https://images.bikeit.example/{sku}.jpg' if rng.random() < 0.9 else ''
+
+        if dirty:
+            # Occasional rows the sync should reject or tolerate
+            defect = rng.random()
+            if defect < 0.002:
+                sku = ''
+            elif defect < 0.004:
+                name = ''
+            elif defect < 0.006:
+                stock = rng.choice(('', 'n/a', '-1'))
+            elif defect < 0.008:
+                description = f'Multi-line\ndescription for {sku}'
+
+        yield (sku, name, description, category, price, stock, image_url)
+
+def write_feed(path, rows, variant='standard', seed=0, dirty=True, extra_columns=0, bom=False, crlf=False):
+    """
+    Write a synthetic feed file and return the number of data rows written
+
+    extra_columns adds unused supplier columns in between the mapped ones,
+    bom prefixes a UTF-8 byte order mark and crlf uses Windows line endings.
+    """
+    header = list(HEADER_VARIANTS[variant])
+    for i in range(extra_columns):
+        header.insert(1 + 2 * i, f'Extra {i}')
+    positions = [header.index(column) for column in HEADER_VARIANTS[variant]]
+
+    with open(path, 'w', encoding='utf-8-sig' if bom else 'utf-8', newline='') as f:
+        writer = csv.writer(f, lineterminator='\r\n' if crlf else '\n')
+        writer.writerow(header)
+
+        row = [''] * len(header)
+        for values in generate_rows(rows, seed, dirty):
+            for position, value in zip(positions, values):
+                row[position] = value
+            writer.writerow(row)
+
+    return rows
+
+def main():
+    """Write a synthetic feed from the command line"""
+    parser = argparse.ArgumentParser(description='Generate a synthetic Bike It product feed')
+    parser.add_argument('path', help='CSV file to write')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--variant', choices=sorted(HEADER_VARIANTS), default='standard')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clean', action='store_true', help='plain prices and no defective rows')
+    parser.add_argument('--extra-columns', type=int, default=0)
+    parser.add_argument('--bom', action='store_true')
+    parser.add_argument('--crlf', action='store_true')
+    args = parser.parse_args()
+
+    write_feed(args.path, args.rows, args.variant, args.seed, not args.clean, args.extra_columns, args.bom, args.crlf)
+    print(f"Wrote {args.rows} rows ({os.path.getsize(args.path)} bytes) to {args.path}")
+
+if __name__ == '__main__':
+    sys.exit(main())
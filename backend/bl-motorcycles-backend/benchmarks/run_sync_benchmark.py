@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Product Sync Benchmark for B&L Motorcycles
+Generates synthetic feeds, serves them from a local SFTP server and syncs
+them into a throwaway SQLite database or an in-memory Supabase stub.
+
+Each feed size is measured twice. First the connect, download, parse,
+classify and upsert stages are run one by one, so each reports its own
+duration, rows/sec and peak RSS. Then sync_bikeit_products runs end to end
+on an empty target, and again on the unchanged feed. Results are appended
+as one JSON line per feed size, so runs from different versions can be
+compared.
+
+Peak RSS is the process high-water mark after each stage; peak_rss_growth_mb
+is how much a stage raised it.
+"""
+
+import os
+import sys
+import argparse
+import gc
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Every price and stock change a benchmark sync makes would otherwise be
+# appended to the shop's real price history
+os.environ.setdefault('PRICE_HISTORY_DIR', tempfile.mkdtemp(prefix='bench_price_history_'))
+
+# Generated feeds link to images that don't exist, and benchmark syncs
+# mustn't rebuild the shop's search index or category summary, or
+# invalidate its cached catalog responses
+os.environ.setdefault('IMAGE_PREFETCH', 'false')
+os.environ.setdefault('SEARCH_INDEX_JOURNAL', os.path.join(tempfile.mkdtemp(prefix='bench_search_'), 'search_index.log'))
+os.environ.setdefault('CATALOG_GENERATION_FILE', os.path.join(tempfile.mkdtemp(prefix='bench_catalog_'), 'catalog_generation'))
+os.environ.setdefault('CATEGORY_SUMMARY_DIR', tempfile.mkdtemp(prefix='bench_category_summary_'))
+
+from benchmarks.feed_generator import HEADER_VARIANTS, write_feed
+from benchmarks.sftp_server import LocalSFTPServer
+from benchmarks.stub_supabase import StubSupabaseClient
+
+DEFAULT_OUTPUT = os.path.join(BACKEND_DIR, 'benchmarks', 'results', 'sync_benchmark.jsonl')
+
+FEED_FILE = 'bikeit_product_feed.csv'
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children, in MB"""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def git_commit():
+    """Commit the benchmarked code is at, if known"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class SyncTarget:
+    """A fresh database for each measured sync, with a round trip counter"""
+
+    def __init__(self, kind, workdir, latency_ms=0.0):
+        self.kind = kind
+        self.workdir = workdir
+        self.latency_ms = latency_ms
+        self.round_trips = 0
+
+        if kind == 'sqlite':
+            from flask import Flask
+            from sqlalchemy import event
+            from src.models.product import db
+
+            self.db = db
+            self.app = Flask('sync_benchmark')
+            self.app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+            self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+            db.init_app(self.app)
+            self.context = self.app.app_context()
+            self.context.push()
+            event.listen(db.engine, 'before_cursor_execute', self._count_round_trip)
+
+            from src.services import ftp_sync
+            self.sync_module = ftp_sync
+            self.feed_sync_class = ftp_sync.BikeItFTPSync
+        else:
+            # The Supabase service is created on import and needs settings, even for the stub
+            os.environ.setdefault('NEXT_PUBLIC_SUPABASE_URL', 'http://127.0.0.1:9')
+            os.environ.setdefault('SUPABASE_SERVICE_ROLE_KEY', 'benchmark')
+
+            from src.services import ftp_sync_supabase
+            from src.services.supabase_client import supabase_service
+            self.supabase_service = supabase_service
+            self.sync_module = ftp_sync_supabase
+            self.feed_sync_class = ftp_sync_supabase.BikeItFTPSyncSupabase
+
+        self.reset()
+
+    def _count_round_trip(self, *args):
+        self.round_trips += 1
+
+    def reset(self):
+        """Start again from an empty products table"""
+        if self.kind == 'sqlite':
+            from src.models.product import ensure_schema
+            self.db.session.remove()
+            self.db.drop_all()
+            self.db.create_all()
+            ensure_schema()
+        else:
+            self.stub = StubSupabaseClient(self.latency_ms)
+            self.supabase_service.client = self.stub
+
+    def requests(self):
+        """Database round trips made so far"""
+        return self.round_trips if self.kind == 'sqlite' else self.stub.requests
+
+    def close(self):
+        if self.kind == 'sqlite':
+            self.db.session.remove()
+            self.context.pop()
+
+class StageTimer:
+    """Collects per-stage measurements"""
+
+    def __init__(self, target):
+        self.target = target
+        self.stages = []
+
+    def measure(self, name, func, rows=None, bytes_read=None):
+        """Run func as one stage and record its measurements, returning its result"""
+        gc.collect()
+        peak_before = peak_rss_mb()
+        requests_before = self.target.requests()
+        started = time.perf_counter()
+
+        value = func()
+
+        seconds = time.perf_counter() - started
+        if callable(rows):
+            rows = rows(value)
+        peak_after = peak_rss_mb()
+
+        stage = {
+            'stage': name,
+            'seconds': round(seconds, 4),
+            'rows': rows,
+            'rows_per_sec': round(rows / seconds, 1) if rows and seconds else None,
+            'bytes': bytes_read,
+            'db_round_trips': self.target.requests() - requests_before,
+            'peak_rss_mb': round(peak_after, 1),
+            'peak_rss_growth_mb': round(peak_after - peak_before, 1),
+        }
+        self.stages.append(stage)
+        print(f"  {name:<18} {seconds:9.3f}s  {stage['rows_per_sec'] or '-':>12} rows/s  "
+              f"{stage['peak_rss_mb']:8.1f} MB peak")
+        return value
+
+def run_stages(timer, target, feed_rows, feed_bytes, chunk_size):
+    """Measure connect, download, parse, classify and upsert one at a time"""
+    from src.services.category_classifier import classify_category, _classify_hint
+    from src.services.feed_cache import FeedCache
+    from src.services.feed_stream import iter_decoded_lines, sync_products_in_chunks
+
+    feed_sync = target.feed_sync_class()
+    ssh, sftp = timer.measure('connect', feed_sync.connect_ftp)
+
+    try:
+        feed_cache = FeedCache()
+        fetched = timer.measure('download', lambda: feed_cache.fetch(sftp, FEED_FILE, sftp.stat(FEED_FILE)),
+                                bytes_read=feed_bytes)
+    finally:
+        sftp.close()
+        ssh.close()
+
+    # Parse with classification switched off, so it can be timed on its own
+    feed_sync.categorize_product = lambda category_hint, name=None, description=None: category_hint
+
+    def parse():
+        with open(fetched['path'], 'rb') as feed:
+            return list(feed_sync.parse_batches(iter_decoded_lines(feed), chunk_size))
+
+    count_rows = lambda batches: sum(map(len, batches))
+    batches = timer.measure('parse', parse, rows=count_rows, bytes_read=feed_bytes)
+    parsed_rows = count_rows(batches)
+    timer.stages[-1]['rejected_rows'] = feed_rows - parsed_rows
+
+    _classify_hint.cache_clear()
+    categories = timer.measure(
+        'classify',
+        lambda: [
+            [classify_category(*values) for values in zip(batch.categories, batch.names, batch.descriptions)]
+            for batch in batches
+        ],
+        rows=count_rows
+    )
+
+    for batch, batch_categories in zip(batches, categories):
+        batch.categories = batch_categories
+    del categories
+
+    timer.measure('upsert', lambda: sync_products_in_chunks(target.feed_sync_class(), batches),
+                  rows=parsed_rows)
+
+def run_end_to_end(timer, target, feed_rows, feed_bytes, chunk_size, parallel):
+    """Measure sync_bikeit_products on an empty target and again on the unchanged feed"""
+    from src.services.category_classifier import _classify_hint
+
+    _classify_hint.cache_clear()
+    sync = lambda: target.sync_module.sync_bikeit_products(chunk_size=chunk_size, parallel=parallel)
+
+    result = timer.measure('end_to_end', sync, rows=feed_rows, bytes_read=feed_bytes)
+    if 'error' in result:
+        raise RuntimeError(f"Sync failed: {result['error']}")
+
+    timer.measure('end_to_end_resync', sync, rows=feed_rows)
+
+def benchmark(rows, args, workdir, server, target):
+    """Benchmark one feed size and return its result record"""
+    feed_path = os.path.join(server.root, FEED_FILE)
+    write_feed(feed_path, rows, args.variant, args.seed, dirty=not args.clean)
+    feed_bytes = os.path.getsize(feed_path)
+    print(f"{rows} rows, {feed_bytes / (1024 * 1024):.1f} MB feed, {target.kind} target")
+
+    timer = StageTimer(target)
+
+    os.environ['FEED_CACHE_DIR'] = tempfile.mkdtemp(dir=workdir)
+    target.reset()
+    run_stages(timer, target, rows, feed_bytes, args.chunk_size)
+
+    os.environ['FEED_CACHE_DIR'] = tempfile.mkdtemp(dir=workdir)
+    target.reset()
+    run_end_to_end(timer, target, rows, feed_bytes, args.chunk_size, args.parallel)
+
+    return {
+        'timestamp': datetime.utcnow().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'target': target.kind,
+        'supabase_latency_ms': args.supabase_latency_ms if target.kind == 'supabase' else None,
+        'rows': rows,
+        'variant': args.variant,
+        'dirty': not args.clean,
+        'feed_bytes': feed_bytes,
+        'chunk_size': args.chunk_size,
+        'parallel': args.parallel,
+        'stages': timer.stages,
+    }
+
+def main():
+    """Main function for the sync benchmark"""
+    parser = argparse.ArgumentParser(description='Benchmark the product sync against a local SFTP server')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help='feed sizes to benchmark (e.g. 10000 100000 1000000)')
+    parser.add_argument('--target', choices=('sqlite', 'supabase'), default='sqlite')
+    parser.add_argument('--supabase-latency-ms', type=float, default=0.0,
+                        help='simulated round trip time of each Supabase request')
+    parser.add_argument('--variant', choices=sorted(HEADER_VARIANTS), default='standard')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--clean', action='store_true', help='plain prices and no defective rows')
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--parallel', action='store_true', help='use the parallel multi-file ingest path')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='JSON lines file the results are appended to')
+    args = parser.parse_args()
+
+    # Keep the sync's own logging and the server side's disconnect noise out of the report
+    import logging
+    logging.disable(logging.INFO)
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    workdir = tempfile.mkdtemp(prefix='sync_benchmark_')
+    served = os.path.join(workdir, 'sftp')
+    os.makedirs(served)
+
+    try:
+        with LocalSFTPServer(served) as server:
+            os.environ.update(server.environment())
+            target = SyncTarget(args.target, workdir, args.supabase_latency_ms)
+
+            try:
+                records = [benchmark(rows, args, workdir, server, target) for rows in args.rows]
+            finally:
+                target.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+    print(f"Results appended to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Local read-only SFTP server for the sync benchmarks
+Serves the files of a local directory over paramiko, standing in for the
+Bike It server so a sync can run end to end without the network.
+"""
+
+import os
+import socket
+import threading
+import paramiko
+
+class _Authentication(paramiko.ServerInterface):
+    """Password authentication against a single user"""
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.username, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+class _ReadOnlyHandle(paramiko.SFTPHandle):
+    """SFTP handle reading straight from a local file"""
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+class _DirectorySFTP(paramiko.SFTPServerInterface):
+    """Read-only view of the served directory"""
+
+    root = None
+
+    def _local_path(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def canonicalize(self, path):
+        return os.path.normpath('/' + path.replace('\\', '/')).replace('\\', '/')
+
+    def list_folder(self, path):
+        try:
+            local_path = self._local_path(path)
+            entries = []
+            for filename in os.listdir(local_path):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local_path, filename)))
+                attr.filename = filename
+                entries.append(attr)
+            return entries
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return paramiko.SFTP_PERMISSION_DENIED
+
+        try:
+            handle = _ReadOnlyHandle(flags)
+            handle.readfile = open(self._local_path(path), 'rb')
+            return handle
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+class LocalSFTPServer:
+    """
+    SFTP server on 127.0.0.1 serving one directory, run in a background thread
+
+    Use as a context manager; host and port are set once it has started.
+    Each client connection gets its own transport thread.
+    """
+
+    def __init__(self, root, username='bench', password='bench'):
+        self.root = os.path.abspath(root)
+        self.username = username
+        self.password = password
+        self.host = '127.0.0.1'
+        self.port = None
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.transports = []
+        self.stopping = threading.Event()
+
+    def start(self):
+        """Start accepting connections"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, 0))
+        self.socket.listen(8)
+        self.socket.settimeout(0.2)
+        self.port = self.socket.getsockname()[1]
+
+        self.thread = threading.Thread(target=self._accept_loop, name='sftp-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def _accept_loop(self):
+        # A fresh subclass per server so the class-level root isn't shared
+        sftp_interface = type('DirectorySFTP', (_DirectorySFTP,), {'root': self.root})
+
+        while not self.stopping.is_set():
+            try:
+                client, _ = self.socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, sftp_interface)
+            transport.start_server(server=_Authentication(self.username, self.password))
+            self.transports.append(transport)
+
+    def stop(self):
+        """Stop accepting connections and close the open ones"""
+        self.stopping.set()
+        self.thread.join()
+        self.socket.close()
+        for transport in self.transports:
+            transport.close()
+
+    def environment(self):
+        """FTP_* settings pointing BikeItFTPSync at this server"""
+        return {
+            'FTP_HOST': self.host,
+            'FTP_PORT': str(self.port),
+            'FTP_USERNAME': self.username,
+            'FTP_PASSWORD': self.password,
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
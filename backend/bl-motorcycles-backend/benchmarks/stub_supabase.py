@@ -0,0 +1,126 @@
+"""
+In-memory stand-in for the Supabase client used by the sync benchmarks
+Implements just the query builder calls the product sync makes, with an
+optional per-request latency to model the round trip to PostgREST.
+"""
+
+import threading
+import time
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data)
+
+class _Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.operation = 'select'
+        self.columns = None
+        self.rows = None
+        self.conflict_key = 'id'
+        self.returning = None
+        self.start = None
+        self.end = None
+
+    def select(self, columns='*', **kwargs):
+        self.columns = None if columns == '*' else [column.strip() for column in columns.split(',')]
+        return self
+
+    def order(self, column, desc=False):
+        return self
+
+    def range(self, start, end):
+        self.start, self.end = start, end
+        return self
+
+    def upsert(self, rows, on_conflict='id', returning=None, **kwargs):
+        self.operation = 'upsert'
+        self.rows = rows if isinstance(rows, list) else [rows]
+        self.conflict_key = on_conflict
+        self.returning = returning
+        return self
+
+    def execute(self):
+        return self.client.execute(self)
+
+class _RPC:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        return self.client.execute_rpc(self.name, self.params)
+
+class StubSupabaseClient:
+    """Products table held in memory, counting requests like a real PostgREST client"""
+
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.tables = {}
+        self.next_id = 1
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params):
+        return _RPC(self, name, params)
+
+    def _round_trip(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def execute(self, query):
+        self._round_trip()
+        with self.lock:
+            rows = self.tables.setdefault(query.table, {})
+
+            if query.operation == 'upsert':
+                for row in query.rows:
+                    key = row[query.conflict_key]
+                    if key in rows:
+                        rows[key].update(row)
+                    else:
+                        rows[key] = dict(row, id=self.next_id)
+                        self.next_id += 1
+                minimal = query.returning is not None and str(query.returning).endswith('minimal')
+                return _Result([] if minimal else query.rows)
+
+            selected = sorted(rows.values(), key=lambda row: row['id'])
+            if query.start is not None:
+                selected = selected[query.start:query.end + 1]
+            if query.columns:
+                selected = [{column: row.get(column) for column in query.columns} for row in selected]
+            return _Result(selected)
+
+    def execute_rpc(self, name, params):
+        self._round_trip()
+        with self.lock:
+            products = self.tables.setdefault('products', {})
+
+            if name == 'apply_stock_levels':
+                for level in params['levels']:
+                    if level['sku'] in products:
+                        products[level['sku']].update(level)
+                return _Result([len(params['levels'])])
+
+            if name == 'apply_selling_prices':
+                for price in params['prices']:
+                    if price['sku'] in products:
+                        products[price['sku']]['selling_price'] = price['selling_price']
+                return _Result([len(params['prices'])])
+
+            if name == 'mark_products_discontinued':
+                marked = [products[sku] for sku in params['skus'] if sku in products]
+                for row in marked:
+                    row.update(stock_quantity=0, in_stock=False, content_hash=None)
+                    if params['soft_delete'] and not row.get('discontinued_at'):
+                        row['discontinued_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+                return _Result([len(marked)])
+
+            return _Result([])
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 """
 FTP Sync Cron Job Script for B&L Motorcycles
-This script runs every 2 hours to synchronize products from Bike It FTP feed
+This script runs every 2 hours to synchronize products from Bike It FTP feed.
+With --stock-only it runs the lightweight stock and price sync, which is
+cheap enough to schedule every few minutes.
 """
 
 import os
 import sys
+import argparse
 import logging
 from datetime import datetime
 
@@ -27,16 +30,21 @@ logger = logging.getLogger(__name__)
 
 def main():
     """Main function for cron job execution"""
+    parser = argparse.ArgumentParser(description='Synchronize products from the Bike It FTP feed')
+    parser.add_argument('--stock-only', action='store_true',
+                        help='only sync stock levels and prices')
+    args = parser.parse_args()
+    
     try:
         logger.info("=" * 50)
-        logger.info("Starting FTP synchronization cron job")
+        logger.info(f"Starting FTP {'stock' if args.stock_only else 'synchronization'} cron job")
         logger.info(f"Timestamp: {datetime.now().isoformat()}")
         
         # Import and run the sync function
         from services.ftp_sync import sync_bikeit_products
         
         # Execute synchronization
-        result = sync_bikeit_products()
+        result = sync_bikeit_products(stock_only=args.stock_only)
         
         if 'error' in result:
             logger.error(f"Synchronization failed: {result['error']}")
@@ -1,7 +1,8 @@
 #!/bin/bash
 
 # Setup script for B&L Motorcycles FTP synchronization cron job
-# This script sets up the cron job to run every 2 hours
+# This script sets up the cron job to run every 2 hours, plus a stock and
+# price only sync every 10 minutes
 
 echo "Setting up B&L Motorcycles FTP sync cron job..."
 
@@ -15,6 +16,7 @@ chmod +x "$PYTHON_SCRIPT"
 
 # Create the cron job command
 CRON_COMMAND="0 */2 * * * cd $SCRIPT_DIR && source $VENV_PATH && python $PYTHON_SCRIPT >> /var/log/bl_motorcycles_ftp_sync.log 2>&1"
+STOCK_CRON_COMMAND="*/10 * * * * cd $SCRIPT_DIR && source $VENV_PATH && python $PYTHON_SCRIPT --stock-only >> /var/log/bl_motorcycles_ftp_sync.log 2>&1"
 
 # Check if cron job already exists
 if crontab -l 2>/dev/null | grep -q "ftp_sync_cron.py"; then
@@ -23,8 +25,8 @@ if crontab -l 2>/dev/null | grep -q "ftp_sync_cron.py"; then
     crontab -l 2>/dev/null | grep -v "ftp_sync_cron.py" | crontab -
 fi
 
-# Add the new cron job
-(crontab -l 2>/dev/null; echo "$CRON_COMMAND") | crontab -
+# Add the new cron jobs
+(crontab -l 2>/dev/null; echo "$CRON_COMMAND"; echo "$STOCK_CRON_COMMAND") | crontab -
 
 # Create log file if it doesn't exist
 sudo touch /var/log/bl_motorcycles_ftp_sync.log
@@ -32,6 +34,7 @@ sudo chmod 666 /var/log/bl_motorcycles_ftp_sync.log
 
 echo "Cron job setup complete!"
 echo "The FTP sync will run every 2 hours."
+echo "The stock and price sync will run every 10 minutes."
 echo "Log file: /var/log/bl_motorcycles_ftp_sync.log"
 echo ""
 echo "To view current cron jobs: crontab -l"
@@ -39,4 +42,5 @@ echo "To view sync logs: tail -f /var/log/bl_motorcycles_ftp_sync.log"
 echo ""
 echo "Manual sync command:"
 echo "cd $SCRIPT_DIR && source $VENV_PATH && python ftp_sync_cron.py"
+echo "cd $SCRIPT_DIR && source $VENV_PATH && python ftp_sync_cron.py --stock-only"
 
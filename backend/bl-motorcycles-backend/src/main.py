@@ -12,7 +12,7 @@ load_dotenv()
 
 # Import models and routes
 from src.models.user import db as user_db
-from src.models.product import db, Product, Order, OrderItem
+from src.models.product import db, Product, Order, OrderItem, ensure_schema
 from src.routes.user import user_bp
 from src.routes.products import products_bp
 from src.routes.orders import orders_bp
@@ -36,6 +36,7 @@ app.register_blueprint(orders_bp, url_prefix='/api')
 db.init_app(app)
 with app.app_context():
     db.create_all()
+    ensure_schema()
 
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
@@ -58,7 +59,8 @@ def api_info():
             'products': '/api/products',
             'orders': '/api/orders',
             'health': '/api/health',
-            'sync': '/api/sync-products'
+            'sync': '/api/sync-products',
+            'sync_runs': '/api/sync-runs'
         },
         'features': [
             'Product management',
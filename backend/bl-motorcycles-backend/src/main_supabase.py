@@ -12,6 +12,7 @@ load_dotenv()
 
 # Import Supabase service and routes
 from src.services.supabase_client import supabase_service
+from src.services.pricing import pricing_engine
 from src.routes.user import user_bp
 from src.routes.products_supabase import products_bp
 from src.routes.orders_supabase import orders_bp
@@ -61,6 +62,7 @@ def api_info():
             'orders': '/api/orders',
             'health': '/api/health',
             'sync': '/api/sync-products',
+            'sync_runs': '/api/sync-runs',
             'stripe_config': '/api/stripe-config',
             'checkout': '/api/create-checkout-session',
             'stripe_webhook': '/api/webhook/stripe',
@@ -91,8 +93,6 @@ def add_sample_products():
                 'description': 'High-quality front brake pads for motorcycles',
                 'category': 'Brakes & ABS',
                 'cost_price': 30.66,
-                'selling_price': 52.0,  # (30.66 * 1.5) + 6
-                'delivery_cost': 6.0,
                 'stock_quantity': 25,
                 'in_stock': True,
                 'image_url': '',
@@ -104,8 +104,6 @@ def add_sample_products():
                 'description': 'Complete chain and sprocket kit for motorcycles',
                 'category': 'Transmission & Clutch',
                 'cost_price': 59.99,
-                'selling_price': 95.99,  # (59.99 * 1.5) + 6
-                'delivery_cost': 6.0,
                 'stock_quantity': 15,
                 'in_stock': True,
                 'image_url': '',
@@ -117,8 +115,6 @@ def add_sample_products():
                 'description': 'Premium oil filter for motorcycle engines',
                 'category': 'Engine & Performance',
                 'cost_price': 12.66,
-                'selling_price': 24.99,  # (12.66 * 1.5) + 6
-                'delivery_cost': 6.0,
                 'stock_quantity': 0,
                 'in_stock': False,
                 'image_url': '',
@@ -126,6 +122,9 @@ def add_sample_products():
             }
         ]
         
+        # Selling price and delivery cost from the pricing rules
+        pricing_engine.apply(sample_products)
+        
         result = supabase_service.upsert_products(sample_products)
         
         if result['success']:
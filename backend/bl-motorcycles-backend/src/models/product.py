@@ -1,10 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from datetime import datetime
+from src.services.pricing import pricing_engine
 
 db = SQLAlchemy()
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # Sort keys of the cursor-paginated listings
+        db.Index('ix_products_selling_price_id', 'selling_price', 'id'),
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     sku = db.Column(db.String(100), unique=True, nullable=False)
@@ -12,12 +19,14 @@ class Product(db.Model):
     description = db.Column(db.Text)
     category = db.Column(db.String(100))
     cost_price = db.Column(db.Float, nullable=False)  # Original cost from supplier
-    selling_price = db.Column(db.Float, nullable=False)  # cost * 1.5 + 6
+    selling_price = db.Column(db.Float, nullable=False)  # From the pricing rules, see services.pricing
     delivery_cost = db.Column(db.Float, default=6.0)
     stock_quantity = db.Column(db.Integer, default=0)
     in_stock = db.Column(db.Boolean, default=True)
     image_url = db.Column(db.String(500))
     supplier = db.Column(db.String(100), default='Bike It')
+    content_hash = db.Column(db.String(32))  # Fingerprint of the mapped feed fields
+    discontinued_at = db.Column(db.DateTime)  # Set when soft-deleted after leaving the feed
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -38,17 +47,21 @@ class Product(db.Model):
             'in_stock': self.in_stock,
             'image_url': self.image_url,
             'supplier': self.supplier,
+            'discontinued_at': self.discontinued_at.isoformat() if self.discontinued_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
     @staticmethod
-    def calculate_selling_price(cost_price, delivery_cost=6.0):
-        """Calculate selling price using the formula: cost * 1.5 + delivery"""
-        return (cost_price * 1.5) + delivery_cost
+    def calculate_selling_price(cost_price, delivery_cost=None, category=None):
+        """Calculate selling price with the pricing rules (default: cost * 1.5 + delivery)"""
+        return pricing_engine.price(cost_price, category, delivery_cost)
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.String(100), unique=True, nullable=False)
@@ -119,3 +132,34 @@ class OrderItem(db.Model):
             'total_price': self.total_price
         }
 
+# Columns added after the first release, created on existing databases by ensure_schema
+ADDED_COLUMNS = {
+    'products': {
+        'content_hash': 'VARCHAR(32)',
+        'discontinued_at': 'DATETIME'
+    }
+}
+
+def ensure_schema():
+    """Add any columns and indexes missing from tables created by an older version, and the search index"""
+    inspector = inspect(db.engine)
+    
+    for table, columns in ADDED_COLUMNS.items():
+        if not inspector.has_table(table):
+            continue
+        
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        
+        for column, column_type in columns.items():
+            if column not in existing:
+                db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+    
+    db.session.commit()
+    
+    # Indexes added since, which create_all only makes for new tables
+    for model in (Product, Order):
+        for index in model.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+    
+    from src.services.product_search import ensure_search_index
+    ensure_search_index(db.session)
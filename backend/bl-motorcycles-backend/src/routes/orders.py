@@ -1,5 +1,8 @@
 from flask import Blueprint, request, jsonify
 from src.models.product import db, Product, Order, OrderItem
+from src.services.pagination import (
+    Keyset, CursorError, ORDER_SORT_COLUMNS, cursor_page, keyset_query, pagination_args
+)
 import stripe
 import os
 from dotenv import load_dotenv
@@ -29,6 +32,10 @@ def get_orders():
         if status:
             query = query.filter(Order.order_status == status)
         
+        # Clients that send a cursor (empty for the first page) get keyset pagination
+        if 'cursor' in request.args:
+            return order_cursor_page(query, status)
+        
         # Order by most recent first
         query = query.order_by(Order.created_at.desc())
         
@@ -58,6 +65,26 @@ def get_orders():
             'error': str(e)
         }), 500
 
+def order_cursor_page(query, status):
+    """A page of orders listed by cursor, most recent first unless sort says otherwise"""
+    try:
+        cursor, sort, per_page, include_total = pagination_args(request.args, '-created_at')
+        keyset = Keyset(sort, ORDER_SORT_COLUMNS)
+        orders, pagination = cursor_page(keyset_query(query, Order, keyset), keyset, cursor, per_page)
+        
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Counted exactly every time: new orders have to show up at once, unlike catalog changes
+    if include_total:
+        pagination['total'] = query.count()
+    
+    return jsonify({
+        'success': True,
+        'orders': [order.to_dict() for order in orders],
+        'pagination': pagination
+    })
+
 @orders_bp.route('/orders/<int:order_id>', methods=['GET'])
 def get_order(order_id):
     """Get a single order by ID"""
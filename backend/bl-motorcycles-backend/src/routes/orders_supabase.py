@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from src.services.supabase_client import supabase_service
+from src.services.pagination import Keyset, CursorError, ORDER_SORT_COLUMNS, cursor_page, pagination_args
 import stripe
 import os
 from dotenv import load_dotenv
@@ -22,6 +23,10 @@ def get_orders():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
         
+        # Clients that send a cursor (empty for the first page) get keyset pagination
+        if 'cursor' in request.args:
+            return order_cursor_page(status or None)
+        
         # Get orders from Supabase
         result = supabase_service.get_orders(
             status=status if status else None,
@@ -50,6 +55,36 @@ def get_orders():
             'error': str(e)
         }), 500
 
+def order_cursor_page(status):
+    """A page of orders listed by cursor, most recent first unless sort says otherwise"""
+    try:
+        cursor, sort, per_page, include_total = pagination_args(request.args, '-created_at')
+        keyset = Keyset(sort, ORDER_SORT_COLUMNS)
+        
+        def fetch(after, backward, limit):
+            result = supabase_service.get_orders_page(keyset, after, backward, limit, status)
+            if not result['success']:
+                raise Exception(result['error'])
+            return result['orders']
+        
+        orders, pagination = cursor_page(fetch, keyset, cursor, per_page)
+        
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    # Counted exactly every time: new orders have to show up at once, unlike catalog changes
+    if include_total:
+        result = supabase_service.count_orders(status)
+        if not result['success']:
+            raise Exception(result['error'])
+        pagination['total'] = result['count']
+    
+    return jsonify({
+        'success': True,
+        'orders': orders,
+        'pagination': pagination
+    })
+
 @orders_bp.route('/orders/<int:order_id>', methods=['GET'])
 def get_order(order_id):
     """Get a single order by ID"""
@@ -1,6 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, send_file
 from src.models.product import db, Product, Order, OrderItem
-from sqlalchemy import or_
+from src.services.pricing import pricing_engine
+from src.services.product_search import search_products
+from src.services.catalog_cache import catalog_generation, catalog_response
+from src.services.category_summary import sqlite_category_summary
+from src.services.pagination import (
+    Keyset, CursorError, PRODUCT_SORT_COLUMNS, count_cache, cursor_page, keyset_query, offset_page, pagination_args
+)
 import os
 from dotenv import load_dotenv
 
@@ -9,6 +15,7 @@ load_dotenv()
 products_bp = Blueprint('products', __name__)
 
 @products_bp.route('/products', methods=['GET'])
+@catalog_response
 def get_products():
     """Get all products with optional search and category filtering"""
     try:
@@ -18,30 +25,29 @@ def get_products():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
         
-        # Build query
-        query = Product.query
+        # Build query, leaving out soft-deleted products
+        query = Product.query.filter(Product.discontinued_at.is_(None))
         
-        # Apply search filter
+        # Apply search filter, ranking the best matches first
         if search:
-            query = query.filter(
-                or_(
-                    Product.name.ilike(f'%{search}%'),
-                    Product.description.ilike(f'%{search}%'),
-                    Product.category.ilike(f'%{search}%'),
-                    Product.sku.ilike(f'%{search}%')
-                )
-            )
+            query = search_products(query, Product, search)
         
         # Apply category filter
         if category:
             query = query.filter(Product.category.ilike(f'%{category}%'))
         
-        # Paginate results
+        # Clients that send a cursor (empty for the first page) get keyset pagination
+        if 'cursor' in request.args:
+            return product_cursor_page(query, search, category)
+        
+        # Paginate results, reusing a recent count of the matches
         products = query.paginate(
             page=page, 
             per_page=per_page, 
-            error_out=False
+            error_out=False,
+            count=False
         )
+        products.total = count_cache.get(('products', catalog_generation.current(), search, category), query.order_by(None).count)
         
         return jsonify({
             'success': True,
@@ -62,7 +68,40 @@ def get_products():
             'error': str(e)
         }), 500
 
+def product_cursor_page(query, search, category):
+    """
+    A page of products listed by cursor
+    
+    Products are sorted by the sort parameter, or in relevance order for
+    searches, where the cursor holds the offset into the ranked results.
+    """
+    try:
+        cursor, sort, per_page, include_total = pagination_args(request.args, 'id')
+        
+        if search:
+            if 'sort' in request.args:
+                raise CursorError("Search results are sorted by relevance")
+            products, pagination = offset_page(
+                lambda offset, limit: query.offset(offset).limit(limit).all(), cursor, per_page
+            )
+        else:
+            keyset = Keyset(sort, PRODUCT_SORT_COLUMNS)
+            products, pagination = cursor_page(keyset_query(query, Product, keyset), keyset, cursor, per_page)
+        
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if include_total:
+        pagination['total'] = count_cache.get(('products', catalog_generation.current(), search, category), query.order_by(None).count)
+    
+    return jsonify({
+        'success': True,
+        'products': [product.to_dict() for product in products],
+        'pagination': pagination
+    })
+
 @products_bp.route('/products/<int:product_id>', methods=['GET'])
+@catalog_response
 def get_product(product_id):
     """Get a single product by ID"""
     try:
@@ -77,16 +116,61 @@ def get_product(product_id):
             'error': str(e)
         }), 500
 
+@products_bp.route('/products/<int:product_id>/image', methods=['GET'])
+def get_product_image(product_id):
+    """Serve a product's image from the local image cache, resized with ?size=thumb or listing"""
+    try:
+        from src.services.image_cache import image_cache, ImageError, ImageTimeout, SERVE_MAX_AGE
+        
+        product = db.session.get(Product, product_id)
+        image_url = product.image_url if product else None
+        
+        if not image_url:
+            return jsonify({
+                'success': False,
+                'error': 'Product image not found'
+            }), 404
+        
+        try:
+            path, content_type, etag = image_cache.get(image_url, request.args.get('size', 'original'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except ImageTimeout as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 504
+        except ImageError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 502
+        
+        # The ETag is the image content's hash, so If-None-Match gets a 304
+        response = send_file(path, mimetype=content_type, etag=etag, max_age=SERVE_MAX_AGE, conditional=True)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @products_bp.route('/products/categories', methods=['GET'])
+@catalog_response
 def get_categories():
-    """Get all unique product categories"""
+    """Get the categories of the products for sale, with their product counts and price ranges"""
     try:
-        categories = db.session.query(Product.category).distinct().filter(Product.category.isnot(None)).all()
-        category_list = [cat[0] for cat in categories if cat[0]]
+        summary = sqlite_category_summary.categories()
         
         return jsonify({
             'success': True,
-            'categories': sorted(category_list)
+            'categories': [category['name'] for category in summary],
+            'summary': summary
         })
     except Exception as e:
         return jsonify({
@@ -98,12 +182,14 @@ def get_categories():
 def create_product():
     """Create a new product (for admin use)"""
     try:
+        # Price with the current rules file, which the scheduler may have seen change
+        pricing_engine.reload_if_changed()
         data = request.get_json()
         
         # Calculate selling price
         cost_price = float(data.get('cost_price', 0))
-        delivery_cost = float(data.get('delivery_cost', 6.0))
-        selling_price = Product.calculate_selling_price(cost_price, delivery_cost)
+        delivery_cost = float(data.get('delivery_cost', pricing_engine.delivery_cost))
+        selling_price = Product.calculate_selling_price(cost_price, delivery_cost, data.get('category', ''))
         
         product = Product(
             sku=data.get('sku'),
@@ -120,7 +206,10 @@ def create_product():
         )
         
         db.session.add(product)
-        db.session.commit()
+        with sqlite_category_summary.recording():
+            db.session.commit()
+            sqlite_category_summary.product_changed(new=product.to_dict())
+        catalog_generation.bump()
         
         return jsonify({
             'success': True,
@@ -138,7 +227,9 @@ def create_product():
 def update_product(product_id):
     """Update a product (for admin use)"""
     try:
+        pricing_engine.reload_if_changed()
         product = Product.query.get_or_404(product_id)
+        old = product.to_dict()
         data = request.get_json()
         
         # Update fields if provided
@@ -150,17 +241,14 @@ def update_product(product_id):
             product.category = data['category']
         if 'cost_price' in data:
             product.cost_price = float(data['cost_price'])
-            # Recalculate selling price
-            product.selling_price = Product.calculate_selling_price(
-                product.cost_price, 
-                product.delivery_cost
-            )
         if 'delivery_cost' in data:
             product.delivery_cost = float(data['delivery_cost'])
-            # Recalculate selling price
+        if data.keys() & {'cost_price', 'delivery_cost', 'category'}:
+            # Recalculate selling price, markups depend on the category
             product.selling_price = Product.calculate_selling_price(
                 product.cost_price, 
-                product.delivery_cost
+                product.delivery_cost,
+                product.category
             )
         if 'stock_quantity' in data:
             product.stock_quantity = int(data['stock_quantity'])
@@ -171,7 +259,10 @@ def update_product(product_id):
         if 'supplier' in data:
             product.supplier = data['supplier']
         
-        db.session.commit()
+        with sqlite_category_summary.recording():
+            db.session.commit()
+            sqlite_category_summary.product_changed(old, product.to_dict())
+        catalog_generation.bump()
         
         return jsonify({
             'success': True,
@@ -190,8 +281,12 @@ def delete_product(product_id):
     """Delete a product (for admin use)"""
     try:
         product = Product.query.get_or_404(product_id)
+        old = product.to_dict()
         db.session.delete(product)
-        db.session.commit()
+        with sqlite_category_summary.recording():
+            db.session.commit()
+            sqlite_category_summary.product_changed(old=old)
+        catalog_generation.bump()
         
         return jsonify({
             'success': True,
@@ -207,17 +302,132 @@ def delete_product(product_id):
 
 @products_bp.route('/sync-products', methods=['POST'])
 def sync_products():
-    """Trigger product synchronization from FTP feed"""
+    """
+    Start product synchronization from FTP feed in the background
+    
+    Returns a job id straight away; poll /api/sync-jobs/<job_id> for progress.
+    A request made while the same sync is queued or running joins that job.
+    Pass ?wait=true to block until the sync finishes, and ?stock_only=true
+    for the stock and price only sync.
+    """
     try:
-        # This will be implemented in the FTP sync module
         from src.services.ftp_sync import sync_bikeit_products
+        from src.services.sync_jobs import sync_job_manager
+        
+        stock_only = request.args.get('stock_only', 'false').lower() == 'true'
         
-        result = sync_bikeit_products()
+        job, coalesced = sync_job_manager.submit(
+            sync_bikeit_products,
+            app=current_app._get_current_object(),
+            stock_only=stock_only
+        )
+        
+        if request.args.get('wait', 'false').lower() == 'true':
+            job.done.wait()
+            return jsonify({
+                'success': True,
+                'message': 'Product synchronization completed',
+                'job_id': job.job_id,
+                'result': job.result if job.result is not None else {'error': job.error}
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': 'Joined running product synchronization' if coalesced else 'Product synchronization started',
+            'job_id': job.job_id,
+            'coalesced': coalesced,
+            'status_url': f'/api/sync-jobs/{job.job_id}'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/reprice-products', methods=['POST'])
+def reprice_products():
+    """
+    Recompute every stored selling price with the current pricing rules in the background
+    
+    Returns a job id to poll at /api/sync-jobs/<job_id>, or the result with ?wait=true.
+    """
+    try:
+        from src.services.ftp_sync import reprice_products as reprice_catalog
+        from src.services.sync_jobs import sync_job_manager
+        
+        job, coalesced = sync_job_manager.submit(reprice_catalog, app=current_app._get_current_object())
+        
+        if request.args.get('wait', 'false').lower() == 'true':
+            job.done.wait()
+            return jsonify({
+                'success': True,
+                'message': 'Repricing completed',
+                'job_id': job.job_id,
+                'result': job.result if job.result is not None else {'error': job.error}
+            })
         
         return jsonify({
             'success': True,
-            'message': 'Product synchronization completed',
-            'result': result
+            'message': 'Joined running repricing' if coalesced else 'Repricing started',
+            'job_id': job.job_id,
+            'coalesced': coalesced,
+            'status_url': f'/api/sync-jobs/{job.job_id}'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/sync-jobs/<job_id>', methods=['GET'])
+def get_sync_job(job_id):
+    """Get the status, current stage, rows processed and result of a sync job"""
+    try:
+        from src.services.sync_jobs import sync_job_manager
+        
+        job = sync_job_manager.get(job_id)
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Sync job not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job.to_dict()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/sync-runs', methods=['GET'])
+def get_sync_runs():
+    """Get stage timings and counters of the most recent sync runs (for admin use)"""
+    try:
+        from src.services.sync_metrics import sync_run_history
+        
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'limit must be an integer'
+            }), 400
+        
+        # No more than the history keeps
+        limit = min(max(limit, 0), sync_run_history.size)
+        runs = sync_run_history.recent(limit)
+        
+        return jsonify({
+            'success': True,
+            'runs': runs,
+            'count': len(runs)
         })
         
     except Exception as e:
@@ -226,3 +436,80 @@ def sync_products():
             'error': str(e)
         }), 500
 
+
+def price_history_query():
+    """The start, end and fields query parameters of the price history endpoints"""
+    from datetime import date
+    from src.services.price_history import TRACKED_FIELDS
+    
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    for value in (start, end):
+        if value:
+            # Raises ValueError for anything but YYYY-MM-DD
+            date.fromisoformat(value)
+    
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or None
+    unknown = set(fields or ()) - set(TRACKED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    return {'start': start, 'end': end, 'fields': fields}
+
+@products_bp.route('/price-history/products/<path:sku>', methods=['GET'])
+def get_product_price_history(sku):
+    """Get the price and stock changes of one product, by SKU"""
+    try:
+        from src.services.price_history import price_history
+        
+        try:
+            query = price_history_query()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        history = price_history.product_history(sku, **query)
+        
+        return jsonify({
+            'success': True,
+            'sku': sku,
+            'history': history,
+            'count': len(history)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/price-history/categories/<path:category>', methods=['GET'])
+def get_category_price_history(category):
+    """Get the price and stock changes of the products in a category, by SKU"""
+    try:
+        from src.services.price_history import price_history
+        
+        try:
+            query = price_history_query()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        history = price_history.category_history(category, **query)
+        
+        return jsonify({
+            'success': True,
+            'category': category,
+            'products': history,
+            'count': len(history)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
@@ -1,5 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, send_file
 from src.services.supabase_client import supabase_service
+from src.services.pricing import pricing_engine
+from src.services.search_index import search_index
+from src.services.catalog_cache import catalog_generation, catalog_response
+from src.services.category_summary import supabase_category_summary
+from src.services.pagination import (
+    Keyset, CursorError, PRODUCT_SORT_COLUMNS, count_cache, cursor_page, offset_page, pagination_args
+)
 import os
 from dotenv import load_dotenv
 
@@ -8,6 +15,7 @@ load_dotenv()
 products_bp = Blueprint('products', __name__)
 
 @products_bp.route('/products', methods=['GET'])
+@catalog_response
 def get_products():
     """Get all products with optional search and category filtering"""
     try:
@@ -17,6 +25,32 @@ def get_products():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
         
+        # Clients that send a cursor (empty for the first page) get keyset pagination
+        if 'cursor' in request.args:
+            return product_cursor_page(search or None, category or None)
+        
+        # Searches are ranked by the in-memory index, only the page of products is fetched
+        found = search_index.search(search, category or None, (page - 1) * per_page, per_page) if search else None
+        
+        if found is not None:
+            product_ids, total = found
+            result = supabase_service.get_products_by_ids(product_ids)
+            
+            if not result['success']:
+                return jsonify(result), 500
+            
+            return jsonify({
+                'success': True,
+                'products': result['products'],
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': total,
+                    'has_next': page * per_page < total,
+                    'has_prev': page > 1
+                }
+            })
+        
         # Get products from Supabase
         result = supabase_service.get_products(
             search=search if search else None,
@@ -46,7 +80,65 @@ def get_products():
             'error': str(e)
         }), 500
 
+def product_cursor_page(search, category):
+    """
+    A page of products listed by cursor
+    
+    Products are sorted by the sort parameter, or in relevance order for
+    searches, where the cursor holds the offset into the ranked results.
+    """
+    try:
+        cursor, sort, per_page, include_total = pagination_args(request.args, 'id')
+        
+        if search:
+            if 'sort' in request.args:
+                raise CursorError("Search results are sorted by relevance")
+            
+            def fetch(offset, limit):
+                found = search_index.search(search, category, offset, limit)
+                if found is None:
+                    result = supabase_service.get_products(search=search, category=category, per_page=limit, offset=offset)
+                else:
+                    result = supabase_service.get_products_by_ids(found[0])
+                if not result['success']:
+                    raise Exception(result['error'])
+                return result['products']
+            
+            products, pagination = offset_page(fetch, cursor, per_page)
+        else:
+            keyset = Keyset(sort, PRODUCT_SORT_COLUMNS)
+            
+            def fetch(after, backward, limit):
+                result = supabase_service.get_products_page(keyset, after, backward, limit, category)
+                if not result['success']:
+                    raise Exception(result['error'])
+                return result['products']
+            
+            products, pagination = cursor_page(fetch, keyset, cursor, per_page)
+        
+    except CursorError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if include_total:
+        def count():
+            found = search_index.search(search, category, 0, 0) if search else None
+            if found is not None:
+                return found[1]
+            result = supabase_service.count_products(search, category)
+            if not result['success']:
+                raise Exception(result['error'])
+            return result['count']
+        
+        pagination['total'] = count_cache.get(('products', catalog_generation.current(), search, category), count)
+    
+    return jsonify({
+        'success': True,
+        'products': products,
+        'pagination': pagination
+    })
+
 @products_bp.route('/products/<int:product_id>', methods=['GET'])
+@catalog_response
 def get_product(product_id):
     """Get a single product by ID"""
     try:
@@ -63,17 +155,67 @@ def get_product(product_id):
             'error': str(e)
         }), 500
 
+@products_bp.route('/products/<int:product_id>/image', methods=['GET'])
+def get_product_image(product_id):
+    """Serve a product's image from the local image cache, resized with ?size=thumb or listing"""
+    try:
+        from src.services.image_cache import image_cache, ImageError, ImageTimeout, SERVE_MAX_AGE
+        
+        result = supabase_service.get_product_by_id(product_id)
+        
+        if not result['success']:
+            return jsonify(result), 404 if 'not found' in result.get('error', '').lower() else 500
+        
+        image_url = result['product'].get('image_url')
+        
+        if not image_url:
+            return jsonify({
+                'success': False,
+                'error': 'Product image not found'
+            }), 404
+        
+        try:
+            path, content_type, etag = image_cache.get(image_url, request.args.get('size', 'original'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except ImageTimeout as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 504
+        except ImageError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 502
+        
+        # The ETag is the image content's hash, so If-None-Match gets a 304
+        response = send_file(path, mimetype=content_type, etag=etag, max_age=SERVE_MAX_AGE, conditional=True)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        return response
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @products_bp.route('/products/categories', methods=['GET'])
+@catalog_response
 def get_categories():
-    """Get all unique product categories"""
+    """Get the categories of the products for sale, with their product counts and price ranges"""
     try:
-        result = supabase_service.get_categories()
+        summary = supabase_category_summary.categories()
+        
+        return jsonify({
+            'success': True,
+            'categories': [category['name'] for category in summary],
+            'summary': summary
+        })
         
-        if result['success']:
-            return jsonify(result)
-        else:
-            return jsonify(result), 500
-            
     except Exception as e:
         return jsonify({
             'success': False,
@@ -84,12 +226,14 @@ def get_categories():
 def create_product():
     """Create a new product (for admin use)"""
     try:
+        # Price with the current rules file, which the scheduler may have seen change
+        pricing_engine.reload_if_changed()
         data = request.get_json()
         
         # Calculate selling price
         cost_price = float(data.get('cost_price', 0))
-        delivery_cost = float(data.get('delivery_cost', 6.0))
-        selling_price = (cost_price * 1.5) + delivery_cost
+        delivery_cost = float(data.get('delivery_cost', pricing_engine.delivery_cost))
+        selling_price = pricing_engine.price(cost_price, data.get('category', ''), delivery_cost)
         
         product_data = {
             'sku': data.get('sku'),
@@ -105,9 +249,14 @@ def create_product():
             'supplier': data.get('supplier', 'Bike It')
         }
         
-        result = supabase_service.create_product(product_data)
+        with supabase_category_summary.recording():
+            result = supabase_service.create_product(product_data)
+            if result['success']:
+                supabase_category_summary.product_changed(new=result['product'])
         
         if result['success']:
+            search_index.product_written(result['product'])
+            catalog_generation.bump()
             return jsonify(result), 201
         else:
             return jsonify(result), 500
@@ -122,8 +271,13 @@ def create_product():
 def update_product(product_id):
     """Update a product (for admin use)"""
     try:
+        pricing_engine.reload_if_changed()
         data = request.get_json()
         
+        current = supabase_service.get_product_by_id(product_id)
+        if not current['success']:
+            return jsonify(current), 404 if current['error'] == 'Product not found' else 500
+        
         # Prepare update data
         update_data = {}
         
@@ -134,18 +288,17 @@ def update_product(product_id):
         if 'category' in data:
             update_data['category'] = data['category']
         if 'cost_price' in data:
-            cost_price = float(data['cost_price'])
-            update_data['cost_price'] = cost_price
-            # Recalculate selling price
-            delivery_cost = float(data.get('delivery_cost', 6.0))
-            update_data['selling_price'] = (cost_price * 1.5) + delivery_cost
+            update_data['cost_price'] = float(data['cost_price'])
         if 'delivery_cost' in data:
-            delivery_cost = float(data['delivery_cost'])
-            update_data['delivery_cost'] = delivery_cost
-            # Recalculate selling price if cost_price is available
-            if 'cost_price' in data:
-                cost_price = float(data['cost_price'])
-                update_data['selling_price'] = (cost_price * 1.5) + delivery_cost
+            update_data['delivery_cost'] = float(data['delivery_cost'])
+        if data.keys() & {'cost_price', 'delivery_cost', 'category'}:
+            # Recalculate selling price, filling in the values not being changed
+            product = dict(current['product'], **update_data)
+            update_data['selling_price'] = pricing_engine.price(
+                float(product['cost_price']),
+                product.get('category'),
+                float(product['delivery_cost']) if product.get('delivery_cost') is not None else None
+            )
         if 'stock_quantity' in data:
             update_data['stock_quantity'] = int(data['stock_quantity'])
         if 'in_stock' in data:
@@ -157,9 +310,14 @@ def update_product(product_id):
         
         update_data['updated_at'] = 'NOW()'
         
-        result = supabase_service.update_product(product_id, update_data)
+        with supabase_category_summary.recording():
+            result = supabase_service.update_product(product_id, update_data)
+            if result['success']:
+                supabase_category_summary.product_changed(current['product'], result['product'])
         
         if result['success']:
+            search_index.product_written(result['product'])
+            catalog_generation.bump()
             return jsonify(result)
         else:
             return jsonify(result), 500
@@ -174,9 +332,14 @@ def update_product(product_id):
 def delete_product(product_id):
     """Delete a product (for admin use)"""
     try:
-        result = supabase_service.delete_product(product_id)
+        with supabase_category_summary.recording():
+            result = supabase_service.delete_product(product_id)
+            if result['success']:
+                supabase_category_summary.product_changed(old=result['product'])
         
         if result['success']:
+            search_index.product_deleted(product_id)
+            catalog_generation.bump()
             return jsonify({
                 'success': True,
                 'message': 'Product deleted successfully'
@@ -192,17 +355,181 @@ def delete_product(product_id):
 
 @products_bp.route('/sync-products', methods=['POST'])
 def sync_products():
-    """Trigger product synchronization from FTP feed"""
+    """
+    Start product synchronization from FTP feed in the background
+    
+    Returns a job id straight away; poll /api/sync-jobs/<job_id> for progress.
+    A request made while the same sync is queued or running joins that job.
+    Pass ?wait=true to block until the sync finishes, and ?stock_only=true
+    for the stock and price only sync.
+    """
     try:
-        # Import the sync function
         from src.services.ftp_sync_supabase import sync_bikeit_products
+        from src.services.sync_jobs import sync_job_manager
+        
+        stock_only = request.args.get('stock_only', 'false').lower() == 'true'
+        
+        job, coalesced = sync_job_manager.submit(
+            sync_bikeit_products,
+            app=current_app._get_current_object(),
+            stock_only=stock_only
+        )
+        
+        if request.args.get('wait', 'false').lower() == 'true':
+            job.done.wait()
+            return jsonify({
+                'success': True,
+                'message': 'Product synchronization completed',
+                'job_id': job.job_id,
+                'result': job.result if job.result is not None else {'error': job.error}
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': 'Joined running product synchronization' if coalesced else 'Product synchronization started',
+            'job_id': job.job_id,
+            'coalesced': coalesced,
+            'status_url': f'/api/sync-jobs/{job.job_id}'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/reprice-products', methods=['POST'])
+def reprice_products():
+    """
+    Recompute every stored selling price with the current pricing rules in the background
+    
+    Returns a job id to poll at /api/sync-jobs/<job_id>, or the result with ?wait=true.
+    """
+    try:
+        from src.services.ftp_sync_supabase import reprice_products as reprice_catalog
+        from src.services.sync_jobs import sync_job_manager
+        
+        job, coalesced = sync_job_manager.submit(reprice_catalog, app=current_app._get_current_object())
+        
+        if request.args.get('wait', 'false').lower() == 'true':
+            job.done.wait()
+            return jsonify({
+                'success': True,
+                'message': 'Repricing completed',
+                'job_id': job.job_id,
+                'result': job.result if job.result is not None else {'error': job.error}
+            })
+        
+        return jsonify({
+            'success': True,
+            'message': 'Joined running repricing' if coalesced else 'Repricing started',
+            'job_id': job.job_id,
+            'coalesced': coalesced,
+            'status_url': f'/api/sync-jobs/{job.job_id}'
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/sync-jobs/<job_id>', methods=['GET'])
+def get_sync_job(job_id):
+    """Get the status, current stage, rows processed and result of a sync job"""
+    try:
+        from src.services.sync_jobs import sync_job_manager
+        
+        job = sync_job_manager.get(job_id)
+        
+        if not job:
+            return jsonify({
+                'success': False,
+                'error': 'Sync job not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'job': job.to_dict()
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@products_bp.route('/sync-runs', methods=['GET'])
+def get_sync_runs():
+    """Get stage timings and counters of the most recent sync runs (for admin use)"""
+    try:
+        from src.services.sync_metrics import sync_run_history
+        
+        try:
+            limit = int(request.args.get('limit', 10))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'limit must be an integer'
+            }), 400
+        
+        # No more than the history keeps
+        limit = min(max(limit, 0), sync_run_history.size)
+        runs = sync_run_history.recent(limit)
+        
+        return jsonify({
+            'success': True,
+            'runs': runs,
+            'count': len(runs)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+def price_history_query():
+    """The start, end and fields query parameters of the price history endpoints"""
+    from datetime import date
+    from src.services.price_history import TRACKED_FIELDS
+    
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    for value in (start, end):
+        if value:
+            # Raises ValueError for anything but YYYY-MM-DD
+            date.fromisoformat(value)
+    
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or None
+    unknown = set(fields or ()) - set(TRACKED_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    return {'start': start, 'end': end, 'fields': fields}
+
+@products_bp.route('/price-history/products/<path:sku>', methods=['GET'])
+def get_product_price_history(sku):
+    """Get the price and stock changes of one product, by SKU"""
+    try:
+        from src.services.price_history import price_history
+        
+        try:
+            query = price_history_query()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        result = sync_bikeit_products()
+        history = price_history.product_history(sku, **query)
         
         return jsonify({
             'success': True,
-            'message': 'Product synchronization completed',
-            'result': result
+            'sku': sku,
+            'history': history,
+            'count': len(history)
         })
         
     except Exception as e:
@@ -211,3 +538,31 @@ def sync_products():
             'error': str(e)
         }), 500
 
+@products_bp.route('/price-history/categories/<path:category>', methods=['GET'])
+def get_category_price_history(category):
+    """Get the price and stock changes of the products in a category, by SKU"""
+    try:
+        from src.services.price_history import price_history
+        
+        try:
+            query = price_history_query()
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        history = price_history.category_history(category, **query)
+        
+        return jsonify({
+            'success': True,
+            'category': category,
+            'products': history,
+            'count': len(history)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
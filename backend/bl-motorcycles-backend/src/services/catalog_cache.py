@@ -0,0 +1,163 @@
+import functools
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from flask import current_app, make_response, request
+
+from src.services.journal import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Shared by the web workers, the scheduler and cron runs, like the sync locks
+GENERATION_FILE = os.getenv('CATALOG_GENERATION_FILE', os.path.join(
+    os.getenv('FEED_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')), 'catalog_generation'
+))
+
+# Catalog responses kept in memory by each process
+RESPONSE_CACHE_SIZE = int(os.getenv('CATALOG_RESPONSE_CACHE_SIZE', 1024))
+
+class CatalogGeneration:
+    """
+    Counter of changes to the catalog, shared between processes
+
+    Every sync and admin write bumps it, rewriting the generation file with
+    the next count under a file lock. The file also holds a random id
+    picked when it is created, so a recreated file never repeats an old
+    generation. Reading it is a single stat while the file is unchanged.
+    """
+
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path or GENERATION_FILE)
+        # (stat of the file, generation read from it)
+        self.cached = None
+
+    def current(self):
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            return '0'
+
+        stamp = (info.st_ino, info.st_size, info.st_mtime_ns, info.st_ctime_ns)
+        cached = self.cached
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        generation = self._read() or '0'
+        self.cached = (stamp, generation)
+        return generation
+
+    def bump(self):
+        """Start a new generation; call after the catalog change is written"""
+        try:
+            with file_lock(self.path):
+                epoch, count = self._parse(self._read())
+                tmp_path = f'{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(f'{epoch}-{count + 1}\n')
+                os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Failed to bump the catalog generation, cached catalog responses may be stale: {e}")
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _parse(self, generation):
+        """(epoch, count) of a generation, a new epoch when there is none yet"""
+        epoch, _, count = (generation or '').rpartition('-')
+        if epoch and count.isdigit():
+            return epoch, int(count)
+        return uuid.uuid4().hex[:8], 0
+
+class ResponseCache:
+    """
+    Bounded LRU of catalog response bodies, keyed by generation and request
+
+    Entries from older generations can never be hit again, so the cache is
+    emptied whenever the generation moves on.
+    """
+
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.generation = None
+        self.entries = OrderedDict()
+
+    def get(self, generation, key):
+        with self.lock:
+            if generation != self.generation:
+                return None
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, generation, key, entry):
+        with self.lock:
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+            self.entries[key] = entry
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+def request_key():
+    """The request's path and its non-empty query parameters in a canonical order"""
+    params = sorted((name, value.strip()) for name, value in request.args.items(multi=True) if value.strip())
+    return request.path, tuple(params)
+
+def catalog_response(view):
+    """
+    Decorator serving a catalog read endpoint from the response cache
+
+    Successful responses are cached until the next catalog generation and
+    carry an ETag of the generation, so clients revalidating with
+    If-None-Match get a 304 without the view running.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        generation = catalog_generation.current()
+        etag = f'catalog-{generation}'
+
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            key = request_key()
+            entry = response_cache.get(generation, key)
+
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response_cache.put(generation, key, (response.get_data(), response.mimetype))
+            else:
+                body, mimetype = entry
+                response = current_app.response_class(body, mimetype=mimetype)
+
+        response.set_etag(etag)
+        # Browsers check back every time, getting a 304 while the catalog is unchanged
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+def invalidates_catalog(func):
+    """Decorator bumping the catalog generation after a sync, unless it was skipped"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            if not (isinstance(result, dict) and result.get('skipped')):
+                catalog_generation.bump()
+    return wrapper
+
+# Global catalog generation and response cache
+catalog_generation = CatalogGeneration()
+response_cache = ResponseCache()
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+from functools import lru_cache
+
+UNCATEGORIZED = 'Uncategorized'
+
+# Keyword -> shop category, in priority order (the first matching keyword wins)
+CATEGORY_KEYWORDS = (
+    ('brake', 'Brakes & ABS'),
+    ('suspension', 'Suspension & Steering'),
+    ('shock', 'Suspension & Steering'),
+    ('steering', 'Suspension & Steering'),
+    ('electrical', 'Electrical & Lighting'),
+    ('lighting', 'Electrical & Lighting'),
+    ('light', 'Electrical & Lighting'),
+    ('bulb', 'Electrical & Lighting'),
+    ('engine', 'Engine & Performance'),
+    ('performance', 'Engine & Performance'),
+    ('exhaust', 'Engine & Performance'),
+    ('transmission', 'Transmission & Clutch'),
+    ('clutch', 'Transmission & Clutch'),
+    ('chain', 'Transmission & Clutch'),
+    ('sprocket', 'Transmission & Clutch'),
+    ('wheel', 'Wheels & Tyres'),
+    ('tyre', 'Wheels & Tyres'),
+    ('tire', 'Wheels & Tyres'),
+    ('rim', 'Wheels & Tyres'),
+    ('body', 'Body & Fairings'),
+    ('fairing', 'Body & Fairings'),
+    ('panel', 'Body & Fairings'),
+    ('cooling', 'Cooling & Lubrication'),
+    ('radiator', 'Cooling & Lubrication'),
+    ('oil', 'Cooling & Lubrication'),
+    ('fuel', 'Fuel & Air'),
+    ('air', 'Fuel & Air'),
+    ('filter', 'Fuel & Air'),
+    ('battery', 'Batteries & Charging'),
+    ('charging', 'Batteries & Charging'),
+    ('tool', 'Tools & Maintenance'),
+    ('maintenance', 'Tools & Maintenance'),
+    ('security', 'Security & Locks'),
+    ('lock', 'Security & Locks'),
+    ('luggage', 'Luggage & Storage'),
+    ('storage', 'Luggage & Storage'),
+    ('bag', 'Luggage & Storage'),
+    ('clothing', 'Clothing & Protection'),
+    ('protection', 'Clothing & Protection'),
+    ('helmet', 'Clothing & Protection'),
+    ('glove', 'Clothing & Protection'),
+    ('cover', 'Covers & Accessories'),
+    ('accessory', 'Covers & Accessories'),
+)
+
+# Distinct category hints remembered by classify_category
+HINT_CACHE_SIZE = int(os.getenv('CATEGORY_HINT_CACHE_SIZE', 4096))
+
+# Fall back to the product name and description when the category column is blank
+CLASSIFY_FROM_PRODUCT_TEXT = os.getenv('CLASSIFY_FROM_PRODUCT_TEXT', 'false').lower() == 'true'
+
+# A zero-width lookahead reports a match at every position, including
+# overlapping ones. Alternatives are tried in priority order, so each match
+# is the highest priority keyword starting at that position.
+_KEYWORD_PATTERN = re.compile(
+    '(?=(' + '|'.join(re.escape(keyword) for keyword, _ in CATEGORY_KEYWORDS) + '))'
+)
+_KEYWORD_PRIORITY = {keyword: priority for priority, (keyword, _) in enumerate(CATEGORY_KEYWORDS)}
+
+# Changes with the keywords and the product text fallback, so categories
+# classified while parsing aren't replayed from the ParsedFeedCache after either changes
+CLASSIFIER_VERSION = hashlib.sha256(
+    repr((CATEGORY_KEYWORDS, CLASSIFY_FROM_PRODUCT_TEXT)).encode('utf-8')
+).hexdigest()[:12]
+
+
+def match_category(text):
+    """Return the category of the highest priority keyword found in text, or None"""
+    best = None
+
+    for match in _KEYWORD_PATTERN.finditer(text.lower()):
+        priority = _KEYWORD_PRIORITY[match.group(1)]
+        if best is None or priority < best:
+            best = priority
+            if priority == 0:
+                break
+
+    return CATEGORY_KEYWORDS[best][1] if best is not None else None
+
+
+@lru_cache(maxsize=HINT_CACHE_SIZE)
+def _classify_hint(category_hint):
+    return match_category(category_hint) or UNCATEGORIZED
+
+
+def classify_category(category_hint, name=None, description=None, use_product_text=None):
+    """
+    Map a supplier category hint to one of the shop's categories
+
+    Feeds repeat the same few hundred hints, so results are memoized per hint.
+    When the hint is blank and use_product_text (or CLASSIFY_FROM_PRODUCT_TEXT)
+    is set, the product name and then its description are tried instead.
+    """
+    if category_hint:
+        return _classify_hint(category_hint)
+
+    if use_product_text is None:
+        use_product_text = CLASSIFY_FROM_PRODUCT_TEXT
+
+    if use_product_text:
+        for text in (name, description):
+            category = match_category(text) if text else None
+            if category:
+                return category
+
+    return UNCATEGORIZED
@@ -0,0 +1,196 @@
+import functools
+import logging
+import os
+import threading
+
+from src.services.journal import Journal
+
+logger = logging.getLogger(__name__)
+
+# Shared by the web workers, the scheduler and cron runs, like the sync locks
+SUMMARY_DIR = os.getenv('CATEGORY_SUMMARY_DIR', os.getenv(
+    'FEED_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')
+))
+
+class CategorySummary:
+    """
+    Per-category product count, in-stock count and price range of the products for sale
+
+    The summary is kept in a file shared between processes. Its first line
+    is a snapshot of every category, written by rebuild() after each sync
+    from one aggregate query. Admin writes append a line with the product's
+    values before and after the change, which readers apply to the
+    snapshot. Each process keeps the summary in memory and only reads what
+    was appended since its last read, so serving it costs one stat. Admin
+    writes hold recording() from the write until its line is appended, so
+    a rebuild either counts the write or is followed by its line.
+
+    Removing a product that held its category's lowest or highest price
+    leaves the range unknown; the next read then rebuilds the summary.
+    """
+
+    def __init__(self, name, compute):
+        self.compute = compute
+        self.journal = Journal(os.path.join(SUMMARY_DIR, f'category_summary-{name}.log'))
+        self.lock = threading.Lock()
+        # category -> [product count, in-stock count, min price, max price]
+        self.stats = None
+        self.inexact = False
+
+    def categories(self):
+        """Summary of each category, sorted by name"""
+        with self.lock:
+            self._read()
+            if self.stats is None or self.inexact:
+                self._rebuild()
+                self._read()
+            if self.stats is None:
+                raise Exception("Category summary unavailable")
+
+            return [{
+                'name': category,
+                'product_count': count,
+                'in_stock_count': in_stock,
+                'min_price': min_price,
+                'max_price': max_price,
+            } for category, (count, in_stock, min_price, max_price) in sorted(self.stats.items())]
+
+    def rebuild(self):
+        """Recompute the whole summary from the database, replacing the shared file"""
+        with self.lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        stats = None
+        try:
+            # Admin writes wait, so none lands between the query and the new snapshot
+            with self.journal.locked(exclusive=True):
+                try:
+                    rows = self.compute()
+                except Exception as e:
+                    logger.error(f"Failed to compute the category summary: {e}")
+                    return
+
+                stats = {
+                    row['category']: [
+                        int(row['product_count']), int(row['in_stock_count']),
+                        float(row['min_price']), float(row['max_price'])
+                    ]
+                    for row in rows
+                }
+                self.journal.reset({'op': 'snapshot', 'categories': stats})
+        except OSError as e:
+            logger.error(f"Failed to write the category summary: {e}")
+            if stats is not None:
+                # Serve this process from the new values anyway
+                self.stats = stats
+                self.inexact = False
+
+    def recording(self):
+        """
+        Context manager to hold around an admin write and its product_changed() call
+
+        Rebuilds wait for it, while admin writes don't wait for each other.
+        """
+        return self.journal.locked()
+
+    def product_changed(self, old=None, new=None):
+        """
+        Record an admin write, given the product's values before and after it
+
+        old is None for a new product and new is None for a deleted one.
+        Call this after the write is committed, inside recording().
+        """
+        try:
+            self.journal.append({'op': 'change', 'old': summary_values(old), 'new': summary_values(new)})
+        except OSError as e:
+            logger.error(f"Failed to record a product change in the category summary: {e}")
+
+    def _read(self):
+        """Apply the lines appended to the shared file since the last read"""
+        for entry in self.journal.read():
+            if entry['op'] == 'snapshot':
+                self.stats = entry['categories']
+                self.inexact = False
+            elif entry['op'] == 'change' and self.stats is not None:
+                self._remove(entry['old'])
+                self._add(entry['new'])
+
+    def _add(self, values):
+        if values is None:
+            return
+        category, in_stock, price = values
+        stats = self.stats.get(category)
+        if stats is None:
+            self.stats[category] = [1, int(in_stock), price, price]
+        else:
+            stats[0] += 1
+            stats[1] += int(in_stock)
+            stats[2] = min(stats[2], price)
+            stats[3] = max(stats[3], price)
+
+    def _remove(self, values):
+        if values is None:
+            return
+        category, in_stock, price = values
+        stats = self.stats.get(category)
+        if stats is None:
+            # Not in the summary yet when it was computed
+            return
+
+        stats[0] -= 1
+        stats[1] -= int(in_stock)
+        if stats[0] <= 0:
+            del self.stats[category]
+        elif price in (stats[2], stats[3]):
+            self.inexact = True
+
+def summary_values(product):
+    """(category, in stock, selling price) of a product dict as counted by the summary, None when it isn't"""
+    if not product or not product.get('category') or product.get('discontinued_at') is not None:
+        return None
+    return product['category'], bool(product.get('in_stock')), float(product.get('selling_price') or 0.0)
+
+def refreshes_summary(summary):
+    """Decorator rebuilding a category summary after a sync, unless it was skipped"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                if not (isinstance(result, dict) and result.get('skipped')):
+                    summary.rebuild()
+        return wrapper
+    return decorator
+
+def compute_sqlite():
+    from sqlalchemy import case, func
+    from src.models.product import db, Product
+    rows = db.session.query(
+        Product.category,
+        func.count(Product.id),
+        func.sum(case((Product.in_stock, 1), else_=0)),
+        func.min(Product.selling_price),
+        func.max(Product.selling_price)
+    ).filter(
+        Product.discontinued_at.is_(None), Product.category.isnot(None), Product.category != ''
+    ).group_by(Product.category).all()
+
+    return [{
+        'category': category, 'product_count': count, 'in_stock_count': in_stock,
+        'min_price': min_price, 'max_price': max_price
+    } for category, count, in_stock, min_price, max_price in rows]
+
+def compute_supabase():
+    from src.services.supabase_client import supabase_service
+    result = supabase_service.get_category_summary()
+    if not result['success']:
+        raise Exception(result['error'])
+    return result['categories']
+
+# Global category summaries of each backend
+sqlite_category_summary = CategorySummary('sqlite', compute_sqlite)
+supabase_category_summary = CategorySummary('supabase', compute_supabase)
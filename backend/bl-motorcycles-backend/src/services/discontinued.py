@@ -0,0 +1,64 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# What happens to catalog products missing from a complete feed:
+# 'out_of_stock' zeroes their stock, 'soft_delete' also hides them from the
+# shop by setting discontinued_at, 'off' leaves them alone
+POLICY = os.getenv('DISCONTINUED_POLICY', 'out_of_stock')
+
+POLICIES = ('out_of_stock', 'soft_delete', 'off')
+
+# Give up, without touching anything, when more than this fraction of the
+# active catalog is newly missing from the feed, e.g. a truncated or wrong file
+MAX_FRACTION = float(os.getenv('DISCONTINUED_MAX_FRACTION', 0.2))
+
+def is_retired(policy, in_stock, stock_quantity, discontinued_at):
+    """Whether a catalog product has already been handled under the policy"""
+    if policy == 'soft_delete':
+        return discontinued_at is not None
+    return not in_stock and not stock_quantity
+
+def plan_discontinued(catalog, feed_skus, policy=None, max_fraction=None):
+    """
+    Find the catalog products missing from a complete feed
+
+    catalog is an iterable of (sku, in_stock, stock_quantity, discontinued_at)
+    rows and feed_skus the set of SKUs seen in the feed. Returns the SKUs
+    to mark under the policy, and a report for the sync result. Products
+    already retired stay in the catalog but don't count as missing again.
+    Nothing is returned to mark when more than max_fraction of the active
+    catalog, the products not yet retired, is missing.
+    """
+    policy = policy or POLICY
+    max_fraction = MAX_FRACTION if max_fraction is None else max_fraction
+
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown discontinued product policy: {policy}")
+
+    report = {'policy': policy, 'catalog': 0, 'retired': 0, 'missing': 0, 'marked': 0, 'aborted': False}
+    if policy == 'off':
+        return [], report
+
+    to_mark = []
+    for sku, in_stock, stock_quantity, discontinued_at in catalog:
+        report['catalog'] += 1
+        if sku in feed_skus:
+            continue
+        if is_retired(policy, in_stock, stock_quantity, discontinued_at):
+            report['retired'] += 1
+        else:
+            report['missing'] += 1
+            to_mark.append(sku)
+
+    active = report['catalog'] - report['retired']
+    if active and report['missing'] > active * max_fraction:
+        logger.error(
+            f"{report['missing']} of {active} active catalog products are missing from the feed, "
+            f"more than the {max_fraction:.0%} limit; not marking any as discontinued"
+        )
+        report['aborted'] = True
+        return [], report
+
+    return to_mark, report
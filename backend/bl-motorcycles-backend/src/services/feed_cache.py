@@ -0,0 +1,205 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from src.services.feed_stream import DEFAULT_BLOCK_SIZE
+from src.services.sync_metrics import record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')
+
+class FeedCache:
+    """
+    Local copies of the supplier feed files and the remote metadata they were fetched at
+
+    Each feed file has two slots on disk: the last good copy, which was
+    successfully synced into the database, and a pending copy that has been
+    downloaded but not synced yet. The state file records the remote size,
+    mtime and SHA-256 of each copy so unchanged feeds can be skipped before
+    downloading anything.
+
+    namespace keeps a separate state and set of copies for a sync mode, so
+    e.g. the stock-only sync doesn't mark a feed as synced for the full sync.
+    """
+
+    def __init__(self, cache_dir=None, namespace=None):
+        self.cache_dir = os.path.abspath(cache_dir or os.getenv('FEED_CACHE_DIR', DEFAULT_CACHE_DIR))
+        if namespace:
+            self.cache_dir = os.path.join(self.cache_dir, namespace)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.state_file = os.path.join(self.cache_dir, 'feed_state.json')
+        self.state = self.load_state()
+
+        # Several feed files may be fetched in parallel
+        self.lock = threading.RLock()
+
+    def load_state(self):
+        """Load the feed state file, starting fresh if it is missing or corrupt"""
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except (ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable feed state file: {e}")
+            state = {}
+
+        state.setdefault('good', {})
+        state.setdefault('pending', {})
+        return state
+
+    def save_state(self):
+        """Write the feed state file atomically"""
+        with self.lock:
+            tmp_path = self.state_file + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.state_file)
+
+    def local_path(self, feed_file, slot='good'):
+        """Path of the local copy of a feed file"""
+        name = os.path.basename(feed_file)
+        return os.path.join(self.cache_dir, name if slot == 'good' else f'{name}.{slot}')
+
+    def _matches(self, slot, feed_file, remote_stat):
+        """Whether a slot holds a local copy fetched at the given remote size and mtime"""
+        entry = self.state[slot].get(feed_file)
+        return (
+            entry is not None
+            and entry['size'] == remote_stat.st_size
+            and entry['mtime'] == remote_stat.st_mtime
+            and os.path.exists(self.local_path(feed_file, slot))
+        )
+
+    def locate_feed_file(self, sftp, find_feed_file):
+        """
+        Return the feed file name and its remote stat
+
+        The last synced feed file is stat'ed directly, falling back to
+        find_feed_file (a directory listing) only when it has gone away.
+        """
+        feed_file = self.state.get('last_feed_file')
+
+        if feed_file:
+            try:
+                return feed_file, sftp.stat(feed_file)
+            except IOError:
+                logger.info(f"Previous feed file {feed_file} is no longer on the server")
+
+        feed_file = find_feed_file(sftp)
+
+        if not feed_file:
+            return None, None
+
+        return feed_file, sftp.stat(feed_file)
+
+    def fetch(self, sftp, feed_file, remote_stat):
+        """
+        Make sure a local copy of the feed file matches the remote one
+
+        Returns a dict whose status is 'unchanged' when the last good copy is
+        already up to date, 'cached' when a pending copy can be reused, or
+        'downloaded' after a fresh download, with the local copy's path and
+        SHA-256.
+        """
+        if self._matches('good', feed_file, remote_stat):
+            logger.info(f"Feed {feed_file} unchanged since last sync, skipping download")
+            return {'status': 'unchanged', 'path': self.local_path(feed_file),
+                    'sha256': self.state['good'][feed_file]['sha256']}
+
+        if self._matches('pending', feed_file, remote_stat):
+            logger.info(f"Reusing downloaded copy of {feed_file}")
+            return {'status': 'cached', 'path': self.local_path(feed_file, 'pending'),
+                    'sha256': self.state['pending'][feed_file]['sha256']}
+
+        content_hash, size = self.download(sftp, feed_file)
+        entry = {'size': remote_stat.st_size, 'mtime': remote_stat.st_mtime, 'sha256': content_hash}
+
+        with self.lock:
+            good = self.state['good'].get(feed_file)
+
+            # Re-uploaded with identical content, just refresh the metadata
+            if good and good['sha256'] == content_hash and os.path.exists(self.local_path(feed_file)):
+                os.remove(self.local_path(feed_file, 'pending'))
+                self.state['good'][feed_file].update(entry)
+                self.state['pending'].pop(feed_file, None)
+                self.save_state()
+                logger.info(f"Feed {feed_file} content unchanged since last sync")
+                return {'status': 'unchanged', 'path': self.local_path(feed_file), 'sha256': content_hash}
+
+            self.state['pending'][feed_file] = entry
+            self.save_state()
+
+        logger.info(f"Downloaded {size} bytes of {feed_file}")
+        return {'status': 'downloaded', 'path': self.local_path(feed_file, 'pending'), 'sha256': content_hash}
+
+    def download(self, sftp, feed_file):
+        """Stream the remote feed file into the pending slot, returning its SHA-256 and size"""
+        pending_path = self.local_path(feed_file, 'pending')
+        tmp_path = pending_path + '.part'
+        digest = hashlib.sha256()
+        size = 0
+
+        try:
+            with sftp.open(feed_file, 'r') as remote_file, open(tmp_path, 'wb') as local_file:
+                remote_file.prefetch()
+
+                while True:
+                    block = remote_file.read(DEFAULT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    digest.update(block)
+                    local_file.write(block)
+                    size += len(block)
+
+            os.replace(tmp_path, pending_path)
+            record('download', bytes=size)
+
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        return digest.hexdigest(), size
+
+    def mark_synced(self, feed_file, remember=True):
+        """
+        Promote the pending copy of a feed file to the last good copy
+
+        remember makes it the feed file checked first by locate_feed_file.
+        """
+        with self.lock:
+            entry = self.state['pending'].pop(feed_file, None)
+
+            if entry is not None:
+                os.replace(self.local_path(feed_file, 'pending'), self.local_path(feed_file))
+                entry['synced_at'] = time.time()
+                self.state['good'][feed_file] = entry
+
+            if remember:
+                self.state['last_feed_file'] = feed_file
+            self.save_state()
+
+    def has_pending(self):
+        """Whether a feed was downloaded but hasn't been synced yet"""
+        return any(os.path.exists(self.local_path(feed_file, 'pending')) for feed_file in self.state['pending'])
+
+    def latest_local_copy(self):
+        """
+        The newest local copy of the last feed file, for replaying without SFTP
+
+        Returns (feed_file, path, sha256), with a None path when there is no copy.
+        """
+        feed_file = self.state.get('last_feed_file') or next(iter(self.state['pending']), None)
+
+        if not feed_file:
+            return None, None, None
+
+        for slot in ('pending', 'good'):
+            if feed_file in self.state[slot] and os.path.exists(self.local_path(feed_file, slot)):
+                return feed_file, self.local_path(feed_file, slot), self.state[slot][feed_file].get('sha256')
+
+        return feed_file, None, None
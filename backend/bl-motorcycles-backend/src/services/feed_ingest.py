@@ -0,0 +1,376 @@
+import contextvars
+import csv
+import fnmatch
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import paramiko
+from src.services.feed_schema import FeedSchema
+from src.services.feed_stream import iter_decoded_lines
+from src.services.product_batch import ProductBatch
+from src.services.sync_metrics import record, stage
+
+logger = logging.getLogger(__name__)
+
+# File name patterns for each kind of feed file, matched case-insensitively
+FEED_FILE_PATTERNS = {
+    'catalogue': ('*catalog*.csv', '*product*.csv', '*feed*.csv'),
+    'stock': ('*stock*.csv', '*inventory*.csv'),
+    'price': ('*price*.csv',),
+}
+
+# Parallel SFTP channels used to download feed files
+DOWNLOAD_WORKERS = int(os.getenv('FEED_DOWNLOAD_WORKERS', 3))
+
+# Processes used to parse feed files (defaults to one per core)
+PARSE_WORKERS = int(os.getenv('FEED_PARSE_WORKERS', 0)) or os.cpu_count() or 1
+
+# Files larger than this are split into byte ranges parsed in parallel, cut
+# at record boundaries outside quoted fields (0 parses each file whole)
+SPLIT_BYTES = int(os.getenv('FEED_PARSE_SPLIT_BYTES', 8 * 1024 * 1024))
+
+# Block size of the quote scan that finds the record boundaries
+SCAN_BLOCK_SIZE = 1024 * 1024
+
+
+def discover_feed_files(sftp, path='.'):
+    """
+    Pick the newest remote file of each kind by name pattern and mtime
+
+    Returns {kind: SFTPAttributes}. When no file matches a pattern, the newest
+    CSV file is used as the catalogue.
+    """
+    attributes = [attr for attr in sftp.listdir_attr(path) if attr.filename.lower().endswith('.csv')]
+    logger.info(f"CSV files in FTP directory: {[attr.filename for attr in attributes]}")
+
+    feed_files = {}
+    claimed = set()
+
+    # Stock and price files are claimed first so e.g. product_stock.csv isn't a catalogue
+    for kind in ('stock', 'price', 'catalogue'):
+        matches = [
+            attr for attr in attributes
+            if attr.filename not in claimed
+            and any(fnmatch.fnmatch(attr.filename.lower(), pattern) for pattern in FEED_FILE_PATTERNS[kind])
+        ]
+        if matches:
+            newest = max(matches, key=lambda attr: attr.st_mtime or 0)
+            feed_files[kind] = newest
+            claimed.update(attr.filename for attr in matches)
+
+    if 'catalogue' not in feed_files:
+        unclaimed = [attr for attr in attributes if attr.filename not in claimed]
+        if unclaimed:
+            feed_files['catalogue'] = max(unclaimed, key=lambda attr: attr.st_mtime or 0)
+
+    return feed_files
+
+
+def download_feed_files(ssh, feed_cache, feed_files):
+    """
+    Fetch feed files into the local cache concurrently
+
+    Each worker opens its own SFTP channel on the existing SSH transport, so
+    there is only one SSH handshake. Returns {kind: fetch result}.
+    """
+    transport = ssh.get_transport()
+
+    def fetch(item):
+        kind, attr = item
+        sftp = paramiko.SFTPClient.from_transport(transport)
+        try:
+            return kind, feed_cache.fetch(sftp, attr.filename, attr)
+        finally:
+            sftp.close()
+
+    workers = max(1, min(DOWNLOAD_WORKERS, len(feed_files)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Each worker runs in a copy of our context so it can record to the current sync run
+        futures = [executor.submit(contextvars.copy_context().run, fetch, item) for item in feed_files.items()]
+        return dict(future.result() for future in futures)
+
+
+def split_byte_ranges(path, target_size=SPLIT_BYTES):
+    """
+    Read the header of a local feed file and split the rest into byte ranges of whole records
+
+    Returns (header, [(start, end), ...]). Each cut is moved forward to the
+    first line break outside a quoted field, so fields spanning several
+    lines stay in one range. A quote toggles quoting and an escaped quote
+    ("") toggles it twice, so a line break is a record boundary when an
+    even number of quotes precede it.
+    """
+    file_size = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        header_line = f.readline()
+        data_start = f.tell()
+
+        ranges = []
+        start = data_start
+        # Quote parity of the data up to position, which only moves forward
+        position, quoted = data_start, False
+
+        while start < file_size:
+            end = file_size
+            if target_size and start + target_size < file_size:
+                quoted = _scan_quotes(f, position, start + target_size, quoted)
+                end = _next_record_start(f, start + target_size, quoted)
+                position, quoted = end, False
+            ranges.append((start, end))
+            start = end
+
+    header = next(csv.reader([header_line.decode('utf-8')]), [])
+    return header, ranges
+
+
+def _scan_quotes(f, start, end, quoted):
+    """Quote parity after the bytes from start to end, given the parity at start"""
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = f.read(min(SCAN_BLOCK_SIZE, remaining))
+        if not block:
+            break
+        quoted ^= block.count(b'"') % 2 == 1
+        remaining -= len(block)
+    return quoted
+
+
+def _next_record_start(f, position, quoted):
+    """Offset just after the first line break at or after position that is outside quotes, or EOF"""
+    f.seek(position)
+    while True:
+        block = f.read(SCAN_BLOCK_SIZE)
+        if not block:
+            return position
+
+        offset = 0
+        while True:
+            newline = block.find(b'\n', offset)
+            if newline == -1:
+                quoted ^= block.count(b'"', offset) % 2 == 1
+                break
+            quoted ^= block.count(b'"', offset, newline) % 2 == 1
+            if not quoted:
+                return position + newline + 1
+            offset = newline + 1
+
+        position += len(block)
+
+
+def parse_feed_range(feed_sync_class, kind, path, header, start, end):
+    """
+    Parse one byte range of a local feed file (runs in a worker process)
+
+    Catalogue files produce a ProductBatch. Stock and price files produce
+    (sku, value) pairs for the columns they actually contain.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    lines = iter_decoded_lines(io.BytesIO(data))
+    feed_sync = feed_sync_class()
+
+    if kind == 'catalogue':
+        return kind, next(feed_sync.parse_batches(lines, batch_size=None, header=header), ProductBatch())
+
+    # Stock and price files only carry a couple of the product columns
+    schema = FeedSchema(header, warn_missing=False)
+    field, parse = {
+        'stock': ('stock_quantity', feed_sync.parse_int),
+        'price': ('cost_price', feed_sync.parse_price),
+    }[kind]
+
+    if schema.columns[field] is None:
+        return kind, []
+
+    extract = schema.extractor(('sku', field))
+    values = []
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        sku, value = extract(row)
+        if sku:
+            values.append((sku, parse(value)))
+
+    return kind, values
+
+
+def parse_feed_files(feed_sync_class, paths):
+    """
+    Parse local feed files in a process pool, splitting large files into byte ranges
+
+    paths is {kind: local path}. Returns {kind: [parsed part, ...]} with the
+    parts in file order.
+    """
+    tasks = []
+    for kind, path in paths.items():
+        header, ranges = split_byte_ranges(path)
+        tasks.extend((kind, path, header, start, end) for start, end in ranges)
+
+    parts = {kind: [] for kind in paths}
+    if not tasks:
+        return parts
+
+    workers = max(1, min(PARSE_WORKERS, len(tasks)))
+    logger.info(f"Parsing {len(paths)} feed files as {len(tasks)} ranges with {workers} processes")
+
+    # Syncs run in web and scheduler threads, where forking the process isn't safe
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as executor:
+        futures = [executor.submit(parse_feed_range, feed_sync_class, *task) for task in tasks]
+        for future in futures:
+            kind, part = future.result()
+            parts[kind].append(part)
+
+    return parts
+
+
+def merge_feed_parts(parts):
+    """
+    Merge parsed catalogue, stock and price parts by SKU
+
+    Later catalogue rows win for repeated SKUs. Stock and price files
+    override the catalogue values of SKUs the catalogue contains. Selling
+    price, stock status and fingerprint are filled in afterwards, when the
+    merged products are written.
+    """
+    products = ProductBatch.merge(parts.get('catalogue', []))
+    positions = {sku: index for index, sku in enumerate(products.skus)}
+
+    overridden = set()
+    for kind, column in (('stock', products.stock_quantities), ('price', products.cost_prices)):
+        for part in parts.get(kind, []):
+            for sku, value in part:
+                index = positions.get(sku)
+                if index is not None:
+                    column[index] = value
+                    overridden.add(sku)
+
+    logger.info(f"Merged {len(products)} products ({len(overridden)} with stock or price overrides)")
+    return products
+
+
+def ingest_feed_files(feed_sync, ssh, sftp, feed_cache, parsed_cache=None):
+    """
+    Discover, download, parse and merge all feed files
+
+    Returns (status, feed_files, products) where products is a ProductBatch
+    and status is 'missing' when no feed files were found, 'unchanged' when
+    none changed since the last sync, or 'changed'. With a ParsedFeedCache
+    the merged products are reused for the same set of feed contents.
+    """
+    with stage('discover'):
+        feed_files = discover_feed_files(sftp)
+
+    if 'catalogue' not in feed_files:
+        logger.warning("No catalogue feed file found in FTP directory")
+        return 'missing', {}, []
+
+    logger.info(f"Feed files: { {kind: attr.filename for kind, attr in feed_files.items()} }")
+
+    with stage('download'):
+        fetched = download_feed_files(ssh, feed_cache, feed_files)
+
+    if all(result['status'] == 'unchanged' for result in fetched.values()):
+        return 'unchanged', feed_files, []
+
+    with stage('parse'):
+        key = None
+        if parsed_cache is not None:
+            key = parsed_cache.key(*sorted(f"{kind}:{result['sha256']}" for kind, result in fetched.items()))
+            cached = parsed_cache.load(key)
+            if cached is not None:
+                logger.info(f"Loading merged feed {key} from cache")
+                products = next(cached, ProductBatch())
+                cached.close()
+                return 'changed', feed_files, products
+
+        parts = parse_feed_files(type(feed_sync), {kind: result['path'] for kind, result in fetched.items()})
+        products = merge_feed_parts(parts)
+
+        if key is not None:
+            try:
+                parsed_cache.store(key, [products])
+            except OSError as e:
+                logger.warning(f"Failed to cache merged feed {key}: {e}")
+
+        return 'changed', feed_files, products
+
+
+def read_stock_levels(feed_sync, path, levels):
+    """
+    Read only the SKU, stock and price columns of a local feed file into levels
+
+    levels maps sku -> [stock_quantity, cost_price], with None for values the
+    file doesn't carry.
+    """
+    with open(path, 'rb') as f:
+        csv_reader = csv.reader(iter_decoded_lines(f))
+        header = next(csv_reader, None)
+        if header is None:
+            return levels
+
+        schema = FeedSchema(header, warn_missing=False)
+        has_stock = schema.columns['stock_quantity'] is not None
+        has_price = schema.columns['cost_price'] is not None
+        if not (has_stock or has_price):
+            return levels
+
+        extract = schema.extractor(('sku', 'stock_quantity', 'cost_price'))
+        parse_int = feed_sync.parse_int
+        parse_price = feed_sync.parse_price
+
+        for row in csv_reader:
+            if not row:
+                continue
+            sku, stock, price = extract(row)
+            if not sku:
+                continue
+            level = levels.setdefault(sku, [None, None])
+            if has_stock:
+                level[0] = parse_int(stock)
+            if has_price:
+                level[1] = parse_price(price)
+
+    return levels
+
+
+def ingest_stock_levels(feed_sync, ssh, sftp, feed_cache):
+    """
+    Discover, download and read the stock and price columns of the feed files
+
+    A dedicated stock file replaces the catalogue when the supplier provides
+    one, and a dedicated price file overrides catalogue prices. Returns (status, feed_files, levels) with
+    the same statuses as ingest_feed_files.
+    """
+    with stage('discover'):
+        feed_files = discover_feed_files(sftp)
+
+    if 'stock' in feed_files:
+        feed_files.pop('catalogue', None)
+
+    if not feed_files:
+        logger.warning("No stock feed file found in FTP directory")
+        return 'missing', {}, {}
+
+    with stage('download'):
+        fetched = download_feed_files(ssh, feed_cache, feed_files)
+
+    if all(result['status'] == 'unchanged' for result in fetched.values()):
+        return 'unchanged', feed_files, {}
+
+    levels = {}
+    with stage('parse'):
+        # Catalogue first, so dedicated stock and price files override it
+        for kind in ('catalogue', 'stock', 'price'):
+            if kind in fetched:
+                read_stock_levels(feed_sync, fetched[kind]['path'], levels)
+    record('parse', rows=len(levels))
+
+    logger.info(f"Read stock levels for {len(levels)} SKUs")
+    return 'changed', feed_files, levels
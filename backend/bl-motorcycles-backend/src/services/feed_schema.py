@@ -0,0 +1,94 @@
+import logging
+import os
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+# Bump when a profile changes so anything derived from parsed feeds is rebuilt
+MAPPING_VERSION = 1
+
+# Product fields read from the feed, in the order extractors return them
+FEED_FIELDS = ('sku', 'name', 'description', 'category', 'cost_price', 'stock_quantity', 'image_url')
+
+# Supplier column aliases for each product field, in order of preference
+MAPPING_PROFILES = {
+    'bikeit': {
+        'sku': ('SKU', 'sku', 'Product Code'),
+        'name': ('Name', 'name', 'Product Name'),
+        'description': ('Description', 'description'),
+        'category': ('Category', 'category'),
+        'cost_price': ('Price', 'price', 'Cost'),
+        'stock_quantity': ('Stock', 'stock', 'Quantity'),
+        'image_url': ('Image', 'image', 'Image URL'),
+    }
+}
+
+# Value used when a feed has no column for a field
+MISSING_VALUES = {
+    'cost_price': '0',
+    'stock_quantity': '0',
+}
+
+DEFAULT_PROFILE = os.getenv('FEED_MAPPING_PROFILE', 'bikeit')
+
+class FeedSchema:
+    """
+    Column mapping for one feed file, resolved from its header row
+
+    The header is inspected once to pick the column for each product field,
+    and extractor() compiles an operator.itemgetter that pulls those columns
+    straight out of csv.reader rows.
+    """
+
+    def __init__(self, header, profile=DEFAULT_PROFILE, warn_missing=True):
+        self.profile = MAPPING_PROFILES[profile]
+
+        # Strip a UTF-8 byte order mark so it doesn't hide the first column name
+        header = list(header)
+        if header:
+            header[0] = header[0].lstrip('\ufeff')
+        self.width = len(header)
+
+        # Later duplicates win, as they would with csv.DictReader
+        positions = {column: index for index, column in enumerate(header)}
+
+        self.columns = {}
+        for field, aliases in self.profile.items():
+            self.columns[field] = next((positions[alias] for alias in aliases if alias in positions), None)
+
+        missing = [field for field, index in self.columns.items() if index is None]
+        if missing and warn_missing:
+            logger.warning(f"Feed has no column for: {', '.join(missing)}")
+
+    def extractor(self, fields=FEED_FIELDS):
+        """Build a function returning the given fields from a csv.reader row as a tuple"""
+        indices = [self.columns[field] for field in fields]
+        present = [index for index in indices if index is not None]
+        width = self.width
+        getter = itemgetter(*present) if present else None
+
+        if len(present) == 1:
+            # itemgetter with a single index returns a bare value
+            single = getter
+            getter = lambda row: (single(row),)
+
+        if len(present) == len(fields):
+            def extract(row):
+                if len(row) < width:
+                    row = row + [''] * (width - len(row))
+                return getter(row)
+            return extract
+
+        # Fill in the columns the feed doesn't have
+        missing = [(position, MISSING_VALUES.get(field, '')) for position, (field, index)
+                   in enumerate(zip(fields, indices)) if index is None]
+
+        def extract_with_defaults(row):
+            if len(row) < width:
+                row = row + [''] * (width - len(row))
+            values = list(getter(row)) if getter else []
+            for position, value in missing:
+                values.insert(position, value)
+            return tuple(values)
+
+        return extract_with_defaults
@@ -0,0 +1,94 @@
+import codecs
+import time
+from itertools import islice
+from src.services.sync_metrics import add_time, record, stage
+
+# Size of each read from the remote (or local) feed file
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# Number of parsed products handed to the database layer at a time
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def iter_decoded_lines(file_obj, encoding='utf-8', block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Incrementally decode a binary file object into text lines
+
+    Only one block of the file is held in memory at a time. Multi-byte
+    characters split across block boundaries are handled by the incremental
+    decoder, and line endings are kept so csv.reader can still parse quoted
+    fields that span several lines.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+
+    while True:
+        block = file_obj.read(block_size)
+        if not block:
+            break
+
+        text = pending + decoder.decode(block)
+
+        # Hold back the last partial line until we've seen its line ending
+        last_newline = text.rfind('\n')
+        if last_newline == -1:
+            pending = text
+            continue
+        pending = text[last_newline + 1:]
+
+        for line in text[:last_newline].split('\n'):
+            yield line + '\n'
+
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_chunks(iterable, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of at most chunk_size items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def merge_sync_results(total, result):
+    """Add the integer counts from one chunk's sync result into a running total"""
+    for key, value in result.items():
+        if isinstance(value, int) and not isinstance(value, bool):
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def sync_products_in_chunks(feed_sync, batches):
+    """
+    Price and write parsed ProductBatches one at a time, totalling the counts
+
+    Time spent producing each batch (parsing, when batches is a generator),
+    pricing it and writing it is recorded as the parse, price and write
+    stages of the current sync run.
+    """
+    result = {}
+    batches = iter(batches)
+
+    while True:
+        started = time.perf_counter()
+        chunk = next(batches, None)
+        add_time('parse', time.perf_counter() - started, rows=len(chunk or ()))
+        if chunk is None:
+            return result
+
+        with stage('price'):
+            feed_sync.finalize_products(chunk)
+        record('price', rows=len(chunk))
+
+        with stage('write'):
+            merge_sync_results(result, feed_sync.update_database(chunk))
+        record('write', rows=len(chunk))
+
+
+def sync_feed_lines(feed_sync, lines, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Parse feed lines and write the products to the database one chunk at a time"""
+    return sync_products_in_chunks(feed_sync, feed_sync.parse_batches(lines, chunk_size))
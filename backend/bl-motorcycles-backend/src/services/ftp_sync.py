@@ -4,8 +4,27 @@ import io
 import os
 from dotenv import load_dotenv
 from src.models.product import db, Product
+from src.services.product_fingerprint import fingerprint_values
+from src.services.product_batch import ProductBatch
+from sqlalchemy import insert, update
 import logging
 from datetime import datetime
+from src.services.feed_stream import (
+    iter_decoded_lines, iter_chunks, sync_feed_lines, sync_products_in_chunks, DEFAULT_CHUNK_SIZE
+)
+from src.services.feed_cache import FeedCache
+from src.services.feed_ingest import ingest_feed_files, ingest_stock_levels
+from src.services.parsed_feed_cache import ParsedFeedCache
+from src.services.feed_schema import FeedSchema
+from src.services.category_classifier import classify_category
+from src.services.discontinued import plan_discontinued
+from src.services.pricing import pricing_engine
+from src.services.image_cache import image_cache, PREFETCH as PREFETCH_IMAGES
+from src.services.price_history import price_history, tracked_changes
+from src.services.catalog_cache import invalidates_catalog
+from src.services.category_summary import sqlite_category_summary, refreshes_summary
+from src.services.sync_lock import coordinated_sync
+from src.services.sync_metrics import instrument_sync, record, stage, count_statements
 
 load_dotenv()
 
@@ -13,6 +32,12 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Product columns refreshed from the feed when a SKU already exists
+UPDATE_FIELDS = (
+    'name', 'description', 'category', 'cost_price', 'selling_price',
+    'delivery_cost', 'stock_quantity', 'in_stock', 'image_url', 'content_hash'
+)
+
 class BikeItFTPSync:
     def __init__(self):
         self.ftp_host = os.getenv('FTP_HOST')
@@ -20,6 +45,18 @@ class BikeItFTPSync:
         self.ftp_password = os.getenv('FTP_PASSWORD')
         self.ftp_port = int(os.getenv('FTP_PORT', 22))
         
+        # Rows per bulk INSERT/UPDATE statement
+        self.batch_size = int(os.getenv('FTP_SYNC_BATCH_SIZE', 1000))
+        
+        # sku -> (id, content_hash) for every product in the catalog, loaded once per sync
+        self.catalog_index = None
+        
+        # Every SKU seen in the feed during this sync, for discontinued product detection
+        self.feed_skus = set()
+        
+        # Image URLs of the products written during this sync, for prefetching
+        self.image_urls = set()
+        
     def connect_ftp(self):
         """Establish SFTP connection to Bike It server"""
         try:
@@ -46,22 +83,30 @@ class BikeItFTPSync:
             logger.error(f"Failed to connect to FTP server: {e}")
             raise
     
+    def find_feed_file(self, sftp):
+        """Find the product feed CSV file in the FTP directory"""
+        # List files in the directory to find the product feed
+        files = sftp.listdir('.')
+        logger.info(f"Files in FTP directory: {files}")
+        
+        # Look for CSV files (common names: products.csv, feed.csv, stock.csv, etc.)
+        csv_files = [f for f in files if f.lower().endswith('.csv')]
+        
+        if not csv_files:
+            logger.warning("No CSV files found in FTP directory")
+            return None
+        
+        # Use the first CSV file found (or implement logic to find the correct one)
+        return csv_files[0]
+    
     def download_product_feed(self, sftp):
         """Download the product feed CSV file from FTP server"""
         try:
-            # List files in the directory to find the product feed
-            files = sftp.listdir('.')
-            logger.info(f"Files in FTP directory: {files}")
+            feed_file = self.find_feed_file(sftp)
             
-            # Look for CSV files (common names: products.csv, feed.csv, stock.csv, etc.)
-            csv_files = [f for f in files if f.lower().endswith('.csv')]
-            
-            if not csv_files:
-                logger.warning("No CSV files found in FTP directory")
+            if not feed_file:
                 return None
             
-            # Use the first CSV file found (or implement logic to find the correct one)
-            feed_file = csv_files[0]
             logger.info(f"Downloading product feed: {feed_file}")
             
             # Download file content
@@ -74,108 +119,91 @@ class BikeItFTPSync:
             logger.error(f"Failed to download product feed: {e}")
             raise
     
+    def stream_product_feed(self, sftp, feed_file):
+        """Yield decoded lines of the feed file without holding it all in memory"""
+        logger.info(f"Streaming product feed: {feed_file}")
+        
+        with sftp.open(feed_file, 'r') as remote_file:
+            # No prefetch(): it reads the whole file ahead and holds it in memory
+            # until consumed, which the database writes do slower than the network
+            # delivers. The cached path prefetches instead, as it writes to disk.
+            yield from iter_decoded_lines(remote_file)
+    
     def parse_csv_content(self, csv_content):
         """Parse CSV content and extract product data"""
         try:
-            # Parse CSV content
-            csv_reader = csv.DictReader(io.StringIO(csv_content))
-            products = []
-            
-            for row in csv_reader:
-                # Map CSV columns to our product model
-                # Note: Column names may vary, adjust as needed
-                product_data = {
-                    'sku': row.get('SKU', row.get('sku', row.get('Product Code', ''))),
-                    'name': row.get('Name', row.get('name', row.get('Product Name', ''))),
-                    'description': row.get('Description', row.get('description', '')),
-                    'category': self.categorize_product(row.get('Category', row.get('category', ''))),
-                    'cost_price': self.parse_price(row.get('Price', row.get('price', row.get('Cost', '0')))),
-                    'stock_quantity': self.parse_int(row.get('Stock', row.get('stock', row.get('Quantity', '0')))),
-                    'image_url': row.get('Image', row.get('image', row.get('Image URL', ''))),
-                    'supplier': 'Bike It'
-                }
-                
-                # Skip products without essential data
-                if not product_data['sku'] or not product_data['name']:
-                    continue
-                
-                # Calculate selling price
-                product_data['selling_price'] = Product.calculate_selling_price(
-                    product_data['cost_price']
-                )
-                
-                # Set stock status
-                product_data['in_stock'] = product_data['stock_quantity'] > 0
-                
-                products.append(product_data)
-            
-            logger.info(f"Parsed {len(products)} products from CSV")
-            return products
+            batch = next(self.parse_batches(io.StringIO(csv_content), batch_size=None), None)
+            return self.finalize_products(batch or ProductBatch())
             
         except Exception as e:
             logger.error(f"Failed to parse CSV content: {e}")
             raise
     
-    def categorize_product(self, category_hint):
-        """Categorize products based on name and description"""
-        if not category_hint:
-            return 'Uncategorized'
+    def parse_batches(self, lines, batch_size=DEFAULT_CHUNK_SIZE, header=None):
+        """
+        Parse an iterable of CSV lines, yielding ProductBatches of up to batch_size products
+        
+        batch_size None puts every product in one batch. header is given when
+        lines is a slice of a feed file that doesn't start at the header row.
+        The derived fields are filled in afterwards by finalize_products.
+        """
+        csv_reader = csv.reader(lines)
+        parsed_count = 0
+        
+        # Resolve the column for each field once from the header row
+        if header is None:
+            header = next(csv_reader, None)
+        if header is None:
+            logger.warning("Product feed is empty")
+            return
+        extract = FeedSchema(header).extractor()
+        batch = ProductBatch()
+        
+        for row in csv_reader:
+            if not row:
+                continue
+            
+            sku, name, description, category, price, stock, image_url = extract(row)
+            
+            # Skip products without essential data
+            if not sku or not name:
+                record('parse', rejected_rows=1)
+                continue
+            
+            # Map CSV columns to our product model
+            batch.append(
+                sku,
+                name,
+                description,
+                self.categorize_product(category, name, description),
+                self.parse_price(price),
+                self.parse_int(stock),
+                image_url
+            )
+            
+            parsed_count += 1
+            if len(batch) == batch_size:
+                yield batch
+                batch = ProductBatch()
         
-        category_hint = category_hint.lower()
+        if batch:
+            yield batch
         
-        # Define category mappings
-        category_map = {
-            'brake': 'Brakes & ABS',
-            'suspension': 'Suspension & Steering',
-            'shock': 'Suspension & Steering',
-            'steering': 'Suspension & Steering',
-            'electrical': 'Electrical & Lighting',
-            'lighting': 'Electrical & Lighting',
-            'light': 'Electrical & Lighting',
-            'bulb': 'Electrical & Lighting',
-            'engine': 'Engine & Performance',
-            'performance': 'Engine & Performance',
-            'exhaust': 'Engine & Performance',
-            'transmission': 'Transmission & Clutch',
-            'clutch': 'Transmission & Clutch',
-            'chain': 'Transmission & Clutch',
-            'sprocket': 'Transmission & Clutch',
-            'wheel': 'Wheels & Tyres',
-            'tyre': 'Wheels & Tyres',
-            'tire': 'Wheels & Tyres',
-            'rim': 'Wheels & Tyres',
-            'body': 'Body & Fairings',
-            'fairing': 'Body & Fairings',
-            'panel': 'Body & Fairings',
-            'cooling': 'Cooling & Lubrication',
-            'radiator': 'Cooling & Lubrication',
-            'oil': 'Cooling & Lubrication',
-            'fuel': 'Fuel & Air',
-            'air': 'Fuel & Air',
-            'filter': 'Fuel & Air',
-            'battery': 'Batteries & Charging',
-            'charging': 'Batteries & Charging',
-            'tool': 'Tools & Maintenance',
-            'maintenance': 'Tools & Maintenance',
-            'security': 'Security & Locks',
-            'lock': 'Security & Locks',
-            'luggage': 'Luggage & Storage',
-            'storage': 'Luggage & Storage',
-            'bag': 'Luggage & Storage',
-            'clothing': 'Clothing & Protection',
-            'protection': 'Clothing & Protection',
-            'helmet': 'Clothing & Protection',
-            'glove': 'Clothing & Protection',
-            'cover': 'Covers & Accessories',
-            'accessory': 'Covers & Accessories'
-        }
+        logger.info(f"Parsed {parsed_count} products from CSV")
+    
+    def finalize_products(self, batch):
+        """Fill in the fields derived from the feed values for a ProductBatch"""
+        # Price the whole batch in one pass over its columns
+        pricing_engine.apply_batch(batch)
         
-        # Find matching category
-        for keyword, category in category_map.items():
-            if keyword in category_hint:
-                return category
+        # Fingerprint the mapped fields so unchanged products can be skipped
+        batch.content_hashes = [fingerprint_values(batch.fingerprint_values(index)) for index in range(len(batch))]
         
-        return 'Uncategorized'
+        return batch
+    
+    def categorize_product(self, category_hint, name=None, description=None):
+        """Categorize products based on the category hint, or name and description"""
+        return classify_category(category_hint, name, description)
     
     def parse_price(self, price_str):
         """Parse price string to float"""
@@ -193,86 +221,513 @@ class BikeItFTPSync:
         except:
             return 0
     
+    def load_catalog_index(self):
+        """Load the sku -> (id, content_hash) map for the whole catalog in a single query"""
+        if self.catalog_index is None:
+            rows = db.session.query(Product.sku, Product.id, Product.content_hash).all()
+            self.catalog_index = {sku: (product_id, content_hash) for sku, product_id, content_hash in rows}
+            logger.info(f"Loaded {len(self.catalog_index)} existing SKUs")
+        return self.catalog_index
+    
     def update_database(self, products):
-        """Update database with new product data"""
+        """
+        Write new and changed products from a finalized ProductBatch using bulk inserts and updates
+        
+        Only the rows being written are turned into dicts. Their price and
+        stock changes are added to the price history once committed.
+        """
         try:
-            updated_count = 0
-            created_count = 0
+            new_count = 0
+            changed_count = 0
+            unchanged_count = 0
+            history = []
             
-            for product_data in products:
-                # Check if product exists
-                existing_product = Product.query.filter_by(sku=product_data['sku']).first()
+            catalog_index = self.load_catalog_index()
+            self.feed_skus.update(products.skus)
+            
+            for batch in products.slices(self.batch_size):
+                inserts = {}
+                updates = {}
+                updated_skus = {}
+                now = datetime.utcnow()
+                
+                for index, sku in enumerate(batch.skus):
+                    content_hash = batch.content_hashes[index]
+                    existing = catalog_index.get(sku)
+                    
+                    if sku in inserts:
+                        # Repeated SKU within the batch, the later row wins
+                        if inserts[sku]['content_hash'] == content_hash:
+                            unchanged_count += 1
+                        else:
+                            inserts[sku] = batch.row(index)
+                            changed_count += 1
+                    elif existing is None:
+                        # Create new product
+                        inserts[sku] = batch.row(index)
+                        new_count += 1
+                    elif existing[1] == content_hash:
+                        # Feed content hasn't changed, leave the row alone
+                        unchanged_count += 1
+                    else:
+                        # Update existing product
+                        product_id = existing[0]
+                        product_data = batch.row(index)
+                        mapping = {field: product_data[field] for field in UPDATE_FIELDS}
+                        mapping['id'] = product_id
+                        mapping['updated_at'] = now
+                        # Back in the feed, so no longer discontinued
+                        mapping['discontinued_at'] = None
+                        updates[product_id] = mapping
+                        updated_skus[product_id] = sku
+                        catalog_index[sku] = (product_id, content_hash)
+                        changed_count += 1
                 
-                if existing_product:
-                    # Update existing product
-                    existing_product.name = product_data['name']
-                    existing_product.description = product_data['description']
-                    existing_product.category = product_data['category']
-                    existing_product.cost_price = product_data['cost_price']
-                    existing_product.selling_price = product_data['selling_price']
-                    existing_product.stock_quantity = product_data['stock_quantity']
-                    existing_product.in_stock = product_data['in_stock']
-                    existing_product.image_url = product_data['image_url']
-                    existing_product.updated_at = datetime.utcnow()
-                    updated_count += 1
-                else:
-                    # Create new product
-                    new_product = Product(**product_data)
-                    db.session.add(new_product)
-                    created_count += 1
+                if inserts:
+                    # Remember the new ids so later batches update rather than insert
+                    new_ids = db.session.execute(
+                        insert(Product).returning(Product.sku, Product.id, Product.content_hash),
+                        list(inserts.values())
+                    )
+                    catalog_index.update((sku, (product_id, content_hash)) for sku, product_id, content_hash in new_ids)
+                    
+                    for product_data in inserts.values():
+                        self.image_urls.add(product_data['image_url'])
+                        history.extend(tracked_changes(
+                            product_data['sku'], product_data['category'], None,
+                            (product_data['cost_price'], product_data['selling_price'], product_data['stock_quantity'])
+                        ))
+                
+                if updates:
+                    # Only the updated rows' previous values are read, for the price history
+                    previous = {
+                        product_id: values
+                        for product_id, *values in db.session.query(
+                            Product.id, Product.cost_price, Product.selling_price, Product.stock_quantity
+                        ).filter(Product.id.in_(list(updates)))
+                    }
+                    for product_id, mapping in updates.items():
+                        self.image_urls.add(mapping['image_url'])
+                        history.extend(tracked_changes(
+                            updated_skus[product_id], mapping['category'], previous.get(product_id),
+                            (mapping['cost_price'], mapping['selling_price'], mapping['stock_quantity'])
+                        ))
+                    
+                    db.session.bulk_update_mappings(Product, list(updates.values()))
             
             # Commit changes
             db.session.commit()
+            price_history.append(history)
             
-            logger.info(f"Database updated: {created_count} created, {updated_count} updated")
+            logger.info(
+                f"Database updated: {new_count} created, {changed_count} updated, "
+                f"{unchanged_count} unchanged"
+            )
             
             return {
-                'created': created_count,
-                'updated': updated_count,
-                'total': len(products)
+                'created': new_count,
+                'updated': changed_count,
+                'new': new_count,
+                'changed': changed_count,
+                'unchanged': unchanged_count,
+                'total': new_count + changed_count + unchanged_count
             }
             
         except Exception as e:
             db.session.rollback()
+            # The rolled back writes are still in the index, reload it on the next call
+            self.catalog_index = None
             logger.error(f"Failed to update database: {e}")
             raise
+    
+    def update_stock_levels(self, levels):
+        """
+        Write only stock and price columns for SKUs whose values changed
+        
+        levels maps sku -> [stock_quantity, cost_price], None meaning keep the
+        current value. SKUs that aren't in the catalog are ignored.
+        """
+        try:
+            changed = []
+            unchanged_count = 0
+            now = datetime.utcnow()
+            
+            rows = db.session.query(
+                Product.id, Product.sku, Product.stock_quantity, Product.cost_price,
+                Product.category, Product.delivery_cost, Product.selling_price
+            ).all()
+            pricing = []
+            previous = []
+            
+            for product_id, sku, stock_quantity, cost_price, category, delivery_cost, selling_price in rows:
+                level = levels.get(sku)
+                if level is None:
+                    continue
+                
+                new_stock = stock_quantity if level[0] is None else level[0]
+                new_cost = cost_price if level[1] is None else level[1]
+                
+                if new_stock == stock_quantity and new_cost == cost_price:
+                    unchanged_count += 1
+                    continue
+                
+                changed.append({
+                    'id': product_id,
+                    'stock_quantity': new_stock,
+                    'in_stock': new_stock > 0,
+                    'cost_price': new_cost,
+                    # No longer the hash of what's stored, so the next full sync rewrites the row
+                    'content_hash': None,
+                    'updated_at': now
+                })
+                pricing.append((new_cost, category, delivery_cost))
+                previous.append((sku, category, (cost_price, selling_price, stock_quantity)))
+            
+            # Price every changed row in one batch
+            if changed:
+                costs, categories, delivery_costs = zip(*pricing)
+                for mapping, price in zip(changed, pricing_engine.price_batch(costs, categories, delivery_costs)):
+                    mapping['selling_price'] = price
+            
+            for batch in iter_chunks(changed, self.batch_size):
+                db.session.bulk_update_mappings(Product, batch)
+            
+            db.session.commit()
+            
+            price_history.append(
+                change
+                for mapping, (sku, category, old) in zip(changed, previous)
+                for change in tracked_changes(
+                    sku, category, old, (mapping['cost_price'], mapping['selling_price'], mapping['stock_quantity'])
+                )
+            )
+            
+            unknown_count = len(levels) - len(changed) - unchanged_count
+            logger.info(
+                f"Stock levels updated: {len(changed)} changed, {unchanged_count} unchanged, "
+                f"{unknown_count} not in catalog"
+            )
+            
+            return {
+                'changed': len(changed),
+                'unchanged': unchanged_count,
+                'unknown': unknown_count,
+                'total': len(levels)
+            }
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to update stock levels: {e}")
+            raise
+    
+    def prefetch_images(self):
+        """Fetch the images of new and changed products into the image cache in the background"""
+        if PREFETCH_IMAGES and self.image_urls:
+            image_cache.prefetch(self.image_urls)
+    
+    def retire_discontinued(self):
+        """
+        Apply the discontinued product policy to catalog products missing from the feed
+        
+        Only call this after a sync that saw the complete feed. Their content
+        hash is cleared so they are rewritten in full if they come back.
+        """
+        try:
+            with stage('discontinue'):
+                catalog = db.session.query(
+                    Product.sku, Product.in_stock, Product.stock_quantity, Product.discontinued_at, Product.category
+                ).all()
+                to_mark, report = plan_discontinued((row[:4] for row in catalog), self.feed_skus)
+                
+                if to_mark:
+                    now = datetime.utcnow()
+                    values = {'stock_quantity': 0, 'in_stock': False, 'content_hash': None, 'updated_at': now}
+                    if report['policy'] == 'soft_delete':
+                        values['discontinued_at'] = now
+                    
+                    for batch in iter_chunks(to_mark, self.batch_size):
+                        db.session.execute(
+                            update(Product).where(Product.sku.in_(batch)).values(**values)
+                            .execution_options(synchronize_session=False)
+                        )
+                    db.session.commit()
+                    
+                    marked = set(to_mark)
+                    price_history.append(
+                        (sku, category, 'stock_quantity', 0.0)
+                        for sku, _, stock_quantity, _, category in catalog
+                        if sku in marked and stock_quantity
+                    )
+            
+            report['marked'] = len(to_mark)
+            record('discontinue', rows=len(to_mark))
+            
+            if to_mark:
+                logger.info(f"Marked {len(to_mark)} discontinued products ({report['policy']})")
+            
+            return report
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to mark discontinued products: {e}")
+            raise
+    
+    def reprice_catalog(self):
+        """Recompute every stored selling price with the current pricing rules, writing only changed ones"""
+        try:
+            changed_count = 0
+            now = datetime.utcnow()
+            
+            history = []
+            
+            rows = db.session.query(
+                Product.id, Product.cost_price, Product.category, Product.delivery_cost, Product.selling_price,
+                Product.sku
+            ).all()
+            
+            for batch in iter_chunks(rows, self.batch_size):
+                with stage('price'):
+                    ids, costs, categories, delivery_costs, current, skus = zip(*batch)
+                    prices = pricing_engine.price_batch(costs, categories, delivery_costs)
+                    updates = []
+                    for product_id, price, old_price, sku, category in zip(ids, prices, current, skus, categories):
+                        if old_price is None or abs(price - old_price) >= 0.005:
+                            # content_hash covers the selling price, so the next full sync rewrites the row
+                            updates.append({'id': product_id, 'selling_price': price, 'content_hash': None, 'updated_at': now})
+                            history.append((sku, category, 'selling_price', price))
+                record('price', rows=len(batch))
+                
+                if updates:
+                    with stage('write'):
+                        db.session.bulk_update_mappings(Product, updates)
+                    record('write', rows=len(updates))
+                    changed_count += len(updates)
+            
+            db.session.commit()
+            price_history.append(history)
+            
+            logger.info(f"Catalog repriced: {changed_count} of {len(rows)} selling prices changed")
+            return {'changed': changed_count, 'unchanged': len(rows) - changed_count, 'total': len(rows)}
+            
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to reprice catalog: {e}")
+            raise
+
+@coordinated_sync('sync-sqlite')
+@instrument_sync('sqlite')
+@invalidates_catalog
+@refreshes_summary(sqlite_category_summary)
+def sync_bikeit_products(streaming=True, chunk_size=DEFAULT_CHUNK_SIZE, use_cache=True, from_cache=False,
+                         parallel=None, stock_only=False, session=None):
+    """
+    Main function to sync products from Bike It FTP
 
-def sync_bikeit_products():
-    """Main function to sync products from Bike It FTP"""
+    In streaming mode the feed is decoded, parsed and written to the database
+    in chunks of chunk_size products, so peak memory doesn't grow with the
+    size of the feed. With use_cache the feed is first streamed to a local
+    copy, and the sync is skipped when the remote file hasn't changed since
+    the last successful run. from_cache replays the newest local copy
+    without connecting to the FTP server. Parsed feeds are kept in a
+    ParsedFeedCache keyed by their content, so syncing the same feed again
+    skips parsing.
+    
+    parallel (default FTP_SYNC_PARALLEL) ingests every catalogue, stock and
+    price file: they are downloaded concurrently, parsed in a process pool
+    and merged by SKU before the database is updated.
+    
+    stock_only is the lightweight fast path: only the SKU, stock and price
+    columns are read, and only stock_quantity, in_stock, cost_price and
+    selling_price are written for SKUs whose values changed.
+    
+    session is an optional SFTPSession whose connection is reused and left
+    open, for long-running processes such as the sync scheduler.
+    
+    After a full sync, catalog products missing from the feed are marked
+    out of stock or soft-deleted according to DISCONTINUED_POLICY (see
+    discontinued).
+    
+    Each run's stage timings and counters are recorded in the sync run
+    history (see sync_metrics).
+    
+    Only one sync runs at a time across processes (see sync_lock). A call
+    made while a sync of the same kind is running returns that sync's
+    result, marked 'attached', instead of syncing again.
+    """
+    if parallel is None:
+        parallel = os.getenv('FTP_SYNC_PARALLEL', 'false').lower() == 'true'
+    
     try:
         logger.info("Starting Bike It product synchronization")
         
+        # Syncs started from the web app price with the current rules file too
+        pricing_engine.reload_if_changed()
+        
         # Initialize FTP sync
         ftp_sync = BikeItFTPSync()
+        count_statements(db.engine)
         
-        # Connect to FTP server
-        ssh, sftp = ftp_sync.connect_ftp()
+        if from_cache:
+            return sync_cached_feed(ftp_sync, FeedCache(), chunk_size)
+        
+        # Connect to FTP server, reusing the session's connection when given one
+        with stage('connect'):
+            ssh, sftp = session.connect() if session else ftp_sync.connect_ftp()
         
         try:
-            # Download product feed
-            csv_content = ftp_sync.download_product_feed(sftp)
-            
-            if not csv_content:
-                return {'error': 'No product feed found'}
-            
-            # Parse CSV content
-            products = ftp_sync.parse_csv_content(csv_content)
+            if stock_only:
+                # Separate feed state so the full sync still sees feeds as changed
+                feed_cache = FeedCache(namespace='stock')
+                status, feed_files, levels = ingest_stock_levels(ftp_sync, ssh, sftp, feed_cache)
+                
+                if status == 'missing':
+                    return {'error': 'No product feed found'}
+                
+                if status == 'unchanged':
+                    logger.info("Stock feeds unchanged, synchronization skipped")
+                    return {'skipped': True, 'reason': 'Stock feeds unchanged since last sync',
+                            'feed_files': [attr.filename for attr in feed_files.values()]}
+                
+                with stage('write'):
+                    result = ftp_sync.update_stock_levels(levels)
+                record('write', rows=len(levels))
+                
+                for attr in feed_files.values():
+                    feed_cache.mark_synced(attr.filename, remember=False)
+            elif parallel:
+                feed_cache = FeedCache()
+                status, feed_files, products = ingest_feed_files(ftp_sync, ssh, sftp, feed_cache, ParsedFeedCache())
+                
+                if status == 'missing':
+                    return {'error': 'No product feed found'}
+                
+                if status == 'unchanged':
+                    logger.info("Product feeds unchanged, synchronization skipped")
+                    return {'skipped': True, 'reason': 'Product feeds unchanged since last sync',
+                            'feed_files': [attr.filename for attr in feed_files.values()]}
+                
+                result = sync_products_in_chunks(ftp_sync, products.slices(chunk_size))
+                
+                for kind, attr in feed_files.items():
+                    feed_cache.mark_synced(attr.filename, remember=(kind == 'catalogue'))
+            elif streaming and use_cache:
+                feed_cache = FeedCache()
+                with stage('discover'):
+                    feed_file, remote_stat = feed_cache.locate_feed_file(sftp, ftp_sync.find_feed_file)
+                
+                if not feed_file:
+                    return {'error': 'No product feed found'}
+                
+                # Only download when the remote file has changed
+                with stage('download'):
+                    fetched = feed_cache.fetch(sftp, feed_file, remote_stat)
+                
+                if fetched['status'] == 'unchanged':
+                    logger.info("Product feed unchanged, synchronization skipped")
+                    return {'skipped': True, 'reason': 'Product feed unchanged since last sync', 'feed_file': feed_file}
+                
+                # Parsed batches are cached by feed content, so a retry skips parsing
+                batches = ParsedFeedCache().feed_batches(ftp_sync, fetched['path'], fetched['sha256'], chunk_size)
+                result = sync_products_in_chunks(ftp_sync, batches)
+                
+                feed_cache.mark_synced(feed_file)
+            elif streaming:
+                with stage('discover'):
+                    feed_file = ftp_sync.find_feed_file(sftp)
+                
+                if not feed_file:
+                    return {'error': 'No product feed found'}
+                
+                # Parse and update the database one chunk at a time
+                result = sync_feed_lines(ftp_sync, ftp_sync.stream_product_feed(sftp, feed_file), chunk_size)
+            else:
+                # Download product feed
+                with stage('download'):
+                    csv_content = ftp_sync.download_product_feed(sftp)
+                
+                if not csv_content:
+                    return {'error': 'No product feed found'}
+                
+                # Parse CSV content
+                with stage('parse'):
+                    products = ftp_sync.parse_csv_content(csv_content)
+                record('parse', bytes=len(csv_content), rows=len(products))
+                
+                # Update database
+                with stage('write'):
+                    result = ftp_sync.update_database(products)
+                record('write', rows=len(products))
             
-            # Update database
-            result = ftp_sync.update_database(products)
+            if not stock_only:
+                # The whole feed was synced, so catalog SKUs missing from it were discontinued
+                result['discontinued'] = ftp_sync.retire_discontinued()
+                ftp_sync.prefetch_images()
             
             logger.info("Product synchronization completed successfully")
             return result
             
         finally:
-            # Close connections
-            sftp.close()
-            ssh.close()
+            # Close connections, unless they belong to a long-lived session
+            if not session:
+                sftp.close()
+                ssh.close()
             
     except Exception as e:
         logger.error(f"Product synchronization failed: {e}")
         return {'error': str(e)}
 
+def sync_bikeit_stock():
+    """Fast path sync of stock levels and prices only"""
+    return sync_bikeit_products(stock_only=True)
+
+@coordinated_sync('sync-sqlite', kind='reprice')
+@instrument_sync('sqlite', sync_type='reprice')
+@invalidates_catalog
+@refreshes_summary(sqlite_category_summary)
+def reprice_products():
+    """
+    Recompute the stored selling prices in bulk after the pricing rules change
+    
+    Runs under the sync lock, so it never overlaps a product sync.
+    """
+    try:
+        pricing_engine.reload_if_changed()
+        ftp_sync = BikeItFTPSync()
+        count_statements(db.engine)
+        return ftp_sync.reprice_catalog()
+        
+    except Exception as e:
+        logger.error(f"Repricing failed: {e}")
+        return {'error': str(e)}
+
+def sync_cached_feed(ftp_sync, feed_cache, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Replay the newest local copy of the feed without an SFTP round trip
+    
+    The feed's parsed batches are loaded from the ParsedFeedCache when it
+    was parsed before, e.g. by the sync that failed and is being retried.
+    """
+    feed_file, path, content_hash = feed_cache.latest_local_copy()
+    
+    if not path:
+        return {'error': 'No cached product feed found'}
+    
+    logger.info(f"Replaying cached product feed: {path}")
+    
+    if content_hash:
+        batches = ParsedFeedCache().feed_batches(ftp_sync, path, content_hash, chunk_size)
+        result = sync_products_in_chunks(ftp_sync, batches)
+    else:
+        with open(path, 'rb') as feed:
+            result = sync_feed_lines(ftp_sync, iter_decoded_lines(feed), chunk_size)
+    
+    feed_cache.mark_synced(feed_file)
+    result['discontinued'] = ftp_sync.retire_discontinued()
+    ftp_sync.prefetch_images()
+    
+    logger.info("Product synchronization completed successfully")
+    return result
+
 if __name__ == '__main__':
     # For testing purposes
     result = sync_bikeit_products()
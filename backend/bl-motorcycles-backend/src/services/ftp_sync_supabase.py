@@ -4,8 +4,28 @@ import io
 import os
 from dotenv import load_dotenv
 from src.services.supabase_client import supabase_service
+from src.services.product_fingerprint import fingerprint_values
+from src.services.product_batch import ProductBatch
 import logging
+import time
 from datetime import datetime
+from src.services.feed_stream import (
+    iter_decoded_lines, sync_feed_lines, sync_products_in_chunks, DEFAULT_CHUNK_SIZE
+)
+from src.services.feed_cache import FeedCache
+from src.services.feed_ingest import ingest_feed_files, ingest_stock_levels
+from src.services.parsed_feed_cache import ParsedFeedCache
+from src.services.feed_schema import FeedSchema
+from src.services.category_classifier import classify_category
+from src.services.discontinued import plan_discontinued
+from src.services.pricing import pricing_engine
+from src.services.image_cache import image_cache, PREFETCH as PREFETCH_IMAGES
+from src.services.price_history import price_history, tracked_changes
+from src.services.search_index import search_index
+from src.services.catalog_cache import invalidates_catalog
+from src.services.category_summary import supabase_category_summary, refreshes_summary
+from src.services.sync_lock import coordinated_sync
+from src.services.sync_metrics import instrument_sync, record, stage
 
 load_dotenv()
 
@@ -20,6 +40,18 @@ class BikeItFTPSyncSupabase:
         self.ftp_password = os.getenv('FTP_PASSWORD')
         self.ftp_port = int(os.getenv('FTP_PORT', 22))
         
+        # Extra attempts for upsert chunks that fail
+        self.upsert_retries = int(os.getenv('SUPABASE_UPSERT_RETRIES', 2))
+        
+        # sku -> content_hash for every product in the catalog, loaded once per sync
+        self.fingerprints = None
+        
+        # Every SKU seen in the feed during this sync, for discontinued product detection
+        self.feed_skus = set()
+        
+        # Image URLs of the products written during this sync, for prefetching
+        self.image_urls = set()
+        
     def connect_ftp(self):
         """Establish SFTP connection to Bike It server"""
         try:
@@ -46,22 +78,30 @@ class BikeItFTPSyncSupabase:
             logger.error(f"Failed to connect to FTP server: {e}")
             raise
     
+    def find_feed_file(self, sftp):
+        """Find the product feed CSV file in the FTP directory"""
+        # List files in the directory to find the product feed
+        files = sftp.listdir('.')
+        logger.info(f"Files in FTP directory: {files}")
+        
+        # Look for CSV files (common names: products.csv, feed.csv, stock.csv, etc.)
+        csv_files = [f for f in files if f.lower().endswith('.csv')]
+        
+        if not csv_files:
+            logger.warning("No CSV files found in FTP directory")
+            return None
+        
+        # Use the first CSV file found (or implement logic to find the correct one)
+        return csv_files[0]
+    
     def download_product_feed(self, sftp):
         """Download the product feed CSV file from FTP server"""
         try:
-            # List files in the directory to find the product feed
-            files = sftp.listdir('.')
-            logger.info(f"Files in FTP directory: {files}")
-            
-            # Look for CSV files (common names: products.csv, feed.csv, stock.csv, etc.)
-            csv_files = [f for f in files if f.lower().endswith('.csv')]
+            feed_file = self.find_feed_file(sftp)
             
-            if not csv_files:
-                logger.warning("No CSV files found in FTP directory")
+            if not feed_file:
                 return None
             
-            # Use the first CSV file found (or implement logic to find the correct one)
-            feed_file = csv_files[0]
             logger.info(f"Downloading product feed: {feed_file}")
             
             # Download file content
@@ -74,107 +114,91 @@ class BikeItFTPSyncSupabase:
             logger.error(f"Failed to download product feed: {e}")
             raise
     
+    def stream_product_feed(self, sftp, feed_file):
+        """Yield decoded lines of the feed file without holding it all in memory"""
+        logger.info(f"Streaming product feed: {feed_file}")
+        
+        with sftp.open(feed_file, 'r') as remote_file:
+            # No prefetch(): it reads the whole file ahead and holds it in memory
+            # until consumed, which the database writes do slower than the network
+            # delivers. The cached path prefetches instead, as it writes to disk.
+            yield from iter_decoded_lines(remote_file)
+    
     def parse_csv_content(self, csv_content):
         """Parse CSV content and extract product data"""
         try:
-            # Parse CSV content
-            csv_reader = csv.DictReader(io.StringIO(csv_content))
-            products = []
-            
-            for row in csv_reader:
-                # Map CSV columns to our product model
-                # Note: Column names may vary, adjust as needed
-                product_data = {
-                    'sku': row.get('SKU', row.get('sku', row.get('Product Code', ''))),
-                    'name': row.get('Name', row.get('name', row.get('Product Name', ''))),
-                    'description': row.get('Description', row.get('description', '')),
-                    'category': self.categorize_product(row.get('Category', row.get('category', ''))),
-                    'cost_price': self.parse_price(row.get('Price', row.get('price', row.get('Cost', '0')))),
-                    'stock_quantity': self.parse_int(row.get('Stock', row.get('stock', row.get('Quantity', '0')))),
-                    'image_url': row.get('Image', row.get('image', row.get('Image URL', ''))),
-                    'supplier': 'Bike It'
-                }
-                
-                # Skip products without essential data
-                if not product_data['sku'] or not product_data['name']:
-                    continue
-                
-                # Calculate selling price
-                product_data['selling_price'] = (product_data['cost_price'] * 1.5) + 6.0
-                product_data['delivery_cost'] = 6.0
-                
-                # Set stock status
-                product_data['in_stock'] = product_data['stock_quantity'] > 0
-                
-                products.append(product_data)
-            
-            logger.info(f"Parsed {len(products)} products from CSV")
-            return products
+            batch = next(self.parse_batches(io.StringIO(csv_content), batch_size=None), None)
+            return self.finalize_products(batch or ProductBatch())
             
         except Exception as e:
             logger.error(f"Failed to parse CSV content: {e}")
             raise
     
-    def categorize_product(self, category_hint):
-        """Categorize products based on name and description"""
-        if not category_hint:
-            return 'Uncategorized'
-        
-        category_hint = category_hint.lower()
-        
-        # Define category mappings
-        category_map = {
-            'brake': 'Brakes & ABS',
-            'suspension': 'Suspension & Steering',
-            'shock': 'Suspension & Steering',
-            'steering': 'Suspension & Steering',
-            'electrical': 'Electrical & Lighting',
-            'lighting': 'Electrical & Lighting',
-            'light': 'Electrical & Lighting',
-            'bulb': 'Electrical & Lighting',
-            'engine': 'Engine & Performance',
-            'performance': 'Engine & Performance',
-            'exhaust': 'Engine & Performance',
-            'transmission': 'Transmission & Clutch',
-            'clutch': 'Transmission & Clutch',
-            'chain': 'Transmission & Clutch',
-            'sprocket': 'Transmission & Clutch',
-            'wheel': 'Wheels & Tyres',
-            'tyre': 'Wheels & Tyres',
-            'tire': 'Wheels & Tyres',
-            'rim': 'Wheels & Tyres',
-            'body': 'Body & Fairings',
-            'fairing': 'Body & Fairings',
-            'panel': 'Body & Fairings',
-            'cooling': 'Cooling & Lubrication',
-            'radiator': 'Cooling & Lubrication',
-            'oil': 'Cooling & Lubrication',
-            'fuel': 'Fuel & Air',
-            'air': 'Fuel & Air',
-            'filter': 'Fuel & Air',
-            'battery': 'Batteries & Charging',
-            'charging': 'Batteries & Charging',
-            'tool': 'Tools & Maintenance',
-            'maintenance': 'Tools & Maintenance',
-            'security': 'Security & Locks',
-            'lock': 'Security & Locks',
-            'luggage': 'Luggage & Storage',
-            'storage': 'Luggage & Storage',
-            'bag': 'Luggage & Storage',
-            'clothing': 'Clothing & Protection',
-            'protection': 'Clothing & Protection',
-            'helmet': 'Clothing & Protection',
-            'glove': 'Clothing & Protection',
-            'cover': 'Covers & Accessories',
-            'accessory': 'Covers & Accessories'
-        }
-        
-        # Find matching category
-        for keyword, category in category_map.items():
-            if keyword in category_hint:
-                return category
-        
-        return 'Uncategorized'
+    def parse_batches(self, lines, batch_size=DEFAULT_CHUNK_SIZE, header=None):
+        """
+        Parse an iterable of CSV lines, yielding ProductBatches of up to batch_size products
+        
+        batch_size None puts every product in one batch. header is given when
+        lines is a slice of a feed file that doesn't start at the header row.
+        The derived fields are filled in afterwards by finalize_products.
+        """
+        csv_reader = csv.reader(lines)
+        parsed_count = 0
+        
+        # Resolve the column for each field once from the header row
+        if header is None:
+            header = next(csv_reader, None)
+        if header is None:
+            logger.warning("Product feed is empty")
+            return
+        extract = FeedSchema(header).extractor()
+        batch = ProductBatch()
+        
+        for row in csv_reader:
+            if not row:
+                continue
+            
+            sku, name, description, category, price, stock, image_url = extract(row)
+            
+            # Skip products without essential data
+            if not sku or not name:
+                record('parse', rejected_rows=1)
+                continue
+            
+            # Map CSV columns to our product model
+            batch.append(
+                sku,
+                name,
+                description,
+                self.categorize_product(category, name, description),
+                self.parse_price(price),
+                self.parse_int(stock),
+                image_url
+            )
+            
+            parsed_count += 1
+            if len(batch) == batch_size:
+                yield batch
+                batch = ProductBatch()
+        
+        if batch:
+            yield batch
+        
+        logger.info(f"Parsed {parsed_count} products from CSV")
+    
+    def finalize_products(self, batch):
+        """Fill in the fields derived from the feed values for a ProductBatch"""
+        # Price the whole batch in one pass over its columns
+        pricing_engine.apply_batch(batch)
+        
+        # Fingerprint the mapped fields so unchanged products can be skipped
+        batch.content_hashes = [fingerprint_values(batch.fingerprint_values(index)) for index in range(len(batch))]
+        
+        return batch
+    
+    def categorize_product(self, category_hint, name=None, description=None):
+        """Categorize products based on the category hint, or name and description"""
+        return classify_category(category_hint, name, description)
     
     def parse_price(self, price_str):
         """Parse price string to float"""
@@ -192,62 +216,574 @@ class BikeItFTPSyncSupabase:
         except:
             return 0
     
+    def load_fingerprints(self):
+        """Load the sku -> content_hash map for the whole catalog"""
+        if self.fingerprints is None:
+            result = supabase_service.get_product_fingerprints()
+            
+            if not result['success']:
+                raise Exception(result['error'])
+            
+            self.fingerprints = result['fingerprints']
+            logger.info(f"Loaded {len(self.fingerprints)} existing SKUs")
+        return self.fingerprints
+    
+    def select_changed_products(self, products):
+        """
+        Split a finalized ProductBatch into new, changed and unchanged by content fingerprint
+        
+        Returns the rows to write as dicts, the counts, and the SKUs of the
+        rows that update existing products.
+        """
+        fingerprints = self.load_fingerprints()
+        changed = {}
+        existing_skus = set()
+        counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+        now = datetime.utcnow().isoformat()
+        self.feed_skus.update(products.skus)
+        
+        for index, sku in enumerate(products.skus):
+            content_hash = products.content_hashes[index]
+            
+            if sku not in fingerprints:
+                counts['new'] += 1
+            elif fingerprints[sku] == content_hash:
+                counts['unchanged'] += 1
+                continue
+            else:
+                counts['changed'] += 1
+                existing_skus.add(sku)
+            
+            # Repeated SKUs collapse into one row, the later row wins. Being
+            # in the feed means the product isn't discontinued (any more)
+            changed[sku] = dict(products.row(index), updated_at=now, discontinued_at=None)
+            fingerprints[sku] = content_hash
+        
+        return list(changed.values()), counts, existing_skus
+    
+    def write_with_retries(self, write_chunks, rows):
+        """
+        Write rows with a chunked writer, retrying only the chunks that failed
+        
+        Returns (written count, rows that still failed, last chunk report).
+        """
+        written_count = 0
+        pending = rows
+        report = None
+        
+        for attempt in range(self.upsert_retries + 1):
+            if not pending:
+                break
+            
+            if attempt:
+                logger.warning(
+                    f"Retrying {len(pending)} products from {len(report['failed_chunks'])} "
+                    f"failed chunks (attempt {attempt + 1}/{self.upsert_retries + 1})"
+                )
+                time.sleep(attempt * 2)
+            
+            report = write_chunks(pending)
+            written_count += report['count']
+            
+            if report['success']:
+                pending = []
+                break
+            
+            pending = [
+                row
+                for chunk in report['chunks'] if not chunk['success']
+                for row in pending[chunk['start']:chunk['start'] + chunk['size']]
+            ]
+        
+        return written_count, pending, report
+    
     def update_database(self, products):
-        """Update Supabase database with new product data"""
+        """
+        Write new and changed products from a finalized ProductBatch to Supabase
+        
+        The price and stock changes of the written rows are added to the price
+        history, reading previous values only for the changed products.
+        """
         try:
-            # Use upsert to insert or update products
-            result = supabase_service.upsert_products(products)
-            
-            if result['success']:
-                logger.info(f"Database updated: {result['count']} products processed")
-                return {
-                    'created_or_updated': result['count'],
-                    'total': len(products)
-                }
-            else:
-                logger.error(f"Failed to update database: {result['error']}")
-                raise Exception(result['error'])
+            to_write, counts, existing_skus = self.select_changed_products(products)
+            
+            previous = {}
+            if existing_skus:
+                result = supabase_service.get_tracked_values(existing_skus)
+                if result['success']:
+                    previous = result['values']
+                else:
+                    logger.warning(f"Recording full values in the price history: {result['error']}")
+            
+            # Use chunked upserts, retrying only the chunks that failed
+            upserted_count, pending, report = self.write_with_retries(
+                supabase_service.upsert_products_batched, to_write
+            )
+            
+            failed_count = len(pending)
+            
+            if failed_count:
+                # Forget the fingerprints of rows that never made it to the database
+                for product_data in pending:
+                    self.fingerprints.pop(product_data['sku'], None)
+            
+            if to_write and not upserted_count:
+                errors = [chunk['error'] for chunk in report['chunks'] if not chunk['success']]
+                raise Exception(errors[0] if errors else 'Upsert failed')
+            
+            if failed_count:
+                logger.error(f"Database partially updated: {failed_count} products failed after retries")
+            
+            failed_skus = {product_data['sku'] for product_data in pending}
+            self.image_urls.update(
+                product_data['image_url'] for product_data in to_write if product_data['sku'] not in failed_skus
+            )
+            price_history.append(
+                change
+                for product_data in to_write if product_data['sku'] not in failed_skus
+                for change in tracked_changes(
+                    product_data['sku'], product_data['category'], previous.get(product_data['sku']),
+                    (product_data['cost_price'], product_data['selling_price'], product_data['stock_quantity'])
+                )
+            )
+            
+            logger.info(
+                f"Database updated: {counts['new']} new, {counts['changed']} changed, "
+                f"{counts['unchanged']} unchanged"
+            )
+            return {
+                'created_or_updated': upserted_count,
+                'new': counts['new'],
+                'changed': counts['changed'],
+                'unchanged': counts['unchanged'],
+                'failed': failed_count,
+                'total': len(products)
+            }
             
         except Exception as e:
             logger.error(f"Failed to update database: {e}")
             raise
+    
+    def update_stock_levels(self, levels):
+        """
+        Write only stock and price columns for SKUs whose values changed
+        
+        levels maps sku -> [stock_quantity, cost_price], None meaning keep the
+        current value. SKUs that aren't in the catalog are ignored.
+        """
+        try:
+            result = supabase_service.get_stock_levels()
+            
+            if not result['success']:
+                raise Exception(result['error'])
+            
+            changed = []
+            pricing = []
+            previous = {}
+            unchanged_count = 0
+            
+            for item in result['products']:
+                level = levels.get(item['sku'])
+                if level is None:
+                    continue
+                
+                stock_quantity = item['stock_quantity'] or 0
+                cost_price = float(item['cost_price'] or 0)
+                new_stock = stock_quantity if level[0] is None else level[0]
+                new_cost = cost_price if level[1] is None else level[1]
+                
+                if new_stock == stock_quantity and new_cost == cost_price:
+                    unchanged_count += 1
+                    continue
+                
+                changed.append({
+                    'sku': item['sku'],
+                    'stock_quantity': new_stock,
+                    'in_stock': new_stock > 0,
+                    'cost_price': new_cost
+                })
+                pricing.append((new_cost, item.get('category'), item.get('delivery_cost')))
+                previous[item['sku']] = (item.get('category'), (cost_price, item.get('selling_price'), stock_quantity))
+            
+            # Price every changed row in one batch
+            if changed:
+                costs, categories, delivery_costs = zip(*pricing)
+                delivery_costs = [None if value is None else float(value) for value in delivery_costs]
+                for level, price in zip(changed, pricing_engine.price_batch(costs, categories, delivery_costs)):
+                    level['selling_price'] = price
+            
+            written_count, pending, report = self.write_with_retries(
+                supabase_service.update_stock_levels, changed
+            )
+            
+            if changed and not written_count:
+                errors = [chunk['error'] for chunk in report['chunks'] if not chunk['success']]
+                raise Exception(errors[0] if errors else 'Stock update failed')
+            
+            failed_skus = {level['sku'] for level in pending}
+            price_history.append(
+                change
+                for level in changed if level['sku'] not in failed_skus
+                for change in tracked_changes(
+                    level['sku'], previous[level['sku']][0], previous[level['sku']][1],
+                    (level['cost_price'], level['selling_price'], level['stock_quantity'])
+                )
+            )
+            
+            unknown_count = len(levels) - len(changed) - unchanged_count
+            logger.info(
+                f"Stock levels updated: {written_count} changed, {unchanged_count} unchanged, "
+                f"{unknown_count} not in catalog"
+            )
+            
+            return {
+                'changed': written_count,
+                'unchanged': unchanged_count,
+                'unknown': unknown_count,
+                'failed': len(pending),
+                'total': len(levels)
+            }
+            
+        except Exception as e:
+            logger.error(f"Failed to update stock levels: {e}")
+            raise
+    
+    def prefetch_images(self):
+        """Fetch the images of new and changed products into the image cache in the background"""
+        if PREFETCH_IMAGES and self.image_urls:
+            image_cache.prefetch(self.image_urls)
+    
+    def retire_discontinued(self):
+        """
+        Apply the discontinued product policy to catalog products missing from the feed
+        
+        Only call this after a sync that saw the complete feed. Their content
+        hash is cleared so they are rewritten in full if they come back.
+        """
+        try:
+            with stage('discontinue'):
+                result = supabase_service.get_catalog_status()
+                
+                if not result['success']:
+                    raise Exception(result['error'])
+                
+                catalog = (
+                    (item['sku'], item['in_stock'], item['stock_quantity'], item['discontinued_at'])
+                    for item in result['products']
+                )
+                to_mark, report = plan_discontinued(catalog, self.feed_skus)
+                
+                soft_delete = report['policy'] == 'soft_delete'
+                marked_count, pending, chunk_report = self.write_with_retries(
+                    lambda skus: supabase_service.mark_discontinued(skus, soft_delete), to_mark
+                )
+            
+            if to_mark and not marked_count:
+                errors = [chunk['error'] for chunk in chunk_report['chunks'] if not chunk['success']]
+                raise Exception(errors[0] if errors else 'Discontinued product update failed')
+            
+            marked = set(to_mark).difference(pending)
+            price_history.append(
+                (item['sku'], item['category'], 'stock_quantity', 0.0)
+                for item in result['products']
+                if item['sku'] in marked and item['stock_quantity']
+            )
+            
+            report['marked'] = marked_count
+            report['failed'] = len(pending)
+            record('discontinue', rows=marked_count)
+            
+            if to_mark:
+                logger.info(f"Marked {marked_count} discontinued products ({report['policy']})")
+            
+            return report
+            
+        except Exception as e:
+            logger.error(f"Failed to mark discontinued products: {e}")
+            raise
+    
+    def reprice_catalog(self):
+        """Recompute every stored selling price with the current pricing rules, writing only changed ones"""
+        try:
+            result = supabase_service.get_pricing_inputs()
+            
+            if not result['success']:
+                raise Exception(result['error'])
+            
+            rows = result['products']
+            changed = []
+            
+            with stage('price'):
+                if rows:
+                    prices = pricing_engine.price_batch(
+                        [float(item['cost_price'] or 0) for item in rows],
+                        [item['category'] for item in rows],
+                        [None if item['delivery_cost'] is None else float(item['delivery_cost']) for item in rows]
+                    )
+                    changed = [
+                        {'sku': item['sku'], 'selling_price': price, 'category': item['category']}
+                        for item, price in zip(rows, prices)
+                        if item['selling_price'] is None or abs(price - float(item['selling_price'])) >= 0.005
+                    ]
+            record('price', rows=len(rows))
+            
+            with stage('write'):
+                written_count, pending, report = self.write_with_retries(
+                    supabase_service.update_selling_prices, changed
+                )
+            record('write', rows=written_count)
+            
+            if changed and not written_count:
+                errors = [chunk['error'] for chunk in report['chunks'] if not chunk['success']]
+                raise Exception(errors[0] if errors else 'Price update failed')
+            
+            failed_skus = {price['sku'] for price in pending}
+            price_history.append(
+                (price['sku'], price['category'], 'selling_price', price['selling_price'])
+                for price in changed if price['sku'] not in failed_skus
+            )
+            
+            logger.info(f"Catalog repriced: {written_count} of {len(rows)} selling prices changed")
+            return {
+                'changed': written_count,
+                'unchanged': len(rows) - len(changed),
+                'failed': len(pending),
+                'total': len(rows)
+            }
+            
+        except Exception as e:
+            logger.error(f"Failed to reprice catalog: {e}")
+            raise
+
+@coordinated_sync('sync-supabase')
+@instrument_sync('supabase')
+@invalidates_catalog
+@refreshes_summary(supabase_category_summary)
+def sync_bikeit_products(streaming=True, chunk_size=DEFAULT_CHUNK_SIZE, use_cache=True, from_cache=False,
+                         parallel=None, stock_only=False, session=None):
+    """
+    Main function to sync products from Bike It FTP
 
-def sync_bikeit_products():
-    """Main function to sync products from Bike It FTP"""
+    In streaming mode the feed is decoded, parsed and written to the database
+    in chunks of chunk_size products, so peak memory doesn't grow with the
+    size of the feed. With use_cache the feed is first streamed to a local
+    copy, and the sync is skipped when the remote file hasn't changed since
+    the last successful run. from_cache replays the newest local copy
+    without connecting to the FTP server. Parsed feeds are kept in a
+    ParsedFeedCache keyed by their content, so syncing the same feed again
+    skips parsing.
+    
+    parallel (default FTP_SYNC_PARALLEL) ingests every catalogue, stock and
+    price file: they are downloaded concurrently, parsed in a process pool
+    and merged by SKU before the database is updated.
+    
+    stock_only is the lightweight fast path: only the SKU, stock and price
+    columns are read, and only stock_quantity, in_stock, cost_price and
+    selling_price are written for SKUs whose values changed.
+    
+    session is an optional SFTPSession whose connection is reused and left
+    open, for long-running processes such as the sync scheduler.
+    
+    After a full sync, catalog products missing from the feed are marked
+    out of stock or soft-deleted according to DISCONTINUED_POLICY (see
+    discontinued).
+    
+    Each run's stage timings and counters are recorded in the sync run
+    history (see sync_metrics).
+    
+    Only one sync runs at a time across processes (see sync_lock). A call
+    made while a sync of the same kind is running returns that sync's
+    result, marked 'attached', instead of syncing again.
+    """
+    if parallel is None:
+        parallel = os.getenv('FTP_SYNC_PARALLEL', 'false').lower() == 'true'
+    
     try:
         logger.info("Starting Bike It product synchronization with Supabase")
         
+        # Syncs started from the web app price with the current rules file too
+        pricing_engine.reload_if_changed()
+        
         # Initialize FTP sync
         ftp_sync = BikeItFTPSyncSupabase()
         
-        # Connect to FTP server
-        ssh, sftp = ftp_sync.connect_ftp()
+        if from_cache:
+            return sync_cached_feed(ftp_sync, FeedCache(), chunk_size)
+        
+        # Connect to FTP server, reusing the session's connection when given one
+        with stage('connect'):
+            ssh, sftp = session.connect() if session else ftp_sync.connect_ftp()
         
         try:
-            # Download product feed
-            csv_content = ftp_sync.download_product_feed(sftp)
-            
-            if not csv_content:
-                return {'error': 'No product feed found'}
-            
-            # Parse CSV content
-            products = ftp_sync.parse_csv_content(csv_content)
+            if stock_only:
+                # Separate feed state so the full sync still sees feeds as changed
+                feed_cache = FeedCache(namespace='stock')
+                status, feed_files, levels = ingest_stock_levels(ftp_sync, ssh, sftp, feed_cache)
+                
+                if status == 'missing':
+                    return {'error': 'No product feed found'}
+                
+                if status == 'unchanged':
+                    logger.info("Stock feeds unchanged, synchronization skipped")
+                    return {'skipped': True, 'reason': 'Stock feeds unchanged since last sync',
+                            'feed_files': [attr.filename for attr in feed_files.values()]}
+                
+                with stage('write'):
+                    result = ftp_sync.update_stock_levels(levels)
+                record('write', rows=len(levels))
+                
+                if feed_written(result):
+                    for attr in feed_files.values():
+                        feed_cache.mark_synced(attr.filename, remember=False)
+            elif parallel:
+                feed_cache = FeedCache()
+                status, feed_files, products = ingest_feed_files(ftp_sync, ssh, sftp, feed_cache, ParsedFeedCache())
+                
+                if status == 'missing':
+                    return {'error': 'No product feed found'}
+                
+                if status == 'unchanged':
+                    logger.info("Product feeds unchanged, synchronization skipped")
+                    return {'skipped': True, 'reason': 'Product feeds unchanged since last sync',
+                            'feed_files': [attr.filename for attr in feed_files.values()]}
+                
+                result = sync_products_in_chunks(ftp_sync, products.slices(chunk_size))
+                
+                if feed_written(result):
+                    for kind, attr in feed_files.items():
+                        feed_cache.mark_synced(attr.filename, remember=(kind == 'catalogue'))
+            elif streaming and use_cache:
+                feed_cache = FeedCache()
+                with stage('discover'):
+                    feed_file, remote_stat = feed_cache.locate_feed_file(sftp, ftp_sync.find_feed_file)
+                
+                if not feed_file:
+                    return {'error': 'No product feed found'}
+                
+                # Only download when the remote file has changed
+                with stage('download'):
+                    fetched = feed_cache.fetch(sftp, feed_file, remote_stat)
+                
+                if fetched['status'] == 'unchanged':
+                    logger.info("Product feed unchanged, synchronization skipped")
+                    return {'skipped': True, 'reason': 'Product feed unchanged since last sync', 'feed_file': feed_file}
+                
+                # Parsed batches are cached by feed content, so a retry skips parsing
+                batches = ParsedFeedCache().feed_batches(ftp_sync, fetched['path'], fetched['sha256'], chunk_size)
+                result = sync_products_in_chunks(ftp_sync, batches)
+                
+                if feed_written(result):
+                    feed_cache.mark_synced(feed_file)
+            elif streaming:
+                with stage('discover'):
+                    feed_file = ftp_sync.find_feed_file(sftp)
+                
+                if not feed_file:
+                    return {'error': 'No product feed found'}
+                
+                # Parse and update the database one chunk at a time
+                result = sync_feed_lines(ftp_sync, ftp_sync.stream_product_feed(sftp, feed_file), chunk_size)
+            else:
+                # Download product feed
+                with stage('download'):
+                    csv_content = ftp_sync.download_product_feed(sftp)
+                
+                if not csv_content:
+                    return {'error': 'No product feed found'}
+                
+                # Parse CSV content
+                with stage('parse'):
+                    products = ftp_sync.parse_csv_content(csv_content)
+                record('parse', bytes=len(csv_content), rows=len(products))
+                
+                # Update database
+                with stage('write'):
+                    result = ftp_sync.update_database(products)
+                record('write', rows=len(products))
             
-            # Update database
-            result = ftp_sync.update_database(products)
+            if not stock_only:
+                # The whole feed was synced, so catalog SKUs missing from it were discontinued
+                result['discontinued'] = ftp_sync.retire_discontinued()
+                ftp_sync.prefetch_images()
+                search_index.invalidate()
             
             logger.info("Product synchronization completed successfully")
             return result
             
         finally:
-            # Close connections
-            sftp.close()
-            ssh.close()
+            # Close connections, unless they belong to a long-lived session
+            if not session:
+                sftp.close()
+                ssh.close()
             
     except Exception as e:
         logger.error(f"Product synchronization failed: {e}")
         return {'error': str(e)}
 
+def sync_bikeit_stock():
+    """Fast path sync of stock levels and prices only"""
+    return sync_bikeit_products(stock_only=True)
+
+@coordinated_sync('sync-supabase', kind='reprice')
+@instrument_sync('supabase', sync_type='reprice')
+@invalidates_catalog
+@refreshes_summary(supabase_category_summary)
+def reprice_products():
+    """
+    Recompute the stored selling prices in bulk after the pricing rules change
+    
+    Runs under the sync lock, so it never overlaps a product sync.
+    """
+    try:
+        pricing_engine.reload_if_changed()
+        return BikeItFTPSyncSupabase().reprice_catalog()
+        
+    except Exception as e:
+        logger.error(f"Repricing failed: {e}")
+        return {'error': str(e)}
+
+def feed_written(result):
+    """
+    Whether every product of a feed was written, so the feed can be marked synced
+    
+    A feed with failed rows stays pending: the next sync sees it as changed
+    and the retry queue replays it, instead of skipping it as unchanged.
+    """
+    if result.get('failed'):
+        logger.warning(f"{result['failed']} products failed to write, leaving the feed pending for a retry")
+        return False
+    return True
+
+def sync_cached_feed(ftp_sync, feed_cache, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Replay the newest local copy of the feed without an SFTP round trip
+    
+    The feed's parsed batches are loaded from the ParsedFeedCache when it
+    was parsed before, e.g. by the sync that failed and is being retried.
+    """
+    feed_file, path, content_hash = feed_cache.latest_local_copy()
+    
+    if not path:
+        return {'error': 'No cached product feed found'}
+    
+    logger.info(f"Replaying cached product feed: {path}")
+    
+    if content_hash:
+        batches = ParsedFeedCache().feed_batches(ftp_sync, path, content_hash, chunk_size)
+        result = sync_products_in_chunks(ftp_sync, batches)
+    else:
+        with open(path, 'rb') as feed:
+            result = sync_feed_lines(ftp_sync, iter_decoded_lines(feed), chunk_size)
+    
+    if feed_written(result):
+        feed_cache.mark_synced(feed_file)
+    result['discontinued'] = ftp_sync.retire_discontinued()
+    ftp_sync.prefetch_images()
+    search_index.invalidate()
+    
+    logger.info("Product synchronization completed successfully")
+    return result
+
 if __name__ == '__main__':
     # For testing purposes
     result = sync_bikeit_products()
@@ -0,0 +1,312 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import requests
+
+try:
+    from PIL import Image
+except ImportError:
+    # Without Pillow every variant is served as the original image
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'image_cache'))
+
+# Disk space the cached images may take; the least recently used are evicted beyond it
+MAX_BYTES = int(float(os.getenv('IMAGE_CACHE_MAX_MB', 1024)) * 1024 * 1024)
+
+# Concurrent fetches from the supplier's image host
+FETCH_WORKERS = int(os.getenv('IMAGE_FETCH_WORKERS', 4))
+
+# Background prefetches run on their own, smaller pool so page requests never
+# queue behind them; URLs beyond the queue limit are left to be fetched on demand
+PREFETCH_WORKERS = int(os.getenv('IMAGE_PREFETCH_WORKERS', 2))
+PREFETCH_QUEUE_SIZE = int(os.getenv('IMAGE_PREFETCH_QUEUE_SIZE', 500))
+
+FETCH_TIMEOUT = float(os.getenv('IMAGE_FETCH_TIMEOUT', 15))
+
+# Fetch the images of new and changed products after each sync
+PREFETCH = os.getenv('IMAGE_PREFETCH', 'true').lower() == 'true'
+
+# How long browsers and CDNs may reuse a served image
+SERVE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 7 * 24 * 3600))
+
+# Images larger than this are not cached
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# Largest width and height of each resized variant
+VARIANTS = {
+    'thumb': (150, 150),
+    'listing': (400, 400),
+}
+
+class ImageError(Exception):
+    """An image that can't be fetched or decoded"""
+
+class ImageTimeout(ImageError):
+    """An image fetch that didn't finish in time"""
+
+class ImageCache:
+    """
+    Supplier product images fetched once and kept on disk with resized variants
+
+    Each image is stored under the SHA-256 of its URL: a JSON entry with the
+    content type and ETag of each variant, the original, and the variants
+    listed in VARIANTS resized with Pillow when it is installed. Fetches run
+    on a bounded thread pool, and concurrent requests for the same URL share
+    one fetch. Prefetches after a sync run on a separate pool with a bounded
+    queue; a request for an image still waiting there fetches it at once.
+    Entries are evicted least recently used first once the cache
+    outgrows max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=MAX_BYTES, workers=FETCH_WORKERS,
+                 prefetch_workers=PREFETCH_WORKERS, prefetch_queue_size=PREFETCH_QUEUE_SIZE):
+        self.cache_dir = os.path.abspath(cache_dir or IMAGE_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-fetch')
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='image-prefetch')
+        self.prefetch_queue_size = prefetch_queue_size
+        # Reentrant, as cancelling a prefetch under it runs its done callback
+        self.lock = threading.RLock()
+        # url -> (future, whether it's a prefetch)
+        self.in_flight = {}
+        self.prefetching = 0
+        self.total_bytes = None
+        self.local = threading.local()
+
+    def key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2])
+
+    def entry_path(self, key):
+        return os.path.join(self.entry_dir(key), f'{key}.json')
+
+    def variant_path(self, key, variant):
+        return os.path.join(self.entry_dir(key), f'{key}.{variant}')
+
+    def load_entry(self, key):
+        try:
+            with open(self.entry_path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, url, variant='original', timeout=None):
+        """
+        Return (path, content_type, etag) of a variant of an image, fetching it on a miss
+
+        Raises ImageError when the image can't be fetched, ImageTimeout when
+        the fetch takes too long.
+        """
+        if variant != 'original' and variant not in VARIANTS:
+            raise ValueError(f"Unknown image variant: {variant}")
+
+        key = self.key(url)
+        entry = self.load_entry(key)
+        if entry is None:
+            try:
+                entry = self.fetch(url).result(timeout or FETCH_TIMEOUT * 2)
+            except FutureTimeoutError:
+                raise ImageTimeout(f"Timed out fetching image {url}")
+
+        # Variants that couldn't be resized are the original image
+        variant = variant if variant in entry['variants'] else 'original'
+        info = entry['variants'][variant]
+
+        # Recently used entries are evicted last
+        try:
+            os.utime(self.entry_path(key))
+        except OSError:
+            pass
+
+        return self.variant_path(key, variant), info['content_type'], info['etag']
+
+    def fetch(self, url):
+        """Future for the entry of an image, starting a fetch unless one is already running"""
+        with self.lock:
+            future, prefetch = self.in_flight.get(url, (None, False))
+            # A prefetch that hasn't started yet is taken over rather than waited for
+            if future is None or (prefetch and future.cancel()):
+                future = self.executor.submit(self._fetch, url)
+                self.in_flight[url] = (future, False)
+                future.add_done_callback(lambda done: self._done(url, done))
+            return future
+
+    def _done(self, url, future):
+        with self.lock:
+            if self.in_flight.get(url, (None,))[0] is future:
+                del self.in_flight[url]
+
+    def _fetch(self, url):
+        key = self.key(url)
+        entry = self.load_entry(key)
+        if entry is not None:
+            return entry
+
+        # Each fetch thread keeps its own HTTP session, and its connections
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            http = self.local.http = requests.Session()
+
+        try:
+            with http.get(url, timeout=FETCH_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                content = response.raw.read(MAX_IMAGE_BYTES + 1, decode_content=True)
+        except requests.RequestException as e:
+            raise ImageError(f"Failed to fetch image {url}: {e}")
+
+        if len(content) > MAX_IMAGE_BYTES:
+            raise ImageError(f"Image {url} is larger than {MAX_IMAGE_BYTES} bytes")
+
+        # Anything else could be served as active content from our own origin
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith('image/') or content_type == 'image/svg+xml':
+            raise ImageError(f"{url} is not a raster image ({content_type or 'no content type'})")
+        variants = {'original': (content, content_type)}
+        variants.update(self.resize(url, content))
+
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        entry = {'url': url, 'fetched_at': time.time(), 'variants': {}}
+        size = 0
+
+        for variant, (data, variant_type) in variants.items():
+            path = self.variant_path(key, variant)
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(f'{path}.tmp', path)
+            entry['variants'][variant] = {
+                'content_type': variant_type,
+                'etag': hashlib.sha256(data).hexdigest()[:32],
+                'size': len(data),
+            }
+            size += len(data)
+
+        # The entry file is written last, so it only exists once all variants do
+        tmp_path = f'{self.entry_path(key)}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.entry_path(key))
+
+        self._added(size)
+        return entry
+
+    def resize(self, url, content):
+        """{variant: (data, content_type)} of the resized variants, empty without Pillow"""
+        if Image is None:
+            return {}
+
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                image.load()
+                has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+                resized = {}
+
+                for variant, size in VARIANTS.items():
+                    copy = image.copy()
+                    copy.thumbnail(size)
+                    buffer = io.BytesIO()
+                    if has_alpha:
+                        copy.convert('RGBA').save(buffer, 'PNG', optimize=True)
+                        resized[variant] = buffer.getvalue(), 'image/png'
+                    else:
+                        copy.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True)
+                        resized[variant] = buffer.getvalue(), 'image/jpeg'
+
+                return resized
+        except Exception as e:
+            logger.warning(f"Serving {url} unresized, it can't be decoded: {e}")
+            return {}
+
+    def prefetch(self, urls):
+        """Fetch the images of the given URLs that aren't cached yet in the background, up to the queue limit"""
+        queued = skipped = 0
+        for url in dict.fromkeys(urls):
+            if not url or not url.startswith(('http://', 'https://')) or os.path.exists(self.entry_path(self.key(url))):
+                continue
+
+            with self.lock:
+                if url in self.in_flight:
+                    continue
+                if self.prefetching >= self.prefetch_queue_size:
+                    skipped += 1
+                    continue
+                future = self.prefetch_executor.submit(self._fetch, url)
+                self.in_flight[url] = (future, True)
+                self.prefetching += 1
+            future.add_done_callback(lambda done, url=url: self._prefetched(url, done))
+            queued += 1
+
+        if queued:
+            logger.info(f"Prefetching {queued} product images")
+        if skipped:
+            logger.info(f"Prefetch queue full, {skipped} product images will be fetched on first request")
+        return queued
+
+    def _prefetched(self, url, future):
+        with self.lock:
+            self.prefetching -= 1
+        self._done(url, future)
+
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(str(future.exception()))
+
+    def _entries(self):
+        """(last used, size, key) of every cached image"""
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith('.json'):
+                    continue
+                key = name[:-len('.json')]
+                try:
+                    last_used = os.path.getmtime(os.path.join(root, name))
+                    with open(os.path.join(root, name), 'r') as f:
+                        size = sum(info['size'] for info in json.load(f)['variants'].values())
+                except (OSError, ValueError, KeyError):
+                    continue
+                entries.append((last_used, size, key))
+        return entries
+
+    def _added(self, size):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(entry_size for _, entry_size, _ in self._entries())
+            else:
+                self.total_bytes += size
+
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used images until the cache fits, keeping a tenth spare"""
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, key in entries:
+            if total <= target:
+                break
+            try:
+                # Without the entry file the image is a miss, so remove it first
+                os.remove(self.entry_path(key))
+                for name in os.listdir(self.entry_dir(key)):
+                    if name.startswith(f'{key}.'):
+                        os.remove(os.path.join(self.entry_dir(key), name))
+            except OSError:
+                continue
+            total -= size
+
+        logger.info(f"Image cache evicted down to {total} bytes")
+        self.total_bytes = total
+
+# Global image cache
+image_cache = ImageCache()
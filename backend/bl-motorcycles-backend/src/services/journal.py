@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where replacing a journal can race with appends to it
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """Lock between processes on a path.lock file beside path, where fcntl is available"""
+    if fcntl is None:
+        yield
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class Journal:
+    """
+    A file of JSON entries shared between processes, appended to and replaced as a whole
+
+    reset() replaces the file with a first entry carrying a new generation
+    id, e.g. a snapshot. append() adds entries after it. Each process reads
+    only what was appended since its last read; the generation id tells a
+    replaced journal from the one read before, even when the filesystem
+    reuses the old file's inode. An unchanged file costs one stat to read.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.generation = None
+        self.offset = 0
+        # Stat of the file when it was last read to the end
+        self.stamp = None
+
+    def locked(self, exclusive=False):
+        """
+        Lock on the journal between processes, where fcntl is available
+
+        Hold it exclusively to compute and reset() a new base, and shared
+        around a change and the append() recording it, so a change is
+        either seen by the new base or appended after it, never lost.
+        """
+        return file_lock(self.path, exclusive)
+
+    def reset(self, entry):
+        """Replace the journal with entry as its first line, under a new generation"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(dict(entry, generation=uuid.uuid4().hex)) + '\n')
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def append(self, entry):
+        """Append an entry, starting a new generation when there is no journal yet"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.exists(self.path):
+            self._create()
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def _create(self):
+        """Create the journal with a 'start' entry, unless another process just did"""
+        tmp_path = f'{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps({'op': 'start', 'generation': uuid.uuid4().hex}) + '\n')
+            os.link(tmp_path, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+
+    def read(self):
+        """
+        The entries written since the last read
+
+        After the journal was replaced, they start with its first entry
+        again. A partly written last line is left for the next read.
+        """
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if self._stamp(info) == self.stamp:
+            return []
+
+        try:
+            with open(self.path, 'rb') as f:
+                # Taken before reading, so an append during the read shows up next time
+                stamp = self._stamp(os.fstat(f.fileno()))
+                generation = self._generation(f.readline())
+                if generation != self.generation:
+                    self.generation = generation
+                    self.offset = 0
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        complete = data[:data.rfind(b'\n') + 1]
+        self.offset += len(complete)
+        self.stamp = stamp if len(complete) == len(data) else None
+
+        entries = []
+        for line in complete.decode('utf-8').splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Skipping unreadable line of {self.path}: {line[:100]}")
+        return entries
+
+    def _stamp(self, info):
+        return info.st_dev, info.st_ino, info.st_size, info.st_mtime_ns, info.st_ctime_ns
+
+    def _generation(self, first_line):
+        try:
+            return json.loads(first_line).get('generation')
+        except (ValueError, AttributeError):
+            return None
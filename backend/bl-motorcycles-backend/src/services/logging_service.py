@@ -105,6 +105,10 @@ class BLMotorcyclesLogger:
         self.ftp_logger.error(f"FTP sync failed: {error}")
         self.error_logger.error(f"FTP sync error: {error}")
     
+    def log_ftp_sync_run(self, run):
+        """Log the stage timings and counters of a finished FTP sync run as a JSON record"""
+        self.ftp_logger.info(f"FTP sync run: {json.dumps(run, default=str, sort_keys=True)}")
+    
     def log_webhook_received(self, webhook_type, data):
         """Log webhook received"""
         self.webhook_logger.info(f"Webhook received - Type: {webhook_type}")
@@ -169,6 +173,9 @@ def log_ftp_sync_success(result):
 def log_ftp_sync_error(error):
     bl_logger.log_ftp_sync_error(error)
 
+def log_ftp_sync_run(run):
+    bl_logger.log_ftp_sync_run(run)
+
 def log_webhook_received(webhook_type, data):
     bl_logger.log_webhook_received(webhook_type, data)
 
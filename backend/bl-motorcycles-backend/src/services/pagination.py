@@ -0,0 +1,250 @@
+import base64
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+# How long a listing's total count is reused before it is counted again
+COUNT_TTL_SECONDS = float(os.getenv('PAGINATION_COUNT_TTL_SECONDS', 60))
+
+# Distinct filter combinations whose counts are kept
+COUNT_CACHE_SIZE = 1024
+
+MAX_PER_PAGE = 100
+
+# Columns the cursor-paginated listings can be sorted by, each with id as tie-breaker
+PRODUCT_SORT_COLUMNS = ('id', 'selling_price', 'created_at')
+ORDER_SORT_COLUMNS = ('id', 'created_at')
+
+class CursorError(ValueError):
+    """A cursor or sort that doesn't fit the listing it was given to"""
+
+class Keyset:
+    """
+    A sort order on unique keys, for keyset pagination
+
+    Rows are sorted by column, then by id to break ties, both ascending or
+    both descending, so every row has a distinct position. A sort is named
+    by its column, with a leading '-' for descending: 'selling_price',
+    '-created_at', 'id'. NULLs sort as each database orders them, along its
+    indexes: before every value on SQLite, after every value on Postgres.
+    """
+
+    def __init__(self, name, allowed_columns):
+        column = name[1:] if name.startswith('-') else name
+        if column not in allowed_columns:
+            raise CursorError(f"Can't sort by {name}, use one of: {', '.join(allowed_columns)} (prefix - for descending)")
+
+        self.name = name
+        self.descending = name.startswith('-')
+        self.columns = ('id',) if column == 'id' else (column, 'id')
+
+    def key(self, row):
+        """The sort key of a row, a model instance or a dict, as JSON values"""
+        values = []
+        for column in self.columns:
+            value = row[column] if isinstance(row, dict) else getattr(row, column)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        return values
+
+    def encode(self, values, backward=False):
+        return encode_cursor({'s': self.name, 'k': values, 'b': backward})
+
+    def decode(self, cursor):
+        """(key values, backward) of a cursor, (None, False) for the first page"""
+        if not cursor:
+            return None, False
+
+        state = decode_cursor(cursor)
+        values = state.get('k')
+        if state.get('s') != self.name or not isinstance(values, list) or len(values) != len(self.columns):
+            raise CursorError("Cursor doesn't match the requested sort")
+        # Keys are numbers, timestamp strings or NULL, ending with the integer id
+        if not all(value is None or type(value) in (int, float, str) for value in values) or type(values[-1]) is not int:
+            raise CursorError("Invalid cursor")
+        return values, bool(state.get('b'))
+
+def encode_cursor(state):
+    """Opaque URL-safe cursor for a pagination state"""
+    data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        state = json.loads(data)
+    except (ValueError, TypeError):
+        raise CursorError("Invalid cursor")
+    if not isinstance(state, dict):
+        raise CursorError("Invalid cursor")
+    return state
+
+def cursor_page(fetch, keyset, cursor, limit):
+    """
+    Fetch the page of rows a cursor points at
+
+    fetch(after, backward, limit) returns up to limit rows that sort after
+    the key values after (before them when backward, in reverse order), or
+    from the start when after is None. Returns (rows, pagination) where
+    pagination has the next and prev cursors, None at either end.
+    """
+    after, backward = keyset.decode(cursor)
+    rows = list(fetch(after, backward, limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    if backward:
+        rows.reverse()
+        has_next, has_prev = after is not None, more
+    else:
+        has_next, has_prev = more, after is not None
+
+    return rows, {
+        'sort': keyset.name,
+        'per_page': limit,
+        'next': keyset.encode(keyset.key(rows[-1])) if rows and has_next else None,
+        'prev': keyset.encode(keyset.key(rows[0]), backward=True) if rows and has_prev else None,
+        'has_next': has_next,
+        'has_prev': has_prev,
+    }
+
+def offset_page(fetch, cursor, limit):
+    """
+    Like cursor_page for listings without a stable key, such as ranked search results
+
+    The cursor holds the offset of the page. fetch(offset, limit) returns
+    up to limit rows from offset.
+    """
+    offset = 0
+    if cursor:
+        state = decode_cursor(cursor)
+        offset = state.get('o')
+        if state.get('s') != 'rank' or not isinstance(offset, int) or offset < 0:
+            raise CursorError("Cursor doesn't match the requested listing")
+
+    rows = list(fetch(offset, limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    return rows, {
+        'sort': 'rank',
+        'per_page': limit,
+        'next': encode_cursor({'s': 'rank', 'o': offset + limit}) if more else None,
+        'prev': encode_cursor({'s': 'rank', 'o': max(0, offset - limit)}) if offset else None,
+        'has_next': more,
+        'has_prev': offset > 0,
+    }
+
+def keyset_filter(model, keyset, after, backward):
+    """SQLAlchemy condition selecting the rows of model that sort after the key values after"""
+    descending = keyset.descending != backward
+    condition = None
+
+    # (a, id) > (x, y) is a > x OR (a = x AND id > y), built from the last column out
+    for column_name, value in reversed(list(zip(keyset.columns, after))):
+        column = getattr(model, column_name)
+        if value is None:
+            # NULL sorts before every value, as SQLite orders it
+            beyond = None if descending else column.isnot(None)
+            same = column.is_(None)
+        else:
+            if column.type.python_type is datetime:
+                try:
+                    value = datetime.fromisoformat(value)
+                except (TypeError, ValueError):
+                    raise CursorError("Invalid cursor")
+            beyond = column < value if descending else column > value
+            if descending and column_name != 'id':
+                beyond = or_(beyond, column.is_(None))
+            same = column == value
+
+        if condition is not None:
+            tie = and_(same, condition)
+            beyond = tie if beyond is None else or_(beyond, tie)
+        condition = beyond
+    return condition
+
+def keyset_order(model, keyset, backward=False):
+    descending = keyset.descending != backward
+    return [getattr(model, name).desc() if descending else getattr(model, name).asc() for name in keyset.columns]
+
+def keyset_query(query, model, keyset):
+    """fetch function for cursor_page over a SQLAlchemy query of model"""
+    def fetch(after, backward, limit):
+        if after is not None:
+            query_page = query.filter(keyset_filter(model, keyset, after, backward))
+        else:
+            query_page = query
+        return query_page.order_by(None).order_by(*keyset_order(model, keyset, backward)).limit(limit).all()
+    return fetch
+
+def postgrest_keyset_filter(keyset, after, backward):
+    """PostgREST or= expression selecting the rows that sort after the key values after"""
+    operator = 'lt' if keyset.descending != backward else 'gt'
+    expression = None
+
+    for column, value in reversed(list(zip(keyset.columns, after))):
+        if value is None:
+            # NULL sorts after every value, as Postgres orders it
+            terms = [f'{column}.not.is.null'] if operator == 'lt' else []
+            same = f'{column}.is.null'
+        else:
+            # Quoted, as timestamps contain PostgREST's reserved characters
+            value = json.dumps(value) if isinstance(value, str) else value
+            terms = [f'{column}.{operator}.{value}']
+            if operator == 'gt' and column != 'id':
+                terms.append(f'{column}.is.null')
+            same = f'{column}.eq.{value}'
+
+        if expression is not None:
+            inner = f'or({expression})' if ',' in expression else expression
+            terms.append(f'and({same},{inner})')
+        expression = ','.join(terms)
+    return expression
+
+class CountCache:
+    """
+    Total counts of listings, reused for a while instead of counted on every page
+
+    Counts are keyed by the listing and its filters, and are at most ttl
+    seconds old.
+    """
+
+    def __init__(self, ttl=COUNT_TTL_SECONDS, max_size=COUNT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def get(self, key, count):
+        """The cached count for key, calling count() when it is missing or expired"""
+        now = time.monotonic()
+        with self.lock:
+            cached = self.counts.get(key)
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+
+        value = count()
+
+        with self.lock:
+            if len(self.counts) >= self.max_size:
+                self.counts = {k: v for k, v in self.counts.items() if now - v[0] < self.ttl}
+                if len(self.counts) >= self.max_size:
+                    self.counts.clear()
+            self.counts[key] = (now, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+
+def pagination_args(args, default_sort):
+    """(cursor, sort, per_page, include_total) of a cursor listing request's arguments"""
+    per_page = min(max(int(args.get('per_page', 20)), 1), MAX_PER_PAGE)
+    include_total = args.get('include_total', 'false').lower() == 'true'
+    return args.get('cursor', ''), args.get('sort') or default_sort, per_page, include_total
+
+# Global listing count cache
+count_cache = CountCache()
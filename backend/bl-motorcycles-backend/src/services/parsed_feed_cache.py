@@ -0,0 +1,166 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from src.services.feed_cache import DEFAULT_CACHE_DIR
+from src.services.category_classifier import CLASSIFIER_VERSION
+from src.services.feed_schema import MAPPING_VERSION
+from src.services.feed_stream import iter_decoded_lines, DEFAULT_CHUNK_SIZE
+from src.services.sync_metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of ProductBatch or of the cache entries changes
+FORMAT_VERSION = 1
+
+# Disk space the parsed feeds may take; the least recently used are evicted beyond it
+MAX_BYTES = int(float(os.getenv('PARSED_FEED_CACHE_MAX_MB', 256)) * 1024 * 1024)
+
+ENTRY_SUFFIX = '.batches'
+
+class ParsedFeedCache:
+    """
+    Parsed feed batches kept on disk, keyed by the feed's content
+
+    An entry holds the ProductBatches parsed from one feed, pickled one after
+    the other so they can be loaded back a batch at a time. Batches are stored
+    before pricing, so a change of pricing rules doesn't invalidate them. The
+    key combines the feed's SHA-256 with MAPPING_VERSION, CLASSIFIER_VERSION
+    and FORMAT_VERSION, so entries parsed with an older column mapping or
+    category classifier are never reused. Only
+    entries written by this class are ever loaded.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=MAX_BYTES):
+        cache_dir = cache_dir or os.getenv('FEED_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.cache_dir = os.path.join(os.path.abspath(cache_dir), 'parsed')
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, *content_hashes):
+        """Cache key of the feed file, or set of feed files, with the given SHA-256s"""
+        content = content_hashes[0] if len(content_hashes) == 1 else hashlib.sha256(
+            '\n'.join(content_hashes).encode('utf-8')
+        ).hexdigest()
+        return f'{content}-m{MAPPING_VERSION}-c{CLASSIFIER_VERSION}-f{FORMAT_VERSION}'
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def contains(self, key):
+        return os.path.exists(self.entry_path(key))
+
+    def store(self, key, batches):
+        """
+        Write batches as the entry for key; returns the number of products stored
+
+        The entry only appears once every batch has been written, so a parse
+        that fails part way leaves nothing behind.
+        """
+        path = self.entry_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        count = 0
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                for batch in batches:
+                    pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    count += len(batch)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict(keep=key)
+        return count
+
+    def load(self, key):
+        """
+        Open the entry for key and yield its batches one at a time
+
+        Returns None when there is no entry. The file is opened straight away,
+        so the entry can't be evicted from under the caller.
+        """
+        path = self.entry_path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        # Recently used entries are evicted last
+        os.utime(path)
+        return self._read_batches(f, path)
+
+    def _read_batches(self, f, path):
+        with f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+                except (pickle.UnpicklingError, AttributeError, ValueError) as e:
+                    logger.error(f"Removing unreadable parsed feed {path}: {e}")
+                    self.remove(path)
+                    raise
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        keep_path = self.entry_path(keep) if keep else None
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            logger.info(f"Evicting parsed feed {os.path.basename(path)} ({size} bytes)")
+            self.remove(path)
+            total -= size
+
+    def feed_batches(self, feed_sync, path, content_hash, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Parsed batches of a local feed file, parsing it into the cache first on a miss
+
+        The whole feed is parsed and stored before the first batch is handed
+        out, so a sync that then fails writing to the database can be retried
+        without parsing the feed again.
+        """
+        key = self.key(content_hash)
+        batches = self.load(key)
+        if batches is not None:
+            logger.info(f"Loading parsed feed {key} from cache")
+            return batches
+
+        try:
+            with stage('parse'), open(path, 'rb') as feed:
+                self.store(key, feed_sync.parse_batches(iter_decoded_lines(feed), chunk_size))
+        except OSError as e:
+            # E.g. the disk is full; parse the feed as it's synced instead
+            logger.warning(f"Failed to cache parsed feed {key}: {e}")
+            return self._parse_file(feed_sync, path, chunk_size)
+
+        batches = self.load(key)
+        return batches if batches is not None else self._parse_file(feed_sync, path, chunk_size)
+
+    def _parse_file(self, feed_sync, path, chunk_size):
+        with open(path, 'rb') as feed:
+            yield from feed_sync.parse_batches(iter_decoded_lines(feed), chunk_size)
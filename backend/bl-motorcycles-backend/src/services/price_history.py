@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Shared by the web app, the scheduler and cron runs, like the sync run history
+HISTORY_DIR = os.getenv('PRICE_HISTORY_DIR', os.path.join(
+    os.getenv('FEED_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')), 'price_history'
+))
+
+# Product columns whose changes are recorded
+TRACKED_FIELDS = ('cost_price', 'selling_price', 'stock_quantity')
+
+FORMAT_VERSION = 1
+
+# Category code of products without a category
+NO_CATEGORY = 0xFFFF
+
+# Decoded segments kept in memory for repeated queries
+SEGMENT_CACHE_SIZE = 64
+
+def tracked_changes(sku, category, old, new):
+    """
+    Yield (sku, category, field, value) for each tracked field that changed
+
+    old and new are values in TRACKED_FIELDS order; old is None for a new
+    product, so all of its values are recorded. None in new means unknown.
+    """
+    for field, old_value, value in zip(TRACKED_FIELDS, old or (None,) * len(TRACKED_FIELDS), new):
+        if value is None:
+            continue
+        if old_value is None or float(old_value) != float(value):
+            yield sku, category, field, float(value)
+
+class PriceHistory:
+    """
+    Append-only history of product price and stock changes
+
+    Each append writes one segment file to the partition directory of its
+    UTC day. A segment holds one time and its changes column by column (SKUs,
+    dictionary-encoded categories, field codes and values), zlib-compressed.
+    Every partition has an index.log mapping SKUs and categories to the
+    segments that mention them. Appending writes the new segment and adds
+    its lines to the index, so it costs O(changes) whatever the catalog size.
+    """
+
+    def __init__(self, history_dir=None):
+        self.history_dir = os.path.abspath(history_dir or HISTORY_DIR)
+        self.lock = threading.Lock()
+        # partition -> {'offset': bytes read, 's': {sku: [segment]}, 'c': {category: [segment]}}
+        self.indexes = {}
+        self.segments = OrderedDict()
+
+    def append(self, changes, at=None):
+        """
+        Record an iterable of (sku, category, field, value) changes made at time at
+
+        Returns the number of changes recorded. Failures are logged rather
+        than raised, as the history must never fail a sync.
+        """
+        at = time.time() if at is None else at
+        skus = []
+        categories = {}
+        category_codes = array('H')
+        fields = array('B')
+        values = array('d')
+
+        for sku, category, field, value in changes:
+            skus.append(sku)
+            if category:
+                category_codes.append(categories.setdefault(category, len(categories)))
+            else:
+                category_codes.append(NO_CATEGORY)
+            fields.append(TRACKED_FIELDS.index(field))
+            values.append(value)
+
+        if not skus:
+            return 0
+
+        try:
+            partition = self.partition_name(at)
+            partition_dir = os.path.join(self.history_dir, partition)
+            os.makedirs(partition_dir, exist_ok=True)
+
+            segment = f'{int(at * 1000)}-{uuid.uuid4().hex[:8]}.seg'
+            sku_bytes = '\n'.join(skus).encode('utf-8')
+            header = {
+                'version': FORMAT_VERSION,
+                'at': at,
+                'rows': len(skus),
+                'byteorder': sys.byteorder,
+                'categories': list(categories),
+                'skus_bytes': len(sku_bytes),
+            }
+            payload = b''.join([
+                json.dumps(header).encode('utf-8'), b'\n', sku_bytes,
+                category_codes.tobytes(), fields.tobytes(), values.tobytes()
+            ])
+
+            path = os.path.join(partition_dir, segment)
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(payload))
+            os.replace(tmp_path, path)
+
+            # One line per distinct SKU and category, written in a single append
+            lines = [f's\t{sku}\t{segment}\n' for sku in dict.fromkeys(skus)]
+            lines.extend(f'c\t{category}\t{segment}\n' for category in categories)
+            with open(os.path.join(partition_dir, 'index.log'), 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+
+        except OSError as e:
+            logger.warning(f"Failed to record {len(skus)} price history changes: {e}")
+            return 0
+
+        return len(skus)
+
+    def partition_name(self, at):
+        return datetime.fromtimestamp(at, timezone.utc).strftime('%Y-%m-%d')
+
+    def partitions(self, start=None, end=None):
+        """Day partitions between start and end (dates or YYYY-MM-DD strings), oldest first"""
+        start = str(start) if start else None
+        end = str(end) if end else None
+        try:
+            names = sorted(name for name in os.listdir(self.history_dir) if len(name) == 10 and name[4] == '-')
+        except FileNotFoundError:
+            return []
+        return [name for name in names if (not start or name >= start) and (not end or name <= end)]
+
+    def _index(self, partition):
+        """The SKU and category index of a partition, reading only what was appended since last time"""
+        index = self.indexes.setdefault(partition, {'offset': 0, 's': {}, 'c': {}})
+        path = os.path.join(self.history_dir, partition, 'index.log')
+
+        try:
+            with open(path, 'rb') as f:
+                f.seek(index['offset'])
+                data = f.read()
+        except FileNotFoundError:
+            return index
+
+        # Leave a partly written last line for next time
+        complete = data[:data.rfind(b'\n') + 1]
+        index['offset'] += len(complete)
+
+        for line in complete.decode('utf-8').splitlines():
+            kind, key, segment = line.split('\t')
+            index[kind].setdefault(key, []).append(segment)
+
+        return index
+
+    def _segment(self, partition, segment):
+        """Decode a segment into (at, [(sku, category, field, value), ...]), cached as segments never change"""
+        key = (partition, segment)
+        rows = self.segments.get(key)
+        if rows is not None:
+            self.segments.move_to_end(key)
+            return rows
+
+        with open(os.path.join(self.history_dir, partition, segment), 'rb') as f:
+            payload = zlib.decompress(f.read())
+
+        header_end = payload.index(b'\n')
+        header = json.loads(payload[:header_end])
+        count = header['rows']
+        position = header_end + 1
+
+        skus = payload[position:position + header['skus_bytes']].decode('utf-8').split('\n')
+        position += header['skus_bytes']
+
+        columns = []
+        for typecode in ('H', 'B', 'd'):
+            column = array(typecode)
+            size = column.itemsize * count
+            column.frombytes(payload[position:position + size])
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            columns.append(column)
+            position += size
+
+        categories = header['categories']
+        category_codes, fields, values = columns
+        rows = header['at'], [
+            (sku, None if code == NO_CATEGORY else categories[code], TRACKED_FIELDS[field], value)
+            for sku, code, field, value in zip(skus, category_codes, fields, values)
+        ]
+
+        self.segments[key] = rows
+        if len(self.segments) > SEGMENT_CACHE_SIZE:
+            self.segments.popitem(last=False)
+        return rows
+
+    def _collect(self, kind, key, match, start, end, fields):
+        """{sku: [point, ...]} from the segments indexed under key, a point being {'at', field: value}"""
+        fields = set(fields or TRACKED_FIELDS)
+        history = {}
+
+        with self.lock:
+            for partition in self.partitions(start, end):
+                for segment in self._index(partition)[kind].get(key, []):
+                    try:
+                        at, rows = self._segment(partition, segment)
+                    except (OSError, ValueError, KeyError, zlib.error) as e:
+                        logger.warning(f"Skipping unreadable price history segment {partition}/{segment}: {e}")
+                        continue
+
+                    points = {}
+                    for sku, category, field, value in rows:
+                        if field in fields and match(sku, category):
+                            point = points.get(sku)
+                            if point is None:
+                                point = points[sku] = {'at': datetime.fromtimestamp(at, timezone.utc).isoformat()}
+                            point[field] = int(value) if field == 'stock_quantity' else value
+
+                    for sku, point in points.items():
+                        history.setdefault(sku, []).append(point)
+
+        for points in history.values():
+            points.sort(key=lambda point: point['at'])
+        return history
+
+    def product_history(self, sku, start=None, end=None, fields=None):
+        """Price and stock changes of one product, oldest first"""
+        return self._collect('s', sku, lambda row_sku, category: row_sku == sku, start, end, fields).get(sku, [])
+
+    def category_history(self, category, start=None, end=None, fields=None):
+        """Price and stock changes of the products in a category, as {sku: [point, ...]}"""
+        return self._collect('c', category, lambda sku, row_category: row_category == category, start, end, fields)
+
+# Global price history
+price_history = PriceHistory()
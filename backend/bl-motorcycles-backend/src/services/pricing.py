@@ -0,0 +1,215 @@
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# JSON file with the shop's pricing rules; the defaults below apply without it
+RULES_FILE = os.getenv('PRICING_RULES_FILE', os.path.join(os.path.dirname(__file__), '..', '..', 'pricing_rules.json'))
+
+# The original pricing formula: cost * 1.5 + 6 delivery
+DEFAULT_RULES = {
+    'markup': 1.5,
+    'delivery_cost': 6.0,
+    'category_markups': {},
+    'price_bands': [],
+    'min_margin': 0.0,
+    'min_margin_rate': 0.0,
+    'rounding': None,
+}
+
+class PricingRules:
+    """
+    Validated pricing rules
+
+    markup applies to the cost price, unless a price band covering the cost
+    (price_bands, [{'up_to': cost, 'markup': m}, ...] with a null up_to for
+    the last band) or the product's category (category_markups) sets one.
+    The category wins over the band. The markup is raised where needed to
+    keep a margin of at least min_margin, and min_margin_rate of the cost.
+    The delivery cost is added last, and the result rounded up to the next
+    rounding['increment'] or to a price ending in rounding['ending'].
+    """
+
+    def __init__(self, rules=None):
+        rules = dict(DEFAULT_RULES, **(rules or {}))
+
+        self.markup = float(rules['markup'])
+        self.delivery_cost = float(rules['delivery_cost'])
+        self.category_markups = {
+            category: float(markup) for category, markup in (rules['category_markups'] or {}).items()
+        }
+        self.min_margin = float(rules['min_margin'] or 0.0)
+        self.min_margin_rate = float(rules['min_margin_rate'] or 0.0)
+
+        bands = sorted(rules['price_bands'] or [], key=lambda band: math.inf if band.get('up_to') is None else band['up_to'])
+        self.band_limits = [math.inf if band.get('up_to') is None else float(band['up_to']) for band in bands]
+        self.band_markups = [float(band['markup']) for band in bands]
+
+        rounding = rules['rounding'] or {}
+        self.increment = float(rounding.get('increment') or 0.0)
+        self.ending = rounding.get('ending')
+        if self.ending is not None:
+            self.ending = float(self.ending)
+            if not 0 <= self.ending < 1:
+                raise ValueError(f"Price ending must be between 0 and 1: {self.ending}")
+
+        if self.markup <= 0 or any(markup <= 0 for markup in self.band_markups + list(self.category_markups.values())):
+            raise ValueError("Markups must be positive")
+
+        self.source = rules
+
+    def base_markup(self, cost_price):
+        """The markup of the price band covering cost_price, or the default markup"""
+        index = bisect.bisect_left(self.band_limits, cost_price)
+        return self.band_markups[index] if index < len(self.band_markups) else self.markup
+
+class PricingEngine:
+    """
+    Computes selling prices from the pricing rules
+
+    price_batch() works a column at a time on arrays of cost prices,
+    categories and delivery costs, so a whole feed chunk is priced with one
+    snapshot of the rules. apply_batch() prices a ProductBatch of parsed
+    feed products and apply() a list of product dicts, in place. The rules
+    are reloaded with reload() or reload_if_changed().
+    """
+
+    def __init__(self, rules_file=RULES_FILE):
+        self.rules_file = rules_file
+        self.rules_mtime = None
+        self.lock = threading.Lock()
+        self.rules = PricingRules()
+        self.reload()
+
+    def reload(self):
+        """Load the rules file, keeping the current rules if it is invalid"""
+        with self.lock:
+            try:
+                mtime = os.path.getmtime(self.rules_file)
+            except OSError:
+                mtime = None
+
+            if mtime is None:
+                rules = {}
+            else:
+                try:
+                    with open(self.rules_file, 'r') as f:
+                        rules = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Ignoring unreadable pricing rules {self.rules_file}: {e}")
+                    return False
+
+            try:
+                self.rules = PricingRules(rules)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Ignoring invalid pricing rules {self.rules_file}: {e}")
+                return False
+
+            self.rules_mtime = mtime
+            logger.info(f"Pricing rules loaded ({'defaults' if mtime is None else self.rules_file})")
+            return True
+
+    def reload_if_changed(self):
+        """Reload the rules when the rules file changed; True when new rules were loaded"""
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+        except OSError:
+            mtime = None
+
+        if mtime == self.rules_mtime:
+            return False
+        return self.reload()
+
+    @property
+    def delivery_cost(self):
+        return self.rules.delivery_cost
+
+    def price(self, cost_price, category=None, delivery_cost=None):
+        """Selling price of one product"""
+        return self.price_batch([cost_price], [category], None if delivery_cost is None else [delivery_cost])[0]
+
+    def price_batch(self, cost_prices, categories=None, delivery_costs=None):
+        """
+        Selling prices for columns of cost prices, categories and delivery costs
+
+        categories and delivery_costs are optional columns of the same length;
+        missing delivery costs use the rules' delivery cost. Returns an
+        array('d') of selling prices.
+        """
+        rules = self.rules
+        count = len(cost_prices)
+        costs = cost_prices if isinstance(cost_prices, array) else array('d', cost_prices)
+
+        # Markup column: per-category overrides, else the price band of the cost
+        if rules.band_limits:
+            markups = array('d', map(rules.base_markup, costs))
+        else:
+            markups = array('d', [rules.markup]) * count
+
+        if rules.category_markups and categories is not None:
+            category_markups = rules.category_markups
+            for index, category in enumerate(categories):
+                markup = category_markups.get(category)
+                if markup is not None:
+                    markups[index] = markup
+
+        if delivery_costs is None:
+            delivery_costs = array('d', [rules.delivery_cost]) * count
+        else:
+            delivery_costs = array('d', (rules.delivery_cost if value is None else value for value in delivery_costs))
+
+        min_margin = rules.min_margin
+        min_margin_rate = rules.min_margin_rate
+        increment = rules.increment
+        ending = rules.ending
+
+        prices = array('d', bytes(8 * count))
+        for index, (cost, markup, delivery) in enumerate(zip(costs, markups, delivery_costs)):
+            goods = cost * markup
+            floor = cost + max(min_margin, cost * min_margin_rate)
+            if goods < floor:
+                goods = floor
+            price = goods + delivery
+
+            if increment:
+                price = math.ceil(round(price / increment, 6)) * increment
+            if ending is not None:
+                price = math.ceil(round(price - ending, 6)) + ending
+            if increment or ending is not None:
+                price = round(price, 2)
+
+            prices[index] = price
+
+        return prices
+
+    def apply(self, products):
+        """Set selling_price and delivery_cost on a batch of product dicts in one pass"""
+        if not products:
+            return products
+
+        prices = self.price_batch(
+            array('d', [product_data['cost_price'] for product_data in products]),
+            [product_data.get('category') for product_data in products]
+        )
+        delivery_cost = self.rules.delivery_cost
+
+        for product_data, price in zip(products, prices):
+            product_data['selling_price'] = price
+            product_data['delivery_cost'] = delivery_cost
+
+        return products
+
+    def apply_batch(self, batch):
+        """Price a ProductBatch, filling in its selling_prices column and delivery cost"""
+        rules = self.rules
+        batch.selling_prices = self.price_batch(batch.cost_prices, batch.categories)
+        batch.delivery_cost = rules.delivery_cost
+        return batch
+
+# Global pricing engine
+pricing_engine = PricingEngine()
@@ -0,0 +1,117 @@
+import sys
+from array import array
+from src.services.product_fingerprint import FINGERPRINT_FIELDS
+
+# Columns of a database row built from a batch, see ProductBatch.row()
+ROW_FIELDS = FINGERPRINT_FIELDS + ('content_hash',)
+
+class ProductBatch:
+    """
+    Parsed feed products held column by column
+
+    Cost prices and stock quantities are typed arrays, and categories and
+    the supplier are interned strings, so a batch costs a few references
+    per product instead of a dict each. Selling prices, the delivery cost
+    and fingerprints are filled in when the batch is finalized. Rows only
+    become dicts, with row(), when they are about to be written.
+    """
+
+    __slots__ = (
+        'skus', 'names', 'descriptions', 'categories', 'cost_prices', 'stock_quantities', 'image_urls',
+        'supplier', 'selling_prices', 'delivery_cost', 'content_hashes'
+    )
+
+    def __init__(self, supplier='Bike It'):
+        self.skus = []
+        self.names = []
+        self.descriptions = []
+        self.categories = []
+        self.cost_prices = array('d')
+        self.stock_quantities = array('q')
+        self.image_urls = []
+        self.supplier = sys.intern(supplier)
+        self.selling_prices = None
+        self.delivery_cost = None
+        self.content_hashes = None
+
+    def __len__(self):
+        return len(self.skus)
+
+    def append(self, sku, name, description, category, cost_price, stock_quantity, image_url):
+        """Add one parsed product"""
+        self.skus.append(sku)
+        self.names.append(name)
+        self.descriptions.append(description)
+        self.categories.append(sys.intern(category) if category else category)
+        self.cost_prices.append(cost_price)
+        self.stock_quantities.append(stock_quantity)
+        self.image_urls.append(image_url)
+
+    def feed_values(self, index):
+        """The parsed values of one product, in append() argument order"""
+        return (
+            self.skus[index], self.names[index], self.descriptions[index], self.categories[index],
+            self.cost_prices[index], self.stock_quantities[index], self.image_urls[index]
+        )
+
+    def fingerprint_values(self, index):
+        """The values of one finalized product in FINGERPRINT_FIELDS order"""
+        stock_quantity = self.stock_quantities[index]
+        return (
+            self.skus[index], self.names[index], self.descriptions[index], self.categories[index],
+            self.cost_prices[index], self.selling_prices[index], self.delivery_cost,
+            stock_quantity, stock_quantity > 0, self.image_urls[index], self.supplier
+        )
+
+    def row(self, index):
+        """One finalized product as a dict of ROW_FIELDS, for the database"""
+        return dict(zip(ROW_FIELDS, self.fingerprint_values(index) + (self.content_hashes[index],)))
+
+    def take(self, start, end):
+        """A new batch with the products from start to end"""
+        part = ProductBatch(self.supplier)
+        part.skus = self.skus[start:end]
+        part.names = self.names[start:end]
+        part.descriptions = self.descriptions[start:end]
+        part.categories = self.categories[start:end]
+        part.cost_prices = self.cost_prices[start:end]
+        part.stock_quantities = self.stock_quantities[start:end]
+        part.image_urls = self.image_urls[start:end]
+        part.delivery_cost = self.delivery_cost
+        if self.selling_prices is not None:
+            part.selling_prices = self.selling_prices[start:end]
+        if self.content_hashes is not None:
+            part.content_hashes = self.content_hashes[start:end]
+        return part
+
+    def slices(self, size):
+        """Yield consecutive batches of at most size products"""
+        for start in range(0, len(self), size):
+            yield self.take(start, start + size)
+
+    @classmethod
+    def merge(cls, batches):
+        """
+        Combine parsed batches into one with a single product per SKU
+
+        A repeated SKU keeps its first position and takes the values of its
+        last row.
+        """
+        merged = cls()
+        positions = {}
+
+        for batch in batches:
+            for index, sku in enumerate(batch.skus):
+                position = positions.get(sku)
+                if position is None:
+                    positions[sku] = len(merged.skus)
+                    merged.append(*batch.feed_values(index))
+                else:
+                    merged.names[position] = batch.names[index]
+                    merged.descriptions[position] = batch.descriptions[index]
+                    merged.categories[position] = batch.categories[index]
+                    merged.cost_prices[position] = batch.cost_prices[index]
+                    merged.stock_quantities[position] = batch.stock_quantities[index]
+                    merged.image_urls[position] = batch.image_urls[index]
+
+        return merged
@@ -0,0 +1,21 @@
+import hashlib
+
+# Mapped feed fields that make up a product's content fingerprint
+FINGERPRINT_FIELDS = (
+    'sku', 'name', 'description', 'category', 'cost_price', 'selling_price',
+    'delivery_cost', 'stock_quantity', 'in_stock', 'image_url', 'supplier'
+)
+
+# Part of every hash, bumped when what is hashed changes. Version 2 hashes the
+# delivery cost the pricing rules fill in, which the first content hashes saw
+# as None, so the first sync after an upgrade rewrites every product once.
+FINGERPRINT_VERSION = 2
+
+def compute_fingerprint(product_data):
+    """Hash the mapped feed fields of a product so unchanged rows can be skipped"""
+    return fingerprint_values(tuple(map(product_data.get, FINGERPRINT_FIELDS)))
+
+def fingerprint_values(values):
+    """Hash a product's values given as a tuple in FINGERPRINT_FIELDS order"""
+    content = '\x1f'.join((f'v{FINGERPRINT_VERSION}', *map(repr, values)))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
@@ -0,0 +1,123 @@
+import logging
+import re
+from sqlalchemy import column, false, or_, table, text
+
+logger = logging.getLogger(__name__)
+
+# FTS5 index over the searchable product columns, kept in step with products by triggers
+FTS_TABLE = 'products_fts'
+
+FTS_COLUMNS = ('sku', 'name', 'description', 'category')
+
+# bm25() weight of each column in FTS_COLUMNS order: SKU matches rank first
+FTS_WEIGHTS = (10.0, 5.0, 1.0, 2.0)
+
+products_fts = table(FTS_TABLE, column('rowid'))
+
+_columns = ', '.join(FTS_COLUMNS)
+_new_values = ', '.join(f'new.{name}' for name in FTS_COLUMNS)
+_old_values = ', '.join(f'old.{name}' for name in FTS_COLUMNS)
+
+FTS_SCHEMA = [
+    # External content table: the index stores no copy of the product text.
+    # The prefix indexes make short prefix queries index lookups.
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        {_columns}, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON products BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON products BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END""",
+    # Stock and price updates leave the index alone
+    f"""CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF {_columns} ON products BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+]
+
+# Engines known to have the FTS index, so searches don't check every time
+_indexed_engines = set()
+
+def ensure_search_index(session):
+    """
+    Create the FTS5 product index and its triggers on SQLite, filling it from existing products
+
+    Returns False when the database isn't SQLite or was built without FTS5,
+    in which case searches fall back to LIKE filters.
+    """
+    engine = session.get_bind()
+    if engine.dialect.name != 'sqlite':
+        return False
+
+    if has_search_index(session):
+        return True
+
+    try:
+        for statement in FTS_SCHEMA:
+            session.execute(text(statement))
+        session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.warning(f"Full-text product search unavailable, falling back to LIKE searches: {e}")
+        return False
+
+    _indexed_engines.add(engine)
+    logger.info("Built full-text product search index")
+    return True
+
+def has_search_index(session):
+    """Whether the database has the FTS5 product index"""
+    engine = session.get_bind()
+    if engine in _indexed_engines:
+        return True
+    if engine.dialect.name != 'sqlite':
+        return False
+
+    found = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+    ).first()
+    if found:
+        _indexed_engines.add(engine)
+    return found is not None
+
+def match_expression(search):
+    """
+    FTS5 MATCH expression for a user's search text, or None when it has no words
+
+    Every word must match, as a prefix so partial words match while typing.
+    A word the tokenizer splits, such as a part number like BK-120/A, must
+    match as a phrase.
+    """
+    phrases = []
+    for word in search.split():
+        tokens = re.findall(r'[^\W_]+', word.lower())
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '"*')
+    return ' '.join(phrases) or None
+
+def search_products(query, model, search):
+    """
+    Filter a product query to matches of search, best first by BM25 rank
+
+    Uses the FTS5 index when there is one, and case-insensitive LIKE filters
+    on each searchable column (unranked) otherwise. Search text with no
+    words for the index to match, such as "-" or "%%", matches nothing.
+    """
+    if not search.strip():
+        return query
+
+    if not has_search_index(query.session):
+        return query.filter(or_(*(getattr(model, name).ilike(f'%{search}%') for name in FTS_COLUMNS)))
+
+    expression = match_expression(search)
+    if expression is None:
+        return query.filter(false())
+
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    return query.join(products_fts, products_fts.c.rowid == model.id) \
+        .filter(text(f'{FTS_TABLE} MATCH :expression').bindparams(expression=expression)) \
+        .order_by(text(f'bm25({FTS_TABLE}, {weights})'))
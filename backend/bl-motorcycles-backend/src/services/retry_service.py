@@ -1,3 +1,4 @@
+import os
 import time
 import functools
 import random
@@ -199,8 +200,13 @@ class FailedOperationQueue:
         try:
             if operation_type == 'ftp_sync':
                 from src.services.ftp_sync_supabase import sync_bikeit_products
-                result = sync_bikeit_products()
-                return 'error' not in result
+                from src.services.feed_cache import FeedCache
+                # A feed that was downloaded but not synced is replayed from its
+                # local copy and parsed batches, skipping download and parse.
+                # Parallel syncs fetch again, which reuses both caches too.
+                parallel = os.getenv('FTP_SYNC_PARALLEL', 'false').lower() == 'true'
+                result = sync_bikeit_products(from_cache=not parallel and FeedCache().has_pending())
+                return 'error' not in result and not result.get('failed')
                 
             elif operation_type == 'dropshipping_email':
                 from src.services.dropshipping import send_bikeit_order
@@ -0,0 +1,419 @@
+import bisect
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from functools import lru_cache
+
+from src.services.journal import Journal
+
+logger = logging.getLogger(__name__)
+
+# Product writes are journaled here so every process sharing the feed cache sees them
+JOURNAL_PATH = os.getenv('SEARCH_INDEX_JOURNAL', os.path.join(
+    os.getenv('FEED_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')), 'search_index.log'
+))
+
+# Columns that are indexed, and how much a match in each counts
+FIELD_WEIGHTS = {
+    'sku': 10.0,
+    'name': 5.0,
+    'category': 2.0,
+    'description': 1.0,
+}
+
+# Score added to the product whose SKU is exactly the search text, ranking it first
+EXACT_SKU_BOOST = 1000.0
+
+# Multiplier for exact matches of part-number-like words (words with digits)
+PART_NUMBER_BOOST = 3.0
+
+# Prefix matches count for less than whole word matches
+PREFIX_FACTOR = 0.5
+
+# Shorter words only match whole words, as their prefixes match too much
+MIN_PREFIX_LENGTH = 2
+
+# BM25 term frequency saturation: repeating a word in a field counts less and less
+TF_SATURATION = 1.2
+
+# A failed build is tried again after this long, searches going to the database meanwhile
+BUILD_RETRY_SECONDS = 60
+
+STOPWORDS = frozenset(('and', 'for', 'the', 'with', 'of', 'to', 'in', 'on', 'or'))
+
+# Spellings normalized so either one finds both
+SYNONYMS = {
+    'tire': 'tyre',
+    'aluminum': 'aluminium',
+    'color': 'colour',
+    'gray': 'grey',
+    'carb': 'carburettor',
+    'carburetor': 'carburettor',
+    'muffler': 'silencer',
+    'lube': 'lubricant',
+}
+
+PIECE = re.compile(r'[^\W_]+')
+
+def normalize(text):
+    """Lower case text without accents"""
+    text = text or ''
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+def stem(word):
+    """Singular, normalized form of a word; words with digits are left alone"""
+    if len(word) > 3 and word.isalpha():
+        if word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif word.endswith(('sses', 'shes', 'ches', 'xes', 'zes')):
+            word = word[:-2]
+        elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+            word = word[:-1]
+    return SYNONYMS.get(word, word)
+
+def is_part_number(token):
+    return len(token) >= 3 and any(char.isdigit() for char in token)
+
+def tokenize(text):
+    """
+    Yield the search tokens of text
+
+    Words are split on punctuation, stemmed and normalized. A word with
+    digits that punctuation splits, such as the part number BK-120/A or the
+    oil grade 10W-40, is also yielded whole without its punctuation
+    (bk120a, 10w40), so it matches however it is written.
+    """
+    for word in normalize(text).split():
+        yield from word_tokens(word)
+
+# Catalog text repeats the same words, so each is only split and stemmed once
+@lru_cache(maxsize=65536)
+def word_tokens(word):
+    pieces = PIECE.findall(word)
+    tokens = [stem(piece) for piece in pieces if piece not in STOPWORDS]
+    if len(pieces) > 1 and any(char.isdigit() for char in word):
+        tokens.append(''.join(pieces))
+    return tuple(tokens)
+
+def query_terms(search):
+    """
+    The tokens a search must match, each in some indexed field
+
+    A split part number is matched as the whole part number only, as
+    products list their part numbers in many spellings.
+    """
+    terms = []
+    for word in normalize(search).split():
+        pieces = PIECE.findall(word)
+        if len(pieces) > 1 and any(char.isdigit() for char in word):
+            terms.append(''.join(pieces))
+        else:
+            terms.extend(stem(piece) for piece in pieces if piece not in STOPWORDS)
+    return list(dict.fromkeys(terms))
+
+def compact(text):
+    """Text reduced to its letters and digits, for exact SKU comparison"""
+    return ''.join(PIECE.findall(normalize(text)))
+
+class _Index:
+    """
+    Inverted index of products for sale
+
+    Each product gets a document number in the order it was added. A
+    token's postings are the document numbers containing it, ascending, and
+    the weight of the token in each document. Updating a product adds a new
+    document and marks the old one dead, so postings are only ever appended
+    to; dead documents are dropped by the next full build.
+    """
+
+    def __init__(self):
+        self.product_ids = array('q')
+        self.live = bytearray()
+        self.categories = []
+        self.category_names = {}
+        self.live_count = 0
+        self.documents = {}
+        self.skus = {}
+        self.postings = {}
+        self.vocabulary = []
+
+    @classmethod
+    def build(cls, products):
+        index = cls()
+        for product in products:
+            index._add(product)
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def _add(self, product):
+        weights = {}
+        for field, field_weight in FIELD_WEIGHTS.items():
+            for token, count in Counter(tokenize(product.get(field))).items():
+                weight = field_weight * count * (TF_SATURATION + 1) / (count + TF_SATURATION)
+                weights[token] = weights.get(token, 0.0) + weight
+
+        document = len(self.product_ids)
+        self.product_ids.append(product['id'])
+        self.live.append(1)
+        category = product.get('category') or ''
+        self.categories.append(self.category_names.setdefault(category, category))
+        self.live_count += 1
+        self.documents[product['id']] = document
+
+        sku = compact(product.get('sku'))
+        if sku:
+            self.skus.setdefault(sku, []).append(document)
+
+        new_tokens = []
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = (array('I'), array('f'))
+                new_tokens.append(token)
+            posting[0].append(document)
+            posting[1].append(weight)
+        return new_tokens
+
+    def remove(self, product_id):
+        document = self.documents.pop(product_id, None)
+        if document is not None and self.live[document]:
+            self.live[document] = 0
+            self.live_count -= 1
+
+    def upsert(self, product):
+        """Index a written product; discontinued products are removed"""
+        self.remove(product['id'])
+        if product.get('discontinued_at') is None:
+            for token in self._add(product):
+                bisect.insort(self.vocabulary, token)
+
+    def expansions(self, term):
+        """(token, factor) of the indexed tokens a search term matches"""
+        if term in self.postings:
+            yield term, 1.0
+        if len(term) < MIN_PREFIX_LENGTH:
+            return
+
+        position = bisect.bisect_right(self.vocabulary, term)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+            yield self.vocabulary[position], PREFIX_FACTOR
+            position += 1
+
+    def _term_scores(self, term, candidates):
+        """{document: score} of the live documents matching term, only among candidates when given"""
+        boost = PART_NUMBER_BOOST if is_part_number(term) else 1.0
+        scores = {}
+        for token, factor in self.expansions(term):
+            documents, weights = self.postings[token]
+            frequency = len(documents)
+            idf = math.log(1 + (self.live_count - frequency + 0.5) / (frequency + 0.5))
+            factor = boost if factor == 1.0 else factor
+
+            if candidates is not None and len(candidates) * 8 < frequency:
+                # Few candidates left: look them up in the postings instead of scanning them
+                matches = []
+                for document in candidates:
+                    position = bisect.bisect_left(documents, document)
+                    if position < frequency and documents[position] == document:
+                        matches.append((document, weights[position]))
+            else:
+                matches = zip(documents, weights)
+
+            live = self.live
+            for document, weight in matches:
+                if not live[document] or (candidates is not None and document not in candidates):
+                    continue
+                score = factor * idf * weight
+                if score > scores.get(document, 0.0):
+                    scores[document] = score
+        return scores
+
+    def search(self, search, category=None):
+        """{document: score} of the live products matching every search term"""
+        terms = query_terms(search)
+        if not terms:
+            return {}
+
+        # Rarest terms first, so later terms only score the documents still in the running
+        terms.sort(key=lambda term: sum(len(self.postings[token][0]) for token, _ in self.expansions(term)))
+        scores = None
+        for term in terms:
+            term_scores = self._term_scores(term, scores)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {document: score + term_scores[document] for document, score in scores.items()
+                          if document in term_scores}
+            if not scores:
+                return {}
+
+        for document in self.skus.get(compact(search), ()):
+            if document in scores:
+                scores[document] += EXACT_SKU_BOOST
+
+        if category:
+            wanted = normalize(category)
+            in_category = {}
+            for document in list(scores):
+                name = self.categories[document]
+                if name not in in_category:
+                    in_category[name] = wanted in normalize(name)
+                if not in_category[name]:
+                    del scores[document]
+
+        return scores
+
+class SearchIndex:
+    """
+    In-memory product search for the Supabase backend
+
+    The index is built from the whole catalog in a background thread, the
+    first time it is searched and again after every sync. Until the first
+    build finishes, search() returns None and callers fall back to
+    searching the database. Admin writes and syncs append to a journal file
+    that each process reads on its next search, applying product writes
+    in place and rebuilding after syncs, so every web worker stays current.
+    Ranking is BM25-like over the weighted fields in FIELD_WEIGHTS, with
+    exact SKU and part number matches boosted.
+    """
+
+    def __init__(self, loader, journal_path=None):
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.index = None
+        self.building = False
+        self.stale = False
+        self.failed_at = None
+        # Writes read from the journal while a build runs, applied to the new index too
+        self.pending = []
+        self.journal = Journal(journal_path or JOURNAL_PATH)
+
+    def product_written(self, product):
+        """Journal a product created or updated by an admin write"""
+        if product:
+            self._journal({
+                'op': 'upsert',
+                'product': {key: product.get(key) for key in ('id', 'discontinued_at', *FIELD_WEIGHTS)}
+            })
+
+    def product_deleted(self, product_id):
+        """Journal a deleted product"""
+        self._journal({'op': 'delete', 'id': product_id})
+
+    def invalidate(self):
+        """
+        Have every process rebuild its index, e.g. after a sync
+
+        The journal is replaced by the rebuild entry, as the rebuild picks up
+        every write before it. Processes rebuild on their next search, so a
+        sync process that never searches doesn't build an index.
+        """
+        try:
+            self.journal.reset({'op': 'rebuild', 'at': time.time()})
+        except OSError as e:
+            logger.warning(f"Failed to invalidate the search index: {e}")
+
+    def _journal(self, entry):
+        try:
+            self.journal.append(entry)
+        except OSError as e:
+            # The write is picked up by the next rebuild instead
+            logger.warning(f"Failed to journal a product write for search: {e}")
+
+        # Searches in this process see the write straight away
+        if self.index is not None:
+            self.refresh()
+
+    def refresh(self):
+        """Apply journal entries written since the last call, starting a build when needed"""
+        with self.lock:
+            for entry in self.journal.read():
+                if entry['op'] == 'rebuild':
+                    self.stale = True
+                    continue
+
+                if self.index is not None:
+                    self._apply(self.index, entry)
+                if self.building:
+                    self.pending.append(entry)
+
+            if self.index is None or self.stale:
+                self._start_build()
+
+    def _apply(self, index, entry):
+        if entry['op'] == 'upsert':
+            index.upsert(entry['product'])
+        elif entry['op'] == 'delete':
+            index.remove(entry['id'])
+
+    def _start_build(self):
+        if self.building:
+            return
+        if self.failed_at is not None and time.time() - self.failed_at < BUILD_RETRY_SECONDS:
+            return
+
+        self.building = True
+        self.stale = False
+        self.pending = []
+        threading.Thread(target=self._build, name='search-index-build', daemon=True).start()
+
+    def _build(self):
+        started = time.time()
+        try:
+            index = _Index.build(self.loader())
+        except Exception as e:
+            logger.error(f"Failed to build the product search index: {e}")
+            with self.lock:
+                self.building = False
+                self.failed_at = time.time()
+            return
+
+        with self.lock:
+            for entry in self.pending:
+                self._apply(index, entry)
+            self.index = index
+            self.pending = []
+            self.building = False
+            self.failed_at = None
+
+        logger.info(f"Built product search index of {index.live_count} products "
+                    f"and {len(index.postings)} tokens in {time.time() - started:.1f}s")
+
+    def search(self, search, category=None, offset=0, limit=20):
+        """
+        Return (product IDs, total matches) of a page of search results, best first
+
+        category keeps products whose category contains it, ignoring case.
+        Returns None while the index isn't built yet.
+        """
+        self.refresh()
+        index = self.index
+        if index is None:
+            return None
+
+        with self.lock:
+            scores = index.search(search, category)
+            # Ties keep the catalog order
+            page = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+            return [index.product_ids[document] for document, _ in page[offset:]], len(scores)
+
+def load_supabase_products():
+    from src.services.supabase_client import supabase_service
+    result = supabase_service.get_search_documents()
+    if not result['success']:
+        raise Exception(result['error'])
+    return result['products']
+
+# Global search index of the Supabase catalog
+search_index = SearchIndex(load_supabase_products)
@@ -0,0 +1,68 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between SSH keepalive packets on an idle session
+KEEPALIVE_SECONDS = int(os.getenv('SFTP_KEEPALIVE_SECONDS', 30))
+
+class SFTPSession:
+    """
+    A reusable SSH/SFTP session for long-running processes
+
+    connect() hands out the open connection when it is still alive and
+    transparently reconnects when the server has dropped it, so repeated syncs
+    only pay for the SSH handshake once. Keepalive packets stop idle
+    connections being closed by firewalls between runs.
+    """
+
+    def __init__(self, feed_sync, keepalive=KEEPALIVE_SECONDS):
+        self.feed_sync = feed_sync
+        self.keepalive = keepalive
+        self.ssh = None
+        self.sftp = None
+        self.lock = threading.Lock()
+
+    def is_alive(self):
+        """Whether the current connection can still serve requests"""
+        if self.ssh is None or self.sftp is None:
+            return False
+
+        transport = self.ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        # One cheap round trip catches channels closed by the server
+        try:
+            self.sftp.normalize('.')
+            return True
+        except Exception as e:
+            logger.info(f"SFTP session is no longer usable: {e}")
+            return False
+
+    def connect(self):
+        """Return (ssh, sftp), reconnecting if the session has gone away"""
+        with self.lock:
+            if self.is_alive():
+                return self.ssh, self.sftp
+
+            self.close()
+            self.ssh, self.sftp = self.feed_sync.connect_ftp()
+
+            if self.keepalive:
+                self.ssh.get_transport().set_keepalive(self.keepalive)
+
+            return self.ssh, self.sftp
+
+    def close(self):
+        """Close the connection, ignoring errors from an already dead session"""
+        for client in (self.sftp, self.ssh):
+            if client is not None:
+                try:
+                    client.close()
+                except Exception:
+                    pass
+
+        self.ssh = None
+        self.sftp = None
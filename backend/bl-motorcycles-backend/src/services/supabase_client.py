@@ -1,6 +1,10 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
+from postgrest import ReturnMethod
 from dotenv import load_dotenv
+from src.services.sync_metrics import record
+from src.services.pagination import postgrest_keyset_filter
 import logging
 
 load_dotenv()
@@ -18,6 +22,10 @@ class SupabaseService:
         
         self.client: Client = create_client(self.url, self.key)
         logger.info("Supabase client initialized successfully")
+        
+        # Batched upsert settings
+        self.upsert_chunk_size = int(os.getenv('SUPABASE_UPSERT_CHUNK_SIZE', 500))
+        self.upsert_workers = int(os.getenv('SUPABASE_UPSERT_WORKERS', 4))
     
     def get_client(self) -> Client:
         """Get the Supabase client instance"""
@@ -41,9 +49,84 @@ class SupabaseService:
                 in_stock BOOLEAN DEFAULT true,
                 image_url VARCHAR(500),
                 supplier VARCHAR(100) DEFAULT 'Bike It',
+                content_hash VARCHAR(32),
+                discontinued_at TIMESTAMP WITH TIME ZONE,
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
                 updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
             );
+            ALTER TABLE products ADD COLUMN IF NOT EXISTS content_hash VARCHAR(32);
+            ALTER TABLE products ADD COLUMN IF NOT EXISTS discontinued_at TIMESTAMP WITH TIME ZONE;
+            -- Sort keys of the cursor-paginated listings
+            CREATE INDEX IF NOT EXISTS products_selling_price_id_idx ON products (selling_price, id);
+            CREATE INDEX IF NOT EXISTS products_created_at_id_idx ON products (created_at, id);
+            """
+            
+            # Bulk stock and price update used by the stock-only sync
+            stock_levels_sql = """
+            CREATE OR REPLACE FUNCTION apply_stock_levels(levels JSONB) RETURNS INTEGER AS $$
+                WITH updated AS (
+                    UPDATE products p SET
+                        stock_quantity = l.stock_quantity,
+                        in_stock = l.in_stock,
+                        cost_price = l.cost_price,
+                        selling_price = l.selling_price,
+                        content_hash = NULL,
+                        updated_at = NOW()
+                    FROM jsonb_to_recordset(levels) AS l(
+                        sku VARCHAR, stock_quantity INTEGER, in_stock BOOLEAN,
+                        cost_price DECIMAL, selling_price DECIMAL
+                    )
+                    WHERE p.sku = l.sku
+                    RETURNING 1
+                )
+                SELECT COUNT(*)::INTEGER FROM updated;
+            $$ LANGUAGE sql;
+            """
+            
+            # Bulk selling price update used by the repricing job
+            selling_prices_sql = """
+            CREATE OR REPLACE FUNCTION apply_selling_prices(prices JSONB) RETURNS INTEGER AS $$
+                WITH updated AS (
+                    UPDATE products p SET
+                        selling_price = l.selling_price,
+                        content_hash = NULL,
+                        updated_at = NOW()
+                    FROM jsonb_to_recordset(prices) AS l(sku VARCHAR, selling_price DECIMAL)
+                    WHERE p.sku = l.sku
+                    RETURNING 1
+                )
+                SELECT COUNT(*)::INTEGER FROM updated;
+            $$ LANGUAGE sql;
+            """
+            
+            # Bulk update of products that left the feed, see discontinued
+            discontinued_sql = """
+            CREATE OR REPLACE FUNCTION mark_products_discontinued(skus TEXT[], soft_delete BOOLEAN) RETURNS INTEGER AS $$
+                WITH updated AS (
+                    UPDATE products SET
+                        stock_quantity = 0,
+                        in_stock = false,
+                        content_hash = NULL,
+                        discontinued_at = CASE WHEN soft_delete THEN COALESCE(discontinued_at, NOW())
+                                               ELSE discontinued_at END,
+                        updated_at = NOW()
+                    WHERE sku = ANY(skus)
+                    RETURNING 1
+                )
+                SELECT COUNT(*)::INTEGER FROM updated;
+            $$ LANGUAGE sql;
+            """
+            
+            # Per-category counts and price ranges, see category_summary
+            category_summary_sql = """
+            CREATE OR REPLACE FUNCTION category_summary() RETURNS TABLE(
+                category VARCHAR, product_count BIGINT, in_stock_count BIGINT, min_price DECIMAL, max_price DECIMAL
+            ) AS $$
+                SELECT category, COUNT(*), COUNT(*) FILTER (WHERE in_stock), MIN(selling_price), MAX(selling_price)
+                FROM products
+                WHERE discontinued_at IS NULL AND category IS NOT NULL AND category <> ''
+                GROUP BY category;
+            $$ LANGUAGE sql STABLE;
             """
             
             # Create orders table
@@ -65,6 +148,7 @@ class SupabaseService:
                 created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
                 updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
             );
+            CREATE INDEX IF NOT EXISTS orders_created_at_id_idx ON orders (created_at, id);
             """
             
             # Create order_items table
@@ -83,6 +167,10 @@ class SupabaseService:
             self.client.rpc('exec_sql', {'sql': products_sql}).execute()
             self.client.rpc('exec_sql', {'sql': orders_sql}).execute()
             self.client.rpc('exec_sql', {'sql': order_items_sql}).execute()
+            self.client.rpc('exec_sql', {'sql': stock_levels_sql}).execute()
+            self.client.rpc('exec_sql', {'sql': selling_prices_sql}).execute()
+            self.client.rpc('exec_sql', {'sql': discontinued_sql}).execute()
+            self.client.rpc('exec_sql', {'sql': category_summary_sql}).execute()
             
             logger.info("Database tables created successfully")
             
@@ -92,10 +180,11 @@ class SupabaseService:
             pass
     
     # Product operations
-    def get_products(self, search=None, category=None, page=1, per_page=20):
-        """Get products with optional filtering and pagination"""
+    def get_products(self, search=None, category=None, page=1, per_page=20, offset=None):
+        """Get products with optional filtering and pagination, from offset when given rather than page"""
         try:
-            query = self.client.table('products').select('*')
+            # Soft-deleted products are no longer for sale
+            query = self.client.table('products').select('*').is_('discontinued_at', 'null')
             
             # Apply search filter
             if search:
@@ -106,7 +195,7 @@ class SupabaseService:
                 query = query.ilike('category', f'%{category}%')
             
             # Apply pagination
-            start = (page - 1) * per_page
+            start = (page - 1) * per_page if offset is None else offset
             end = start + per_page - 1
             
             result = query.range(start, end).execute()
@@ -121,6 +210,49 @@ class SupabaseService:
             logger.error(f"Failed to get products: {e}")
             return {'success': False, 'error': str(e)}
     
+    def get_products_page(self, keyset, after=None, backward=False, limit=20, category=None):
+        """Get the products that sort after the keyset values after (before them when backward)"""
+        try:
+            query = self.client.table('products').select('*').is_('discontinued_at', 'null')
+            
+            if category:
+                query = query.ilike('category', f'%{category}%')
+            
+            return {'success': True, 'products': self._keyset_page(query, keyset, after, backward, limit)}
+            
+        except Exception as e:
+            logger.error(f"Failed to get products: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def count_products(self, search=None, category=None):
+        """Count the products for sale matching the filters of get_products"""
+        try:
+            query = self.client.table('products').select('id', count='exact', head=True).is_('discontinued_at', 'null')
+            
+            if search:
+                query = query.or_(f'name.ilike.%{search}%,description.ilike.%{search}%,category.ilike.%{search}%,sku.ilike.%{search}%')
+            
+            if category:
+                query = query.ilike('category', f'%{category}%')
+            
+            return {'success': True, 'count': query.execute().count}
+            
+        except Exception as e:
+            logger.error(f"Failed to count products: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def _keyset_page(self, query, keyset, after, backward, limit):
+        """Rows of a query in keyset order, starting after the key values after"""
+        descending = keyset.descending != backward
+        
+        if after is not None:
+            query = query.or_(postgrest_keyset_filter(keyset, after, backward))
+        
+        for column in keyset.columns:
+            query = query.order(column, desc=descending)
+        
+        return query.limit(limit).execute().data
+    
     def get_product_by_id(self, product_id):
         """Get a single product by ID"""
         try:
@@ -163,31 +295,238 @@ class SupabaseService:
             logger.error(f"Failed to update product: {e}")
             return {'success': False, 'error': str(e)}
     
+    def get_products_by_ids(self, product_ids, chunk_size=200):
+        """Get the products with the given IDs, in the order given"""
+        try:
+            product_ids = list(product_ids)
+            products = {}
+            
+            for start in range(0, len(product_ids), chunk_size):
+                result = self.client.table('products').select('*') \
+                    .in_('id', product_ids[start:start + chunk_size]).execute()
+                
+                for item in result.data:
+                    products[item['id']] = item
+            
+            return {
+                'success': True,
+                'products': [products[product_id] for product_id in product_ids if product_id in products]
+            }
+        
+        except Exception as e:
+            logger.error(f"Failed to get products: {e}")
+            return {'success': False, 'error': str(e)}
+    
     def delete_product(self, product_id):
         """Delete a product"""
         try:
             result = self.client.table('products').delete().eq('id', product_id).execute()
             
-            return {'success': True}
+            return {'success': True, 'product': result.data[0] if result.data else None}
             
         except Exception as e:
             logger.error(f"Failed to delete product: {e}")
             return {'success': False, 'error': str(e)}
     
-    def upsert_products(self, products_data):
-        """Upsert multiple products (insert or update)"""
+    def _select_all_products(self, columns, page_size=1000):
+        """Select columns for every product, paging past PostgREST's row limit"""
+        rows = []
+        start = 0
+        
+        while True:
+            result = self.client.table('products').select(columns) \
+                .order('id').range(start, start + page_size - 1).execute()
+            record(db_round_trips=1)
+            
+            rows.extend(result.data)
+            
+            if len(result.data) < page_size:
+                return rows
+            start += page_size
+    
+    def get_product_fingerprints(self):
+        """Get the sku -> content_hash map for the whole catalog"""
         try:
-            result = self.client.table('products').upsert(products_data, on_conflict='sku').execute()
+            rows = self._select_all_products('sku,content_hash')
+            fingerprints = {item['sku']: item['content_hash'] for item in rows}
             
-            return {
-                'success': True,
-                'count': len(result.data) if result.data else 0
-            }
+            return {'success': True, 'fingerprints': fingerprints}
             
         except Exception as e:
-            logger.error(f"Failed to upsert products: {e}")
+            logger.error(f"Failed to get product fingerprints: {e}")
             return {'success': False, 'error': str(e)}
     
+    def get_search_documents(self):
+        """Get the ID, SKU and text columns of every product for sale, for the search index"""
+        try:
+            rows = self._select_all_products('id,sku,name,description,category,discontinued_at')
+            
+            return {'success': True, 'products': [item for item in rows if item['discontinued_at'] is None]}
+        
+        except Exception as e:
+            logger.error(f"Failed to get search documents: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def get_tracked_values(self, skus, chunk_size=200):
+        """Get the sku -> (cost_price, selling_price, stock_quantity) map of the given SKUs"""
+        try:
+            skus = list(skus)
+            values = {}
+            
+            # A few hundred SKUs at a time keeps the request URL short
+            for start in range(0, len(skus), chunk_size):
+                result = self.client.table('products').select('sku,cost_price,selling_price,stock_quantity') \
+                    .in_('sku', skus[start:start + chunk_size]).execute()
+                record(db_round_trips=1)
+                
+                for item in result.data:
+                    values[item['sku']] = (item['cost_price'], item['selling_price'], item['stock_quantity'])
+            
+            return {'success': True, 'values': values}
+            
+        except Exception as e:
+            logger.error(f"Failed to get tracked product values: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def get_stock_levels(self):
+        """Get the current stock quantity, prices and pricing inputs of every product"""
+        try:
+            rows = self._select_all_products('sku,stock_quantity,cost_price,category,delivery_cost,selling_price')
+            
+            return {'success': True, 'products': rows}
+            
+        except Exception as e:
+            logger.error(f"Failed to get stock levels: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def update_stock_levels(self, levels, chunk_size=None, max_workers=None):
+        """
+        Update only stock and price columns, in chunks sent in parallel
+        
+        levels is a list of dicts with sku, stock_quantity, in_stock,
+        cost_price and selling_price. Returns the same per-chunk report as
+        upsert_products_batched.
+        """
+        return self._run_chunks(self._update_stock_chunk, levels, chunk_size, max_workers)
+    
+    def _update_stock_chunk(self, chunk):
+        """Apply one chunk of stock levels through the apply_stock_levels function"""
+        self.client.rpc('apply_stock_levels', {'levels': chunk}).execute()
+    
+    def get_pricing_inputs(self):
+        """Get the cost price, category, delivery cost and selling price of every product"""
+        try:
+            rows = self._select_all_products('sku,cost_price,category,delivery_cost,selling_price')
+            
+            return {'success': True, 'products': rows}
+            
+        except Exception as e:
+            logger.error(f"Failed to get pricing inputs: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def update_selling_prices(self, prices, chunk_size=None, max_workers=None):
+        """
+        Update only the selling price of the given SKUs, in chunks sent in parallel
+        
+        prices is a list of dicts with sku and selling_price. Returns the same
+        per-chunk report as upsert_products_batched.
+        """
+        def write_chunk(chunk):
+            self.client.rpc('apply_selling_prices', {'prices': chunk}).execute()
+        
+        return self._run_chunks(write_chunk, prices, chunk_size, max_workers)
+    
+    def get_catalog_status(self):
+        """Get the SKU, category, stock and discontinued state of every product"""
+        try:
+            rows = self._select_all_products('sku,category,in_stock,stock_quantity,discontinued_at')
+            
+            return {'success': True, 'products': rows}
+            
+        except Exception as e:
+            logger.error(f"Failed to get catalog status: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def mark_discontinued(self, skus, soft_delete=False, chunk_size=None, max_workers=None):
+        """
+        Zero the stock of the given SKUs, and soft-delete them if asked, in chunks
+        
+        Returns the same per-chunk report as upsert_products_batched.
+        """
+        def write_chunk(chunk):
+            self.client.rpc('mark_products_discontinued', {'skus': chunk, 'soft_delete': soft_delete}).execute()
+        
+        return self._run_chunks(write_chunk, skus, chunk_size, max_workers)
+    
+    def upsert_products(self, products_data):
+        """Upsert multiple products (insert or update)"""
+        report = self.upsert_products_batched(products_data)
+        
+        if report['success']:
+            return {'success': True, 'count': report['count']}
+        
+        errors = [chunk['error'] for chunk in report['chunks'] if not chunk['success']]
+        return {
+            'success': False,
+            'count': report['count'],
+            'error': errors[0] if errors else 'Upsert failed'
+        }
+    
+    def upsert_products_batched(self, products_data, chunk_size=None, max_workers=None):
+        """
+        Upsert products in chunks sent in parallel by a small worker pool
+        
+        Rows aren't echoed back by PostgREST. The report lists every chunk's
+        offset, size and outcome so callers can retry only the chunks that failed.
+        """
+        return self._run_chunks(self._upsert_product_chunk, products_data, chunk_size, max_workers)
+    
+    def _upsert_product_chunk(self, chunk):
+        """Upsert one chunk of products without returning the rows"""
+        self.client.table('products').upsert(
+            chunk,
+            on_conflict='sku',
+            returning=ReturnMethod.minimal
+        ).execute()
+    
+    def _run_chunks(self, write_chunk, rows, chunk_size=None, max_workers=None):
+        """Call write_chunk for each chunk of rows from a small worker pool, reporting per chunk"""
+        chunk_size = chunk_size or self.upsert_chunk_size
+        max_workers = max_workers or self.upsert_workers
+        
+        def run(index, start):
+            chunk = rows[start:start + chunk_size]
+            report = {'index': index, 'start': start, 'size': len(chunk), 'success': True}
+            
+            try:
+                write_chunk(chunk)
+            except Exception as e:
+                logger.error(f"Failed to write products {start}-{start + len(chunk) - 1}: {e}")
+                report['success'] = False
+                report['error'] = str(e)
+            
+            return report
+        
+        starts = list(enumerate(range(0, len(rows), chunk_size)))
+        
+        if len(starts) <= 1 or max_workers <= 1:
+            chunk_reports = [run(index, start) for index, start in starts]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(starts))) as executor:
+                chunk_reports = list(executor.map(lambda item: run(*item), starts))
+        
+        record(db_round_trips=len(chunk_reports))
+        written = sum(report['size'] for report in chunk_reports if report['success'])
+        failed_chunks = [report['index'] for report in chunk_reports if not report['success']]
+        
+        return {
+            'success': not failed_chunks,
+            'count': written,
+            'failed_count': len(rows) - written,
+            'chunks': chunk_reports,
+            'failed_chunks': failed_chunks
+        }
+    
     # Order operations
     def create_order(self, order_data):
         """Create a new order"""
@@ -227,6 +566,34 @@ class SupabaseService:
             logger.error(f"Failed to get orders: {e}")
             return {'success': False, 'error': str(e)}
     
+    def get_orders_page(self, keyset, after=None, backward=False, limit=20, status=None):
+        """Get the orders that sort after the keyset values after (before them when backward)"""
+        try:
+            query = self.client.table('orders').select('*')
+            
+            if status:
+                query = query.eq('order_status', status)
+            
+            return {'success': True, 'orders': self._keyset_page(query, keyset, after, backward, limit)}
+            
+        except Exception as e:
+            logger.error(f"Failed to get orders: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def count_orders(self, status=None):
+        """Count the orders, optionally only those with a status"""
+        try:
+            query = self.client.table('orders').select('id', count='exact', head=True)
+            
+            if status:
+                query = query.eq('order_status', status)
+            
+            return {'success': True, 'count': query.execute().count}
+            
+        except Exception as e:
+            logger.error(f"Failed to count orders: {e}")
+            return {'success': False, 'error': str(e)}
+    
     def get_order_by_id(self, order_id):
         """Get a single order by ID"""
         try:
@@ -272,17 +639,46 @@ class SupabaseService:
             logger.error(f"Failed to create order item: {e}")
             return {'success': False, 'error': str(e)}
     
-    def get_categories(self):
-        """Get all unique product categories"""
+    def get_category_summary(self):
+        """Get the product count, in-stock count and price range of each category, for products for sale"""
         try:
-            result = self.client.table('products').select('category').execute()
+            try:
+                result = self.client.rpc('category_summary', {}).execute()
+                return {'success': True, 'categories': result.data}
+            except Exception as e:
+                # Databases created before the function existed
+                logger.warning(f"category_summary function unavailable, summarizing rows instead: {e}")
+            
+            categories = {}
+            for item in self._select_all_products('category,in_stock,selling_price,discontinued_at'):
+                if not item['category'] or item['discontinued_at'] is not None:
+                    continue
+                price = float(item['selling_price'] or 0.0)
+                summary = categories.setdefault(item['category'], {
+                    'category': item['category'], 'product_count': 0, 'in_stock_count': 0,
+                    'min_price': price, 'max_price': price
+                })
+                summary['product_count'] += 1
+                summary['in_stock_count'] += int(bool(item['in_stock']))
+                summary['min_price'] = min(summary['min_price'], price)
+                summary['max_price'] = max(summary['max_price'], price)
+            
+            return {'success': True, 'categories': list(categories.values())}
             
-            categories = list(set([item['category'] for item in result.data if item['category']]))
-            categories.sort()
+        except Exception as e:
+            logger.error(f"Failed to get category summary: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def get_categories(self):
+        """Get the categories of the products for sale"""
+        try:
+            result = self.get_category_summary()
+            if not result['success']:
+                return result
             
             return {
                 'success': True,
-                'categories': categories
+                'categories': sorted(row['category'] for row in result['categories'])
             }
             
         except Exception as e:
@@ -0,0 +1,125 @@
+import contextlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from src.services.sync_metrics import observe_runs
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept around for status polling
+JOB_HISTORY_SIZE = int(os.getenv('SYNC_JOB_HISTORY_SIZE', 20))
+
+class SyncJob:
+    """One product sync requested through the API"""
+
+    def __init__(self, key, options):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.options = options
+        self.status = 'queued'
+        self.submitted_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.coalesced_requests = 0
+        self.run = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def is_active(self):
+        return self.status in ('queued', 'running')
+
+    def to_dict(self):
+        """Job status for the API"""
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'options': self.options,
+            'submitted_at': self.submitted_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'coalesced_requests': self.coalesced_requests,
+            'progress': self.run.progress() if self.run else None,
+            'result': self.result,
+            'error': self.error,
+        }
+
+class SyncJobManager:
+    """
+    Runs product syncs requested through the API on a background thread
+
+    Jobs run one at a time. A request for a sync that is already queued or
+    running with the same options joins that job instead of adding another.
+    """
+
+    def __init__(self, history_size=JOB_HISTORY_SIZE):
+        self.history_size = history_size
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync-job')
+        self.jobs = OrderedDict()
+        self.active = {}
+        self.lock = threading.Lock()
+
+    def submit(self, sync_function, app=None, **options):
+        """
+        Queue sync_function(**options), returning (job, coalesced)
+
+        app is the Flask app whose context the sync runs in, for the SQLite
+        models. coalesced is True when the request joined an existing job.
+        """
+        key = (sync_function.__module__, sync_function.__name__, tuple(sorted(options.items())))
+
+        with self.lock:
+            job = self.active.get(key)
+            if job is not None:
+                job.coalesced_requests += 1
+                logger.info(f"Sync request joined job {job.job_id}")
+                return job, True
+
+            job = SyncJob(key, options)
+            self.active[key] = job
+            self.jobs[job.job_id] = job
+            self._trim()
+
+        self.executor.submit(self._run, job, sync_function, app)
+        logger.info(f"Queued sync job {job.job_id}")
+        return job, False
+
+    def _run(self, job, sync_function, app):
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+
+        def attach(run):
+            job.run = run
+
+        try:
+            with app.app_context() if app else contextlib.nullcontext(), observe_runs(attach):
+                job.result = sync_function(**job.options)
+            job.error = job.result.get('error')
+            job.status = 'failed' if job.error else 'finished'
+        except Exception as e:
+            logger.error(f"Sync job {job.job_id} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.utcnow()
+            with self.lock:
+                self.active.pop(job.key, None)
+            job.done.set()
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond the history size"""
+        finished = [job_id for job_id, job in self.jobs.items() if not job.is_active()]
+        for job_id in finished[:max(0, len(self.jobs) - self.history_size)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        """A job by id, or None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+# Global sync job manager
+sync_job_manager = SyncJobManager()
@@ -0,0 +1,283 @@
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Lock files live next to the feed cache, which every sync process shares
+LOCK_DIR = os.getenv('SYNC_LOCK_DIR', os.getenv(
+    'FEED_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')
+))
+
+# A lock whose heartbeat is older than this is considered abandoned
+STALE_SECONDS = int(os.getenv('SYNC_LOCK_STALE_SECONDS', 600))
+
+# How often the lock holder refreshes its heartbeat
+HEARTBEAT_SECONDS = int(os.getenv('SYNC_LOCK_HEARTBEAT_SECONDS', 30))
+
+# How long a caller waits for a sync already in progress before giving up
+WAIT_SECONDS = int(os.getenv('SYNC_LOCK_WAIT_SECONDS', 3600))
+
+POLL_SECONDS = 1.0
+
+# Results of the last few syncs are kept for callers that were waiting on them
+PUBLISHED_RESULTS = 10
+
+class SyncLock:
+    """
+    Lock file shared by every process that syncs products into one database
+
+    The file is created exclusively and holds the owner's pid, host, sync
+    kind and a token. Its mtime is the owner's heartbeat. A lock is stale when
+    its owner on this host has exited, or when the heartbeat is older than
+    STALE_SECONDS (e.g. the owner runs on another host and crashed). When the
+    owner finishes it writes its result next to the lock so waiting callers
+    can pick it up.
+    """
+
+    def __init__(self, name, lock_dir=None, stale_seconds=STALE_SECONDS, heartbeat_seconds=HEARTBEAT_SECONDS):
+        lock_dir = os.path.abspath(lock_dir or LOCK_DIR)
+        self.path = os.path.join(lock_dir, f'{name}.lock')
+        self.result_path = os.path.join(lock_dir, f'{name}.result.json')
+        self.stale_seconds = stale_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.token = None
+        self.heartbeat_stop = None
+
+    def holder(self):
+        """The current lock owner's info with its heartbeat time, or None when unlocked"""
+        try:
+            with open(self.path, 'r') as f:
+                info = json.load(f)
+            info['heartbeat_at'] = os.path.getmtime(self.path)
+            return info
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError):
+            # Being written right now, or truncated by a crash
+            try:
+                return {'token': None, 'heartbeat_at': os.path.getmtime(self.path)}
+            except OSError:
+                return None
+
+    def is_stale(self, holder):
+        """Whether a lock owner has gone away without releasing the lock"""
+        if time.time() - holder['heartbeat_at'] > self.stale_seconds:
+            return True
+
+        if holder.get('host') == socket.gethostname() and holder.get('pid'):
+            try:
+                os.kill(holder['pid'], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+
+        return False
+
+    def try_acquire(self, kind):
+        """Take the lock if it is free or stale; returns True on success"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        token = uuid.uuid4().hex
+
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                holder = self.holder()
+                if holder is not None and not self.is_stale(holder):
+                    return False
+                if holder is not None:
+                    self._break(holder)
+                continue
+
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'token': token,
+                    'kind': kind,
+                    'pid': os.getpid(),
+                    'host': socket.gethostname(),
+                    'acquired_at': time.time(),
+                }, f)
+
+            self.token = token
+            self._start_heartbeat()
+            return True
+
+        return False
+
+    def _break(self, holder):
+        """Remove a stale lock, unless someone else replaced it in the meantime"""
+        logger.warning(f"Breaking stale sync lock held by pid {holder.get('pid')} on {holder.get('host')}")
+        stale_path = f'{self.path}.{uuid.uuid4().hex}.stale'
+
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return
+
+        try:
+            with open(stale_path, 'r') as f:
+                moved = json.load(f)
+        except (ValueError, OSError):
+            moved = {'token': None}
+
+        if holder.get('token') is not None and moved.get('token') != holder.get('token'):
+            # We moved a fresh lock taken after our check, so put it back
+            try:
+                os.link(stale_path, self.path)
+            except OSError:
+                pass
+
+        os.remove(stale_path)
+
+    def _start_heartbeat(self):
+        self.heartbeat_stop = threading.Event()
+        stop = self.heartbeat_stop
+
+        def beat():
+            while not stop.wait(self.heartbeat_seconds):
+                try:
+                    os.utime(self.path)
+                except OSError:
+                    return
+
+        threading.Thread(target=beat, name='sync-lock-heartbeat', daemon=True).start()
+
+    def release(self, kind, result):
+        """Publish the result for waiting callers and remove the lock"""
+        if self.heartbeat_stop is not None:
+            self.heartbeat_stop.set()
+
+        try:
+            # Only the lock holder writes here, so read-modify-write is safe
+            published = self._published()[-(PUBLISHED_RESULTS - 1):]
+            published.append({'token': self.token, 'kind': kind, 'result': result, 'finished_at': time.time()})
+
+            tmp_path = f'{self.result_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(published, f, default=str)
+            os.replace(tmp_path, self.result_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Failed to publish sync result: {e}")
+
+        holder = self.holder()
+        if holder is not None and holder.get('token') == self.token:
+            os.remove(self.path)
+        self.token = None
+
+    def _published(self):
+        try:
+            with open(self.result_path, 'r') as f:
+                published = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return published if isinstance(published, list) else []
+
+    def published_result(self, token):
+        """The result published by the owner of the given lock token, if it has finished"""
+        return next((entry for entry in self._published() if entry.get('token') == token), None)
+
+class SyncCoordinator:
+    """
+    Makes sure only one product sync runs at a time across processes
+
+    A caller that arrives while a sync of the same kind is running waits for
+    it and gets its result, marked with 'attached': True, instead of syncing
+    again. A caller wanting a different kind of sync waits for the running one
+    to finish and then runs its own.
+    """
+
+    def __init__(self, name, wait_seconds=WAIT_SECONDS):
+        self.name = name
+        self.wait_seconds = wait_seconds
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def run(self, kind, func, *args, **kwargs):
+        """Run func under the sync lock, or attach to a sync of the same kind already running"""
+        with self.lock:
+            flight = self.in_flight.get(kind)
+            if flight is None:
+                flight = {'done': threading.Event(), 'result': None}
+                self.in_flight[kind] = flight
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            logger.info(f"Attaching to the {kind} sync already running in this process")
+            if not flight['done'].wait(self.wait_seconds):
+                return {'error': 'Timed out waiting for the running product sync'}
+            return dict(flight['result'], attached=True)
+
+        try:
+            flight['result'] = self._run_locked(kind, func, *args, **kwargs)
+            return flight['result']
+        finally:
+            with self.lock:
+                self.in_flight.pop(kind, None)
+            flight['done'].set()
+
+    def _run_locked(self, kind, func, *args, **kwargs):
+        sync_lock = SyncLock(self.name)
+        deadline = time.monotonic() + self.wait_seconds
+        waited_for = None
+        announced = None
+
+        while True:
+            holder = sync_lock.holder()
+
+            if waited_for and (holder is None or holder.get('token') != waited_for):
+                # The sync we were waiting on has finished, pick up its result
+                published = sync_lock.published_result(waited_for)
+                if published is not None:
+                    return dict(published['result'], attached=True)
+                waited_for = None
+
+            if holder is None or sync_lock.is_stale(holder):
+                if sync_lock.try_acquire(kind):
+                    break
+                continue
+
+            if holder.get('token') and holder['token'] != announced:
+                announced = holder['token']
+                logger.info(f"A {holder.get('kind')} sync is running in pid {holder.get('pid')} "
+                            f"on {holder.get('host')}, waiting for it")
+            if holder.get('kind') == kind:
+                waited_for = holder.get('token')
+
+            if time.monotonic() > deadline:
+                return {'error': 'Timed out waiting for the running product sync'}
+
+            time.sleep(POLL_SECONDS)
+
+        result = {'error': 'Product synchronization did not finish'}
+        try:
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            sync_lock.release(kind, result)
+
+def coordinated_sync(name, kind=None):
+    """
+    Decorator running a sync function through a SyncCoordinator for the given lock name
+
+    The sync kind is 'stock' or 'full' from the stock_only argument, unless
+    kind is given.
+    """
+    coordinator = SyncCoordinator(name)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            sync_kind = kind or ('stock' if kwargs.get('stock_only') else 'full')
+            return coordinator.run(sync_kind, func, *args, **kwargs)
+        wrapper.coordinator = coordinator
+        return wrapper
+    return decorator
@@ -0,0 +1,299 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where only compacting the run history can race
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Number of sync runs kept in the run history
+HISTORY_SIZE = int(os.getenv('SYNC_RUN_HISTORY_SIZE', 50))
+
+# Shared by the web app, the scheduler and cron runs, so all of them show up
+HISTORY_FILE = os.getenv('SYNC_RUN_HISTORY_FILE', os.path.join(
+    os.getenv('FEED_CACHE_DIR', os.path.join(os.path.dirname(__file__), '..', '..', 'feed_cache')), 'sync_runs.jsonl'
+))
+
+# Counters kept for each stage
+STAGE_COUNTERS = ('bytes', 'rows', 'rejected_rows', 'db_round_trips')
+
+# The run being recorded in the current context, if any
+_current_run = ContextVar('sync_run', default=None)
+
+# Called with each SyncRun started in the current context, see observe_runs()
+_run_observer = ContextVar('sync_run_observer', default=None)
+
+class SyncRun:
+    """
+    Timings and counters for one product sync run
+
+    Stages are created on first use and accumulate, so a stage entered once
+    per chunk reports its total time. Counters can be added from worker
+    threads; without an explicit stage they go to the innermost open one.
+    """
+
+    def __init__(self, backend, sync_type, options=None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.backend = backend
+        self.sync_type = sync_type
+        self.options = options or {}
+        self.started_at = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {}
+        self.open_stages = []
+        self.lock = threading.Lock()
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = dict({'seconds': 0.0}, **{counter: 0 for counter in STAGE_COUNTERS})
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block of work as part of a stage"""
+        with self.lock:
+            self._stage(name)
+            self.open_stages.append(name)
+        started = time.perf_counter()
+
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.stages[name]['seconds'] += time.perf_counter() - started
+                self.open_stages.remove(name)
+
+    def add_time(self, name, seconds):
+        """Add time measured elsewhere to a stage"""
+        with self.lock:
+            self._stage(name)['seconds'] += seconds
+
+    def count(self, stage=None, **counters):
+        """Add to a stage's counters"""
+        with self.lock:
+            name = stage or (self.open_stages[-1] if self.open_stages else 'other')
+            values = self._stage(name)
+            for counter, value in counters.items():
+                values[counter] += value
+
+    def elapsed(self):
+        """Seconds the run took, or has taken so far"""
+        return (self.finished or time.perf_counter()) - self.started
+
+    def progress(self):
+        """Snapshot of a run in progress: the current stage and each stage's time and rows so far"""
+        with self.lock:
+            current = self.open_stages[-1] if self.open_stages else next(reversed(self.stages), None)
+            return {
+                'run_id': self.run_id,
+                'stage': current,
+                'elapsed_seconds': round(self.elapsed(), 3),
+                'stages': {
+                    name: {'seconds': round(values['seconds'], 3), 'rows': values['rows']}
+                    for name, values in self.stages.items()
+                },
+            }
+
+    def to_dict(self, result):
+        """The run's record for the history and the log"""
+        if 'error' in result:
+            status = 'error'
+        elif result.get('skipped'):
+            status = 'skipped'
+        else:
+            status = 'success'
+
+        return {
+            'run_id': self.run_id,
+            'backend': self.backend,
+            'sync_type': self.sync_type,
+            'options': self.options,
+            'status': status,
+            'error': result.get('error'),
+            'started_at': self.started_at.isoformat(),
+            'finished_at': datetime.utcnow().isoformat(),
+            'duration_seconds': round(self.elapsed(), 3),
+            'stages': [
+                dict({'stage': name, 'seconds': round(values['seconds'], 3)},
+                     **{counter: values[counter] for counter in STAGE_COUNTERS})
+                for name, values in self.stages.items()
+            ],
+            'result': {key: value for key, value in result.items() if key != 'error'},
+        }
+
+class SyncRunHistory:
+    """
+    The most recent sync runs, one JSON line each in a small file
+
+    The web app, the scheduler and cron runs all record runs here. Each
+    run is appended under an exclusive file lock, so concurrent runs never
+    drop each other's records. Once the file holds twice the history size,
+    it is compacted to the newest runs under the same lock. Readers skip a
+    line still being written.
+    """
+
+    def __init__(self, path=HISTORY_FILE, size=HISTORY_SIZE):
+        self.path = path
+        self.size = size
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the history between processes, where fcntl is available"""
+        if fcntl is None:
+            yield
+            return
+
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable sync run history: {e}")
+            return []
+
+        runs = []
+        for line in lines:
+            try:
+                runs.append(json.loads(line))
+            except ValueError:
+                continue
+        return runs
+
+    def add(self, record):
+        """Append a run record, compacting the history once it holds twice its size"""
+        line = json.dumps(record, default=str) + '\n'
+
+        with self.lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+            with self._file_lock():
+                with open(self.path, 'a') as f:
+                    f.write(line)
+
+                runs = self._load()
+                if len(runs) > self.size * 2:
+                    tmp_path = f'{self.path}.{os.getpid()}.tmp'
+                    with open(tmp_path, 'w') as f:
+                        f.writelines(json.dumps(run, default=str) + '\n' for run in runs[-self.size:])
+                    os.replace(tmp_path, self.path)
+
+    def recent(self, limit=10):
+        """The last limit runs, newest first"""
+        runs = self._load()[-self.size:]
+        return list(reversed(runs[-limit:])) if limit > 0 else []
+
+def current_run():
+    """The SyncRun being recorded in this context, or None"""
+    return _current_run.get()
+
+@contextmanager
+def stage(name):
+    """Time a block as part of a stage of the current run (a no-op outside of a run)"""
+    run = _current_run.get()
+    if run is None:
+        yield None
+        return
+
+    with run.stage(name):
+        yield run
+
+def record(stage=None, **counters):
+    """Add to the counters of the current run, if there is one"""
+    run = _current_run.get()
+    if run is not None:
+        run.count(stage, **counters)
+
+def add_time(stage, seconds, **counters):
+    """Add time measured elsewhere, and optionally counters, to a stage of the current run"""
+    run = _current_run.get()
+    if run is not None:
+        run.add_time(stage, seconds)
+        if counters:
+            run.count(stage, **counters)
+
+@contextmanager
+def observe_runs(callback):
+    """Call callback with every SyncRun started in this context, e.g. to report progress"""
+    token = _run_observer.set(callback)
+    try:
+        yield
+    finally:
+        _run_observer.reset(token)
+
+def count_statements(engine):
+    """Count the SQL statements an engine executes as database round trips of the current run"""
+    from sqlalchemy import event
+
+    if not event.contains(engine, 'before_cursor_execute', _count_statement):
+        event.listen(engine, 'before_cursor_execute', _count_statement)
+
+def _count_statement(*args):
+    record(db_round_trips=1)
+
+def instrument_sync(backend, sync_type=None):
+    """
+    Decorator recording each call of a sync function as a SyncRun
+
+    The finished run is added to the run history and written to the FTP
+    sync log as a JSON record. Nested calls are recorded as part of the
+    outer run. The sync type is 'stock' or 'full' from the stock_only
+    argument, unless sync_type is given.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_run.get() is not None:
+                return func(*args, **kwargs)
+
+            run_type = sync_type or ('stock' if kwargs.get('stock_only') else 'full')
+            options = {key: value for key, value in kwargs.items() if isinstance(value, (bool, int, str))}
+            run = SyncRun(backend, run_type, options)
+            token = _current_run.set(run)
+
+            observer = _run_observer.get()
+            if observer is not None:
+                observer(run)
+
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                run.finished = time.perf_counter()
+                _current_run.reset(token)
+
+            try:
+                run_record = run.to_dict(result)
+                sync_run_history.add(run_record)
+
+                from src.services.logging_service import bl_logger
+                bl_logger.log_ftp_sync_run(run_record)
+            except Exception as e:
+                logger.warning(f"Failed to record sync run {run.run_id}: {e}")
+
+            return result
+        return wrapper
+    return decorator
+
+# Global sync run history
+sync_run_history = SyncRunHistory()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Sync Scheduler Daemon for B&L Motorcycles
+Long-running replacement for the FTP sync cron jobs. The database clients
+and the SSH/SFTP session to Bike It stay open between runs. The full,
+stock-only and retry-queue jobs each run on their own cadence, and the
+catalog is repriced when the pricing rules file changes. Only one job
+runs at a time: a job that comes due while another is still running is
+skipped until its next turn.
+"""
+
+import os
+import sys
+import argparse
+import contextlib
+import importlib
+import logging
+import signal
+import threading
+import time
+
+import schedule
+
+# Add the backend directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Set up logging
+handlers = [logging.StreamHandler(sys.stdout)]
+try:
+    handlers.append(logging.FileHandler(os.getenv('SYNC_SCHEDULER_LOG', '/var/log/bl_motorcycles/sync_scheduler.log')))
+except OSError:
+    pass
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
+    handlers=handlers
+)
+
+logger = logging.getLogger(__name__)
+
+# Minutes between runs of each job (0 disables the job)
+FULL_SYNC_INTERVAL = int(os.getenv('SYNC_FULL_INTERVAL_MINUTES', 120))
+STOCK_SYNC_INTERVAL = int(os.getenv('SYNC_STOCK_INTERVAL_MINUTES', 10))
+RETRY_INTERVAL = int(os.getenv('SYNC_RETRY_INTERVAL_MINUTES', 5))
+PRICING_CHECK_INTERVAL = int(os.getenv('SYNC_PRICING_CHECK_MINUTES', 1))
+
+# Sync module and feed sync class for each database backend
+BACKENDS = {
+    'sqlite': ('src.services.ftp_sync', 'BikeItFTPSync'),
+    'supabase': ('src.services.ftp_sync_supabase', 'BikeItFTPSyncSupabase'),
+}
+
+class SyncScheduler:
+    """Runs the sync jobs on their cadences with warm clients and one shared SFTP session"""
+
+    def __init__(self, backend):
+        from src.services.sftp_session import SFTPSession
+
+        module_name, class_name = BACKENDS[backend]
+        self.backend = backend
+        self.sync_module = importlib.import_module(module_name)
+        self.session = SFTPSession(getattr(self.sync_module, class_name)())
+
+        # The SQLite models need a Flask app context in every job thread
+        self.app = None
+        if backend == 'sqlite':
+            from src.main import app
+            self.app = app
+
+        # Modification time of the pricing rules the catalog was last repriced with
+        from src.services.pricing import pricing_engine
+        self.priced_rules_mtime = pricing_engine.rules_mtime
+
+        self.scheduler = schedule.Scheduler()
+        self.run_lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def app_context(self):
+        """App context for database access from a job thread"""
+        return self.app.app_context() if self.app else contextlib.nullcontext()
+
+    def run_exclusive(self, name, job):
+        """Run a job unless another one is still in progress"""
+        if not self.run_lock.acquire(blocking=False):
+            logger.warning(f"Skipping {name} job, previous run still in progress")
+            return
+
+        started = time.monotonic()
+        try:
+            logger.info(f"Starting {name} job")
+            with self.app_context():
+                job()
+            logger.info(f"Finished {name} job in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"{name} job failed: {e}")
+        finally:
+            self.run_lock.release()
+
+    def start_job(self, name, job):
+        """Run a job in a worker thread so the scheduler loop keeps ticking"""
+        thread = threading.Thread(target=self.run_exclusive, args=(name, job), name=f'{name}-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def sync(self, sync_type, **kwargs):
+        """Run one product sync over the shared SFTP session"""
+        from src.services.logging_service import log_ftp_sync_start, log_ftp_sync_success, log_ftp_sync_error
+        from src.services.retry_service import add_failed_operation
+
+        log_ftp_sync_start(sync_type)
+        result = self.sync_module.sync_bikeit_products(session=self.session, **kwargs)
+
+        if 'error' in result:
+            log_ftp_sync_error(result['error'])
+            # The retry queue re-runs syncs against Supabase
+            if self.backend == 'supabase' and sync_type == 'scheduled':
+                add_failed_operation('ftp_sync', {}, result['error'])
+        else:
+            log_ftp_sync_success(result)
+            # Failed rows leave the feed pending, queue a replay rather than wait for the next full sync
+            if self.backend == 'supabase' and sync_type == 'scheduled' and result.get('failed'):
+                add_failed_operation('ftp_sync', {}, f"{result['failed']} products failed to write")
+
+        return result
+
+    def full_sync(self):
+        """Full catalogue sync"""
+        return self.sync('scheduled')
+
+    def stock_sync(self):
+        """Stock and price only sync"""
+        return self.sync('scheduled-stock', stock_only=True)
+
+    def retry_failed(self):
+        """Work through the failed operation queue"""
+        from src.services.retry_service import process_failed_operations
+        process_failed_operations()
+
+    def check_pricing_rules(self):
+        """Reprice the stored catalog when the pricing rules file has changed, until a repricing succeeds"""
+        from src.services.pricing import pricing_engine
+
+        pricing_engine.reload_if_changed()
+        rules_mtime = pricing_engine.rules_mtime
+        if rules_mtime == self.priced_rules_mtime:
+            return
+
+        logger.info("Pricing rules changed, repricing the catalog")
+        result = self.sync_module.reprice_products()
+
+        if result.get('error') or result.get('skipped') or result.get('failed'):
+            logger.warning("Repricing didn't complete, trying again at the next pricing check")
+            return
+        self.priced_rules_mtime = rules_mtime
+
+    def setup(self):
+        """Register each enabled job on its cadence"""
+        jobs = (
+            ('full', FULL_SYNC_INTERVAL, self.full_sync),
+            ('stock', STOCK_SYNC_INTERVAL, self.stock_sync),
+            ('retry', RETRY_INTERVAL, self.retry_failed),
+            ('pricing', PRICING_CHECK_INTERVAL, self.check_pricing_rules),
+        )
+
+        for name, interval, job in jobs:
+            if interval > 0:
+                self.scheduler.every(interval).minutes.do(self.start_job, name, job)
+                logger.info(f"Scheduled {name} job every {interval} minutes")
+
+    def run(self, run_now=True):
+        """Run the scheduler loop until stop() is called"""
+        self.setup()
+
+        if run_now:
+            self.start_job('full', self.full_sync)
+
+        while not self.stopping.is_set():
+            self.scheduler.run_pending()
+            self.stopping.wait(1)
+
+        # Let a job in progress finish before closing the session under it
+        with self.run_lock:
+            self.session.close()
+        logger.info("Sync scheduler stopped")
+
+    def stop(self, *args):
+        """Ask the scheduler loop to exit"""
+        logger.info("Stopping sync scheduler")
+        self.stopping.set()
+
+def main():
+    """Main function for the scheduler daemon"""
+    parser = argparse.ArgumentParser(description='Run the B&L Motorcycles sync jobs on a schedule')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=os.getenv('SYNC_BACKEND', 'supabase'),
+                        help='database to sync products into')
+    parser.add_argument('--no-initial-sync', action='store_true',
+                        help="wait for the first scheduled run instead of syncing on startup")
+    args = parser.parse_args()
+
+    logger.info("=" * 50)
+    logger.info(f"Starting sync scheduler ({args.backend} backend)")
+
+    sync_scheduler = SyncScheduler(args.backend)
+    signal.signal(signal.SIGTERM, sync_scheduler.stop)
+    signal.signal(signal.SIGINT, sync_scheduler.stop)
+
+    sync_scheduler.run(run_now=not args.no_initial_sync)
+
+if __name__ == '__main__':
+    main()
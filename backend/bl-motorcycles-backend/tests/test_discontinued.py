@@ -0,0 +1,84 @@
+import pytest
+
+from src.services.discontinued import is_retired, plan_discontinued
+
+def catalog_rows(count, prefix='SKU', in_stock=True, stock_quantity=5, discontinued_at=None):
+    return [(f'{prefix}-{index}', in_stock, stock_quantity, discontinued_at) for index in range(count)]
+
+def feed_without(catalog, missing):
+    """SKUs of catalog except the first missing ones"""
+    return {row[0] for row in catalog[missing:]}
+
+@pytest.mark.parametrize('policy', ['out_of_stock', 'soft_delete'])
+def test_missing_products_are_marked(policy):
+    catalog = catalog_rows(10)
+    to_mark, report = plan_discontinued(catalog, feed_without(catalog, 1), policy=policy, max_fraction=0.2)
+    assert to_mark == ['SKU-0']
+    assert report == {'policy': policy, 'catalog': 10, 'retired': 0, 'missing': 1, 'marked': 0, 'aborted': False}
+
+def test_exactly_the_max_fraction_missing_is_marked():
+    catalog = catalog_rows(10)
+    to_mark, report = plan_discontinued(catalog, feed_without(catalog, 2), policy='out_of_stock', max_fraction=0.2)
+    assert to_mark == ['SKU-0', 'SKU-1']
+    assert report['aborted'] is False
+
+def test_more_than_the_max_fraction_missing_aborts():
+    catalog = catalog_rows(10)
+    to_mark, report = plan_discontinued(catalog, feed_without(catalog, 3), policy='out_of_stock', max_fraction=0.2)
+    assert to_mark == []
+    assert report['missing'] == 3
+    assert report['aborted'] is True
+
+def test_empty_feed_aborts():
+    to_mark, report = plan_discontinued(catalog_rows(10), set(), policy='soft_delete', max_fraction=0.2)
+    assert to_mark == []
+    assert report['missing'] == 10
+    assert report['aborted'] is True
+
+def test_empty_catalog_marks_nothing():
+    to_mark, report = plan_discontinued([], {'SKU-0'}, policy='out_of_stock', max_fraction=0.2)
+    assert to_mark == []
+    assert report['catalog'] == 0
+    assert report['aborted'] is False
+
+def test_retired_products_are_counted_apart_from_the_limit():
+    # 10 retired products still missing from the feed, 10 active of which 2 are missing
+    catalog = catalog_rows(10, prefix='OLD', in_stock=False, stock_quantity=0) + catalog_rows(10)
+    feed_skus = {f'SKU-{index}' for index in range(2, 10)}
+
+    to_mark, report = plan_discontinued(catalog, feed_skus, policy='out_of_stock', max_fraction=0.2)
+    assert to_mark == ['SKU-0', 'SKU-1']
+    assert report['catalog'] == 20
+    assert report['retired'] == 10
+    assert report['missing'] == 2
+    assert report['aborted'] is False
+
+def test_soft_delete_retires_by_discontinued_at():
+    # Out of stock but still listed: soft_delete hasn't handled these yet
+    catalog = catalog_rows(2, prefix='OUT', in_stock=False, stock_quantity=0) + \
+        catalog_rows(3, prefix='GONE', discontinued_at='2024-01-01T00:00:00') + catalog_rows(10)
+
+    to_mark, report = plan_discontinued(catalog, feed_without(catalog, 5), policy='soft_delete', max_fraction=0.2)
+    assert to_mark == ['OUT-0', 'OUT-1']
+    assert report['retired'] == 3
+    assert report['missing'] == 2
+    assert report['aborted'] is False
+
+def test_off_policy_marks_nothing():
+    to_mark, report = plan_discontinued(catalog_rows(10), set(), policy='off')
+    assert to_mark == []
+    assert report['aborted'] is False
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        plan_discontinued([], set(), policy='delete')
+
+@pytest.mark.parametrize('policy, row, retired', [
+    ('out_of_stock', (False, 0, None), True),
+    ('out_of_stock', (False, 3, None), False),
+    ('out_of_stock', (True, 0, None), False),
+    ('soft_delete', (False, 0, None), False),
+    ('soft_delete', (True, 5, '2024-01-01T00:00:00'), True),
+])
+def test_is_retired(policy, row, retired):
+    assert is_retired(policy, *row) is retired
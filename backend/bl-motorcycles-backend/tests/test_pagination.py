@@ -0,0 +1,166 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from src.models.product import db, Order
+from src.routes.orders import orders_bp
+from src.services.pagination import (
+    ORDER_SORT_COLUMNS, PRODUCT_SORT_COLUMNS, CursorError, Keyset, cursor_page, decode_cursor,
+    encode_cursor, keyset_query, postgrest_keyset_filter
+)
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    app.register_blueprint(orders_bp, url_prefix='/api')
+    with app.app_context():
+        db.create_all()
+        yield app
+
+def add_orders(created_ats):
+    orders = [
+        Order(
+            order_id=f'BLM-{index}', customer_name='Test', customer_email='test@example.com',
+            address_line_1='1 Test Road', city='Leeds', postcode='LS1 1AA', country='UK',
+            total_amount=10.0, created_at=created_at
+        )
+        for index, created_at in enumerate(created_ats)
+    ]
+    db.session.add_all(orders)
+    db.session.commit()
+    # The column default fills in NULL created_at values on insert
+    for order, created_at in zip(orders, created_ats):
+        if created_at is None:
+            order.created_at = None
+    db.session.commit()
+    return orders
+
+def page_through(sort, per_page):
+    """Ids of every order, following next cursors, then following prev cursors back"""
+    keyset = Keyset(sort, ORDER_SORT_COLUMNS)
+    fetch = keyset_query(Order.query, Order, keyset)
+
+    pages = []
+    cursor = ''
+    while True:
+        rows, pagination = cursor_page(fetch, keyset, cursor, per_page)
+        pages.append([row.id for row in rows])
+        if not pagination['has_next']:
+            break
+        cursor = pagination['next']
+
+    back = [pages[-1]]
+    while pagination['prev']:
+        rows, pagination = cursor_page(fetch, keyset, pagination['prev'], per_page)
+        back.insert(0, [row.id for row in rows])
+
+    assert back == pages
+    return [order_id for page in pages for order_id in page]
+
+def test_cursor_round_trip():
+    state = {'s': '-created_at', 'k': ['2024-01-01T12:00:00', 7], 'b': True}
+    cursor = encode_cursor(state)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == state
+
+    keyset = Keyset('selling_price', PRODUCT_SORT_COLUMNS)
+    assert keyset.decode(keyset.encode([19.99, 3])) == ([19.99, 3], False)
+    assert keyset.decode(keyset.encode([None, 3], backward=True)) == ([None, 3], True)
+    assert keyset.decode('') == (None, False)
+
+def test_sort_must_be_allowed():
+    with pytest.raises(CursorError):
+        Keyset('-customer_email', ORDER_SORT_COLUMNS)
+
+@pytest.mark.parametrize('cursor', [
+    '!!!',
+    base64.urlsafe_b64encode(b'not json').decode(),
+    encode_cursor(['-created_at', 1]),
+    encode_cursor({'s': 'id', 'k': [1]}),
+    encode_cursor({'s': '-created_at', 'k': [1]}),
+    encode_cursor({'s': '-created_at', 'k': ['2024-01-01T12:00:00', '7']}),
+    encode_cursor({'s': '-created_at', 'k': [{'a': 1}, 7]}),
+    encode_cursor({'s': '-created_at', 'k': [True, 7]}),
+])
+def test_tampered_cursors_are_rejected(cursor):
+    with pytest.raises(CursorError):
+        Keyset('-created_at', ORDER_SORT_COLUMNS).decode(cursor)
+
+@pytest.mark.parametrize('created_at', ['yesterday', 42])
+def test_cursor_with_an_invalid_timestamp_is_rejected(app, created_at):
+    add_orders([START])
+    keyset = Keyset('-created_at', ORDER_SORT_COLUMNS)
+    with pytest.raises(CursorError):
+        cursor_page(keyset_query(Order.query, Order, keyset), keyset, keyset.encode([created_at, 1]), 10)
+
+@pytest.mark.parametrize('cursor', ['!!!', encode_cursor({'s': '-created_at', 'k': ['yesterday', 1]})])
+def test_route_answers_invalid_cursors_with_400(app, cursor):
+    add_orders([START])
+    response = app.test_client().get('/api/orders', query_string={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+def test_route_pages_by_cursor(app):
+    add_orders([START + timedelta(minutes=index) for index in range(5)])
+    client = app.test_client()
+
+    first = client.get('/api/orders', query_string={'cursor': '', 'per_page': 3, 'include_total': 'true'}).get_json()
+    assert [order['order_id'] for order in first['orders']] == ['BLM-4', 'BLM-3', 'BLM-2']
+    assert first['pagination']['total'] == 5
+
+    second = client.get('/api/orders', query_string={'cursor': first['pagination']['next'], 'per_page': 3}).get_json()
+    assert [order['order_id'] for order in second['orders']] == ['BLM-1', 'BLM-0']
+    assert second['pagination']['has_next'] is False
+
+def test_ties_on_the_sort_key_are_broken_by_id(app):
+    orders = add_orders([START] * 5 + [START + timedelta(hours=1)] * 2 + [START - timedelta(hours=1)])
+    ids = [order.id for order in orders]
+
+    expected = [ids[6], ids[5], ids[4], ids[3], ids[2], ids[1], ids[0], ids[7]]
+    for per_page in (1, 2, 3, 8):
+        assert page_through('-created_at', per_page) == expected
+        assert page_through('created_at', per_page) == expected[::-1]
+
+def test_null_timestamps_sort_first_ascending_and_last_descending(app):
+    orders = add_orders([START, None, START + timedelta(hours=1), None, START])
+    ids = [order.id for order in orders]
+
+    expected = [ids[2], ids[4], ids[0], ids[3], ids[1]]
+    for per_page in (1, 2, 4):
+        assert page_through('-created_at', per_page) == expected
+        assert page_through('created_at', per_page) == expected[::-1]
+
+def test_postgrest_filter_quotes_strings():
+    keyset = Keyset('-created_at', ORDER_SORT_COLUMNS)
+    timestamp = '2024-01-01T12:00:00+00:00'
+    assert postgrest_keyset_filter(keyset, [timestamp, 5], False) == (
+        f'created_at.lt."{timestamp}",and(created_at.eq."{timestamp}",id.lt.5)'
+    )
+
+    # Reserved characters and quotes stay inside the quoted value
+    assert postgrest_keyset_filter(Keyset('-created_at', ORDER_SORT_COLUMNS), ['a,"b)', 5], False) == (
+        'created_at.lt."a,\\"b)",and(created_at.eq."a,\\"b)",id.lt.5)'
+    )
+
+def test_postgrest_filter_numbers_and_id():
+    assert postgrest_keyset_filter(Keyset('id', ORDER_SORT_COLUMNS), [5], False) == 'id.gt.5'
+    assert postgrest_keyset_filter(Keyset('id', ORDER_SORT_COLUMNS), [5], True) == 'id.lt.5'
+    assert postgrest_keyset_filter(Keyset('-selling_price', PRODUCT_SORT_COLUMNS), [19.5, 5], True) == (
+        'selling_price.gt.19.5,selling_price.is.null,and(selling_price.eq.19.5,id.gt.5)'
+    )
+
+def test_postgrest_filter_sorts_nulls_last():
+    keyset = Keyset('-created_at', ORDER_SORT_COLUMNS)
+    # Descending, NULLs come first: after a NULL key, the remaining NULLs and then every value
+    assert postgrest_keyset_filter(keyset, [None, 5], False) == (
+        'created_at.not.is.null,and(created_at.is.null,id.lt.5)'
+    )
+    # Ascending, NULLs come last: after a NULL key, only the remaining NULLs
+    assert postgrest_keyset_filter(keyset, [None, 5], True) == 'and(created_at.is.null,id.gt.5)'
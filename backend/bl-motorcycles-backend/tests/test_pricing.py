@@ -0,0 +1,121 @@
+import json
+import os
+
+import pytest
+
+from src.services.pricing import PricingEngine, PricingRules
+
+BANDS = [
+    {'up_to': 10, 'markup': 2.0},
+    {'up_to': 100, 'markup': 1.5},
+    {'up_to': None, 'markup': 1.25},
+]
+
+def make_engine(tmp_path, rules):
+    rules_file = tmp_path / 'pricing_rules.json'
+    rules_file.write_text(json.dumps(rules))
+    return PricingEngine(str(rules_file))
+
+def test_default_rules_keep_the_original_formula(tmp_path):
+    engine = PricingEngine(str(tmp_path / 'missing.json'))
+    assert engine.price(10.0) == pytest.approx(21.0)
+    assert engine.delivery_cost == 6.0
+
+@pytest.mark.parametrize('cost, markup', [
+    (0.0, 2.0),
+    (9.99, 2.0),
+    (10.0, 2.0),
+    (10.01, 1.5),
+    (100.0, 1.5),
+    (100.01, 1.25),
+    (1e9, 1.25),
+])
+def test_band_covers_costs_up_to_its_limit(cost, markup):
+    assert PricingRules({'price_bands': BANDS}).base_markup(cost) == markup
+
+def test_bands_are_sorted_and_fall_back_to_the_default_markup():
+    rules = PricingRules({'markup': 3.0, 'price_bands': [BANDS[1], BANDS[0]]})
+    assert rules.base_markup(10.0) == 2.0
+    assert rules.base_markup(50.0) == 1.5
+    assert rules.base_markup(100.01) == 3.0
+
+def test_category_markup_wins_over_the_band(tmp_path):
+    engine = make_engine(tmp_path, {
+        'delivery_cost': 0.0, 'price_bands': BANDS, 'category_markups': {'Tyres': 1.1}
+    })
+    prices = engine.price_batch([5.0, 5.0, 500.0], ['Tyres', 'Brakes', None])
+    assert list(prices) == pytest.approx([5.5, 10.0, 625.0])
+
+@pytest.mark.parametrize('price, rounded', [
+    (10.0, 10.0),
+    (10.01, 10.5),
+    (10.5, 10.5),
+    (10.51, 11.0),
+])
+def test_rounding_up_to_an_increment(tmp_path, price, rounded):
+    engine = make_engine(tmp_path, {'markup': 1.0, 'delivery_cost': 0.0, 'rounding': {'increment': 0.5}})
+    assert engine.price(price) == rounded
+
+@pytest.mark.parametrize('price, rounded', [
+    (10.0, 10.99),
+    (10.99, 10.99),
+    (11.0, 11.99),
+    (0.5, 0.99),
+])
+def test_rounding_up_to_a_price_ending(tmp_path, price, rounded):
+    engine = make_engine(tmp_path, {'markup': 1.0, 'delivery_cost': 0.0, 'rounding': {'ending': 0.99}})
+    assert engine.price(price) == rounded
+
+def test_rounding_to_an_increment_then_an_ending(tmp_path):
+    engine = make_engine(tmp_path, {
+        'markup': 1.0, 'delivery_cost': 0.0, 'rounding': {'increment': 5, 'ending': 0.95}
+    })
+    assert engine.price(11.0) == 15.95
+    assert engine.price(15.0) == 15.95
+
+@pytest.mark.parametrize('ending', [1.0, -0.01])
+def test_price_ending_must_be_a_fraction(ending):
+    with pytest.raises(ValueError):
+        PricingRules({'rounding': {'ending': ending}})
+
+def test_markups_must_be_positive():
+    with pytest.raises(ValueError):
+        PricingRules({'category_markups': {'Tyres': 0}})
+
+def test_min_margin_raises_low_markups(tmp_path):
+    engine = make_engine(tmp_path, {'markup': 1.05, 'delivery_cost': 1.0, 'min_margin': 2.0})
+    # 5% of 10 is below the 2.00 minimum margin; delivery is added after the clamp
+    assert engine.price(10.0) == pytest.approx(13.0)
+    # 5% of 100 is above it
+    assert engine.price(100.0) == pytest.approx(106.0)
+
+def test_min_margin_rate_raises_low_markups(tmp_path):
+    engine = make_engine(tmp_path, {
+        'markup': 1.05, 'delivery_cost': 0.0, 'min_margin': 2.0, 'min_margin_rate': 0.2
+    })
+    assert engine.price(100.0) == pytest.approx(120.0)
+    assert engine.price(5.0) == pytest.approx(7.0)
+
+def test_delivery_costs_column_overrides_the_rules(tmp_path):
+    engine = make_engine(tmp_path, {'markup': 2.0, 'delivery_cost': 6.0})
+    assert list(engine.price_batch([1.0, 1.0], delivery_costs=[0.0, None])) == pytest.approx([2.0, 8.0])
+
+def test_reload_if_changed_picks_up_new_rules(tmp_path):
+    engine = make_engine(tmp_path, {'markup': 2.0, 'delivery_cost': 0.0})
+    assert engine.reload_if_changed() is False
+
+    rules_file = tmp_path / 'pricing_rules.json'
+    rules_file.write_text(json.dumps({'markup': 3.0, 'delivery_cost': 0.0}))
+    # A later mtime, as a write within the same clock tick could keep the old one
+    os.utime(rules_file, (engine.rules_mtime + 1, engine.rules_mtime + 1))
+    assert engine.reload_if_changed() is True
+    assert engine.price(10.0) == pytest.approx(30.0)
+    assert engine.reload_if_changed() is False
+
+def test_invalid_rules_keep_the_current_ones(tmp_path):
+    engine = make_engine(tmp_path, {'markup': 2.0, 'delivery_cost': 0.0})
+    rules_file = tmp_path / 'pricing_rules.json'
+    rules_file.write_text(json.dumps({'markup': -1}))
+    os.utime(rules_file, (engine.rules_mtime + 1, engine.rules_mtime + 1))
+    assert engine.reload_if_changed() is False
+    assert engine.price(10.0) == pytest.approx(20.0)